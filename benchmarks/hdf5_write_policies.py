@@ -0,0 +1,126 @@
+"""
+Write/read throughput of the HDF5 write policies in `experiment_control.util.io`
+for representative experiment datasets. Run from the repository root:
+
+    $ python benchmarks/hdf5_write_policies.py
+    $ python benchmarks/hdf5_write_policies.py --policies none lzf gzip --repeat 5 --json results.json
+
+Each dataset type is written with `dump_hdf5` (full dict in one file, as in
+`collect_scan`) and read back whole with `load_hdf5`. Throughput is reported in
+MB/s of uncompressed array data, along with the on-disk compression ratio.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+
+sys.path.insert(0,os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),"..")))
+from experiment_control.util.io import dump_hdf5, load_hdf5, hdf5_write_policies
+from experiment_control.util.units import u
+
+"""
+Synthetic stand-ins for the data we actually save. Values are noisy but
+structured (smooth signals plus noise, sensor-like integer frames) so that
+compression ratios are in the right ballpark.
+"""
+def galvo_scan_channels(nx=200,ny=200,rng=None):
+    # `read_data` from `shg_microscope.collect_scan`: 4 AO + 4 AI channels of nx*ny float64 samples
+    rng = rng or np.random.default_rng(0)
+    n = nx*ny
+    t = np.arange(n)*1e-4
+    Vx = np.tile(np.concatenate((np.linspace(-1,1,nx),np.linspace(1,-1,nx))),ny//2)
+    Vy = np.repeat(np.linspace(-1,1,ny),nx)
+    ds = {'t': t*u.second}
+    for ch,V in (('Dev1/ao0',Vx/2),('Dev1/ao1',-Vx/2),('Dev1/ao2',Vy/2),('Dev1/ao3',-Vy/2)):
+        ds[ch] = V*u.volt
+    for ch in ('Dev1/ai0','Dev1/ai1','Dev1/ai2','Dev1/ai3'):
+        ds[ch] = (np.exp(-(Vx**2+Vy**2)/0.2) + 1e-3*rng.standard_normal(n))*u.volt
+    return ds
+
+def zelux_frames(n_frames=4,shape=(1080,1440),rng=None):
+    # Thorlabs Zelux CS165MU, 10-bit pixels delivered as uint16
+    rng = rng or np.random.default_rng(0)
+    y,x = np.mgrid[0:shape[0],0:shape[1]]
+    spot = 800*np.exp(-((x-shape[1]/2)**2+(y-shape[0]/2)**2)/(2*40.**2))
+    frames = np.clip(spot[None,:,:] + 60 + 8*rng.standard_normal((n_frames,)+shape),0,1023).astype(np.uint16)
+    return {'wf_img': frames}
+
+def opo_traces(n_points=1000000,n_channels=2,rng=None):
+    # long oscilloscope/DAQ traces of pulsed OPO output, float32 volts
+    rng = rng or np.random.default_rng(0)
+    t = np.arange(n_points)*1e-9
+    ds = {'t': t*u.second}
+    for ch in range(n_channels):
+        pulses = (np.sin(2*np.pi*t*80e6)>0.95).astype(np.float32)
+        ds[f'V{ch+1}'] = (pulses + 0.01*rng.standard_normal(n_points).astype(np.float32))*u.volt
+    return ds
+
+dataset_types = {
+    'galvo_scan':   galvo_scan_channels,
+    'zelux_frames': zelux_frames,
+    'opo_traces':   opo_traces,
+}
+
+def _nbytes(ds):
+    return sum(getattr(v,'m',v).nbytes for v in ds.values())
+
+@contextlib.contextmanager
+def _quiet():
+    # `dump_hdf5`/`load_hdf5` print every item they touch
+    with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def benchmark(ds,policy,tmp_dir,repeat=3):
+    nbytes = _nbytes(ds)
+    t_write, t_read, fsize = [], [], 0
+    for rr in range(repeat):
+        fpath = os.path.join(tmp_dir,f"bench_{policy}_{rr}.h5")
+        with _quiet():
+            t0 = time.perf_counter()
+            dump_hdf5(ds,fpath,open_mode='w',policy=policy)
+            t1 = time.perf_counter()
+            load_hdf5(fpath=fpath)
+            t2 = time.perf_counter()
+        t_write.append(t1-t0)
+        t_read.append(t2-t1)
+        fsize = os.path.getsize(fpath)
+        os.remove(fpath)
+    return {
+        'MB': nbytes/1e6,
+        'write_MBps': nbytes/1e6/min(t_write),
+        'read_MBps': nbytes/1e6/min(t_read),
+        'ratio': nbytes/fsize,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--policies',nargs='+',default=list(hdf5_write_policies),help="write policies to compare")
+    parser.add_argument('--datasets',nargs='+',default=list(dataset_types),choices=list(dataset_types))
+    parser.add_argument('--repeat',type=int,default=3,help="best-of-N timing")
+    parser.add_argument('--dir',default=None,help="directory for temporary files (default: system temp dir)")
+    parser.add_argument('--json',default=None,help="also save results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+        for ds_name in args.datasets:
+            ds = dataset_types[ds_name]()
+            results[ds_name] = {}
+            print(f"\n{ds_name} ({_nbytes(ds)/1e6:.1f} MB)")
+            print(f"  {'policy':<16}{'write MB/s':>12}{'read MB/s':>12}{'ratio':>8}")
+            for policy in args.policies:
+                r = benchmark(ds,policy,tmp_dir,repeat=args.repeat)
+                results[ds_name][policy] = r
+                print(f"  {policy:<16}{r['write_MBps']:>12.1f}{r['read_MBps']:>12.1f}{r['ratio']:>8.2f}")
+    if args.json:
+        with open(args.json,'w') as f:
+            json.dump(results,f,indent=2)
+    return results
+
+if __name__ == '__main__':
+    main()
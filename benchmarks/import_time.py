@@ -0,0 +1,88 @@
+"""
+Startup-time guard for the analysis-side modules of `experiment_control`.
+Imports each module in a fresh interpreter with `python -X importtime`, reports
+the cumulative import time (best of `--repeat` runs) and the slowest modules it
+pulled in, and exits with status 1 if any module is over `--budget-ms` or
+imports one of the `--forbid` modules (heavy dependencies that should only be
+loaded on first use). Run from the repository root:
+
+    $ python benchmarks/import_time.py
+    $ python benchmarks/import_time.py --budget-ms 100 experiment_control.util.io
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+repo_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+default_modules = [
+    'experiment_control.util.units',
+    'experiment_control.util.io',
+    'experiment_control.util.catalog',
+]
+default_forbid = ['instrumental','pint','h5py','numpy','scipy','matplotlib']
+
+_line_re = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+def import_times(module,python=sys.executable):
+    """
+    Run `import module` under `-X importtime` in a fresh interpreter and return
+    a list of (name, self_us, cumulative_us, depth) for every module imported.
+    """
+    proc = subprocess.run(
+        [python,'-X','importtime','-c','import ' + module],
+        cwd=repo_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if proc.returncode:
+        raise RuntimeError("importing " + module + " failed:\n" + proc.stderr[-2000:])
+    entries = []
+    for line in proc.stderr.splitlines():
+        m = _line_re.match(line)
+        if m:
+            self_us, cum_us, indent, name = m.groups()
+            entries.append((name,int(self_us),int(cum_us),len(indent)//2))
+    return entries
+
+def measure(module,repeat=5):
+    # best of `repeat` runs; the first run may include writing .pyc files
+    best = None
+    for rr in range(repeat):
+        entries = import_times(module)
+        total = [e for e in entries if e[0]==module][-1][2]
+        if best is None or total < best[0]:
+            best = (total,entries)
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules',nargs='*',default=default_modules)
+    parser.add_argument('--budget-ms',type=float,default=150.,help="maximum cumulative import time per module")
+    parser.add_argument('--forbid',nargs='*',default=default_forbid,help="modules that must not be imported eagerly")
+    parser.add_argument('--repeat',type=int,default=5)
+    parser.add_argument('--top',type=int,default=5,help="number of slowest imported modules to list")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module in args.modules:
+        total_us, entries = measure(module,repeat=args.repeat)
+        over = total_us*1e-3 > args.budget_ms
+        imported = set(e[0] for e in entries)
+        forbidden = [ff for ff in args.forbid if ff in imported]
+        status = "FAIL" if (over or forbidden) else "ok"
+        print(f"{status:<5}{module:<40}{total_us*1e-3:>8.1f} ms  (budget {args.budget_ms:.0f} ms)")
+        slowest = sorted([e for e in entries if e[0]!=module],key=lambda e: -e[2])[:args.top]
+        for name, self_us, cum_us, depth in slowest:
+            print(f"       {name:<45}{cum_us*1e-3:>8.1f} ms")
+        if forbidden:
+            print("       eagerly imports: " + ", ".join(forbidden))
+        failed = failed or over or bool(forbidden)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
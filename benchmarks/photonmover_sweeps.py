@@ -0,0 +1,320 @@
+"""
+Throughput of the photonmover measurement routines (`perform_tx_measurement_MPM200`,
+`perform_tx_measurement_daq`, `perform_tx_bias_measurement`, `perform_iv_measurement`
+and `retrieve_vna_trace` of `new_GPIB_manager.GPIBManager`), run headless against
+the latency-modelled instruments of `instruments.Simulated`. Run from the
+repository root:
+
+    $ python benchmarks/photonmover_sweeps.py
+    $ python benchmarks/photonmover_sweeps.py --routines tx_mpm200 iv --points 1001 --repeat 5 --json results.json
+
+Each routine runs on a fresh GPIBManager, with the default setup of
+`connect_instruments` (the DAQ sweep uses the HP lightwave as laser and power
+meter, as that path requires) and the instruments initialized as the GUI does.
+The wall time of the routine is split into phases by the instrument method or
+bus transfer it is spent in:
+
+    configure     cfg_*/configure_*/set_*/turn_* methods, and commands sent outside them
+    acquire       start_*/wait_*/stop_* methods, and waiting for an instrument to answer
+    transfer      reading logged data/traces back (get_logged_data, read_data...), and bus reads
+    save          io.savemat and the VNA's csv writer
+    post_process  everything else: the routine's own python code and the drivers' parsing
+
+Times are best of `--repeat` runs; the peak memory (tracemalloc) is taken from
+one more run, since tracing slows the python parts down. The 1 s completion
+beep of the routines is skipped.
+
+Requirements: numpy, scipy (the routines save with scipy.io.savemat) and
+matplotlib (imported by new_GPIB_manager and several drivers). The GUI and the
+hardware-only packages are not needed: wx only has to be importable for the
+event classes, and winsound, nidaqmx (NI DAQ) and pyserial (serial instruments)
+are only used by the real instruments, so stand-ins are used for any of them
+that is not installed.
+Everything runs in real time: the simulated instruments take as long as the
+real ones, and the drivers' own sleeps are not shortened.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import types
+import argparse
+import platform
+import tempfile
+import functools
+import contextlib
+import subprocess
+import tracemalloc
+
+repo_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+photonmover_dir = os.path.join(repo_dir,"experiment_control","428hub","photonmover")
+sys.path.insert(0,photonmover_dir)
+
+PHASES = ('configure','acquire','transfer','post_process','save')
+
+# Phase of the driver methods, by name (first match)
+driver_phases = [
+    (re.compile(r'(cfg|configure|set|turn)_\w+'),'configure'),
+    (re.compile(r'(start|wait|stop)_\w+|take_data'),'acquire'),
+    (re.compile(r'get_logged_data|get_power_offsets|get_frequencies|read_data|read_trace'),'transfer'),
+]
+# Phase of the bus traffic of the simulated sessions, when it is not inside one of the methods above
+session_phases = {'write':'configure','read_chunk':'transfer','_next_response':'acquire'}
+
+"""
+Headless import of new_GPIB_manager
+"""
+def _import_manager():
+    os.environ.setdefault('MPLBACKEND','Agg')
+    try:
+        import wx
+    except ImportError:
+        # Only the event classes are defined at import time; the routines never post events
+        wx = types.ModuleType('wx')
+        wx.PyEvent = type('PyEvent',(object,),{'__init__': lambda self: None,'SetEventType': lambda self,t: None})
+        sys.modules['wx'] = wx
+    # Only imported by the drivers of the real instruments; the simulated ones do not use them
+    for module in ('winsound','nidaqmx','serial'):
+        try:
+            __import__(module)
+        except ImportError:
+            sys.modules[module] = types.ModuleType(module)
+    import new_GPIB_manager
+    new_GPIB_manager.winsound = types.SimpleNamespace(Beep=lambda frequency,duration: None)
+    return new_GPIB_manager
+
+@contextlib.contextmanager
+def _quiet():
+    # The routines and the drivers print every step
+    with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def _commit():
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],cwd=repo_dir,stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL,universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+class PhaseTimer:
+    """
+    Splits wall time into PHASES. Time goes to the innermost active phase, and
+    to post_process outside of any. Session phases are weak: inside a driver
+    method with a phase of its own, the bus traffic counts as that phase.
+    """
+    def __init__(self):
+        self.totals = dict.fromkeys(PHASES,0.)
+        self._stack = []  # (phase, strong)
+        self._t = None
+
+    def start(self):
+        self.totals = dict.fromkeys(PHASES,0.)
+        self._t = time.perf_counter()
+
+    def stop(self):
+        self._tick()
+        self._t = None
+        return dict(self.totals)
+
+    def _tick(self):
+        if self._t is None:
+            return
+        now = time.perf_counter()
+        self.totals[self._stack[-1][0] if self._stack else 'post_process'] += now-self._t
+        self._t = now
+
+    def wrap(self,func,phase,weak=False):
+        @functools.wraps(func)
+        def timed(*args,**kwargs):
+            self._tick()
+            if weak and self._stack and self._stack[-1][1]:
+                self._stack.append(self._stack[-1])
+            else:
+                self._stack.append((phase,not weak))
+            try:
+                return func(*args,**kwargs)
+            finally:
+                self._tick()
+                self._stack.pop()
+        return timed
+
+def instrument(timer,instruments):
+    """
+    Wraps the methods of the drivers, and the sessions they opened, to time their phases.
+    Returns the simulated sessions.
+    """
+    from instruments.Simulated.session import SimSession
+    sessions, seen = [], set()
+    for instr in instruments:
+        if instr is None or id(instr) in seen:
+            continue
+        seen.add(id(instr))
+        for name in dir(type(instr)):
+            if name.startswith('_'):
+                continue
+            for pattern,phase in driver_phases:
+                if pattern.fullmatch(name) and callable(getattr(instr,name)):
+                    setattr(instr,name,timer.wrap(getattr(instr,name),phase))
+                    break
+        for value in list(vars(instr).values()):
+            if isinstance(value,SimSession) and value not in sessions:
+                for name,phase in session_phases.items():
+                    setattr(value,name,timer.wrap(getattr(value,name),phase,weak=True))
+                sessions.append(value)
+    return sessions
+
+class _Frame:
+    # The settings the routines read from the GUI window
+    def __init__(self,args):
+        self.start_meas_wl = args.start
+        self.stop_meas_wl = args.stop
+        self.num_meas_wl = args.points-1  # The sweeps take num_meas_wl+1 points
+        self.start_meas_v = args.start_v
+        self.stop_meas_v = args.stop_v
+        self.num_meas_v = args.biases
+        self.pd_bias = 0.
+        self.pd_bias_2 = 0.
+        self.power = 1.
+        self.cal_set = "NONE"
+
+"""
+Routines. Each one sets up the manager and returns (routine, number of points).
+"""
+def tx_mpm200(nm,gm,args):
+    gm.sweep_daq_acq = False
+    return (lambda: gm.perform_tx_measurement_MPM200(save_data=True,plot=False)), args.points
+
+def tx_daq(nm,gm,args):
+    from instruments.Light_sources.HPLightWave import HPLightWave
+    gm.light_source = gm.power_meter = HPLightWave(tap_channel=nm.TAP_CHANNEL,rec_channel=nm.REC_CHANNEL)
+    gm.using_HP, gm.using_MPM200, gm.sweep_daq_acq = True, False, True
+    return (lambda: gm.perform_tx_measurement_daq(save_data=True,plot=False)), args.points
+
+def tx_bias(nm,gm,args):
+    gm.sweep_daq_acq = False
+    return (lambda: gm.perform_tx_bias_measurement(save_data=True,plot=False)), args.biases*args.points
+
+def iv(nm,gm,args):
+    gm.parent.num_meas_v = args.iv_points
+    return (lambda: gm.perform_iv_measurement(save_data=True,plot=False)), args.iv_points
+
+def vna(nm,gm,args):
+    return (lambda: gm.retrieve_vna_trace(save_data=True,plot=False)), args.vna_points
+
+routines = {
+    'tx_mpm200': tx_mpm200,
+    'tx_daq':    tx_daq,
+    'tx_bias':   tx_bias,
+    'iv':        iv,
+    'vna':       vna,
+}
+
+def benchmark(nm,name,args,tmp_dir):
+    from instruments import visa_pool
+    from instruments.Simulated.bench import SimBench
+    from instruments.Simulated.sim_daq import SimNiDAQ
+    from instruments.Simulated.simulation import enable_simulation, disable_simulation
+    from instruments.Power_meters.SantecMPM200 import SantecMPM200
+
+    bench = enable_simulation(SimBench(seed=0))
+    timer = PhaseTimer()
+    io_module = nm.io
+    try:
+        with _quiet():
+            gm = nm.GPIBManager(_Frame(args),None)
+            gm.ni_daq = SimNiDAQ(bench)
+            gm.user_file_path = os.path.join(tmp_dir,name)
+            gm.power_range = -10
+            routine, points = routines[name](nm,gm,args)
+            if isinstance(gm.power_meter,SantecMPM200):
+                gm.power_meter.offset_cache_file = None  # Keep the simulated tables out of the real cache
+            gm.initialize_instruments()
+            gm.light_source.turn_on()
+            if name == 'vna':
+                gm.vna.set_frequency_range(args.vna_start,args.vna_stop,args.vna_points)
+                gm.vna.take_data(1)
+
+        sessions = instrument(timer,[gm.light_source,gm.power_meter,gm.source_meter,gm.vna,gm.ni_daq])
+        nm.io = types.SimpleNamespace(savemat=timer.wrap(io_module.savemat,'save'))
+        vna_module = sys.modules[type(gm.vna).__module__]
+        vna_csv = vna_module.csv
+        vna_module.csv = types.SimpleNamespace(writer=lambda *a,**k: _timed_writer(timer,vna_csv.writer(*a,**k)))
+
+        traffic = sum(s.stats['bytes_written']+s.stats['bytes_read'] for s in sessions)
+        runs = []
+        try:
+            with _quiet():
+                for rr in range(args.repeat):
+                    t0 = time.perf_counter()
+                    timer.start()
+                    routine()
+                    phases = timer.stop()
+                    runs.append((time.perf_counter()-t0,phases))
+                tracemalloc.start()
+                routine()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            vna_module.csv = vna_csv
+    finally:
+        nm.io = io_module
+        visa_pool.close_all()
+        disable_simulation()
+
+    total, phases = min(runs,key=lambda r: r[0])
+    return {
+        'points': points,
+        'time_s': total,
+        'points_per_s': points/total,
+        'phases_s': phases,
+        'peak_memory_MB': peak/1e6,
+        'bus_bytes': (sum(s.stats['bytes_written']+s.stats['bytes_read'] for s in sessions)-traffic)//(args.repeat+1),
+        'instrument_errors': [e for s in sessions for e in s.errors],
+    }
+
+def _timed_writer(timer,writer):
+    return types.SimpleNamespace(writerow=timer.wrap(writer.writerow,'save'),
+                                 writerows=timer.wrap(writer.writerows,'save'))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routines',nargs='+',default=list(routines),choices=list(routines))
+    parser.add_argument('--start',type=float,default=1549.,help="start wavelength of the sweeps (nm)")
+    parser.add_argument('--stop',type=float,default=1552.,help="stop wavelength of the sweeps (nm)")
+    parser.add_argument('--points',type=int,default=301,help="wavelengths per sweep")
+    parser.add_argument('--start-v',type=float,default=-1.,help="first bias of tx_bias and iv (V)")
+    parser.add_argument('--stop-v',type=float,default=0.5,help="last bias of tx_bias and iv (V)")
+    parser.add_argument('--biases',type=int,default=3,help="sweeps of tx_bias")
+    parser.add_argument('--iv-points',type=int,default=101,help="points of the IV curve")
+    parser.add_argument('--vna-start',type=float,default=1e9,help="start frequency of the VNA trace (Hz)")
+    parser.add_argument('--vna-stop',type=float,default=20e9,help="stop frequency of the VNA trace (Hz)")
+    parser.add_argument('--vna-points',type=int,default=401,help="points of the VNA trace")
+    parser.add_argument('--repeat',type=int,default=3,help="best-of-N timing")
+    parser.add_argument('--dir',default=None,help="directory for the saved data (default: system temp dir)")
+    parser.add_argument('--json',default=None,help="also save results to this JSON file")
+    args = parser.parse_args(argv)
+
+    with _quiet():
+        nm = _import_manager()
+
+    results = {}
+    print(f"  {'routine':<12}{'points':>8}{'time s':>9}{'points/s':>10}"
+          + ''.join(f"{p:>14}" for p in PHASES) + f"{'peak MB':>9}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+        for name in args.routines:
+            r = benchmark(nm,name,args,tmp_dir)
+            results[name] = r
+            print(f"  {name:<12}{r['points']:>8}{r['time_s']:>9.2f}{r['points_per_s']:>10.1f}"
+                  + ''.join(f"{r['phases_s'][p]:>14.3f}" for p in PHASES) + f"{r['peak_memory_MB']:>9.2f}")
+            if r['instrument_errors']:
+                print(f"    instrument errors: {r['instrument_errors']}")
+    if args.json:
+        with open(args.json,'w') as f:
+            json.dump({'commit': _commit(),'python': platform.python_version(),'settings': vars(args),
+                       'results': results},f,indent=2)
+    return results
+
+if __name__ == '__main__':
+    main()
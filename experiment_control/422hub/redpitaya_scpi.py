@@ -47,28 +47,37 @@ class scpi (object):
                 break
         return msg[:-2]
 
-    def rx_arb(self):
-        numOfBytes = 0
-        """ Recieve binary data from scpi server"""
-        str=''
-        while (len(str) != 1):
-            str = (self._socket.recv(1))
-        if not (str == '#'):
+    def _rx_exact(self, n):
+        """Receive exactly n bytes."""
+        buf = bytearray(n)
+        view = memoryview(buf)
+        pos = 0
+        while pos < n:
+            nbytes = self._socket.recv_into(view[pos:], n - pos)
+            if nbytes == 0:
+                raise ConnectionError('SCPI >> connection closed after {:d} of {:d} bytes'.format(pos, n))
+            pos += nbytes
+        return buf
+
+    def rx_arb(self, dtype=None):
+        """Receive binary data (an IEEE 488.2 #<n><length><data> block) from scpi server.
+        The data is received straight into a preallocated buffer.
+        Returns it as a bytearray, or as a numpy array viewing the buffer if a
+        dtype (e.g. '>f4' for ACQ:DATA:FORMAT BIN) is given.
+        """
+        if self._rx_exact(1) != b'#':
             return False
-        str=''
-        while (len(str) != 1):
-            str = (self._socket.recv(1))
-        numOfNumBytes = int(str)
+        numOfNumBytes = int(self._rx_exact(1))
         if not (numOfNumBytes > 0):
             return False
-        str=''
-        while (len(str) != numOfNumBytes):
-            str += (self._socket.recv(1))
-        numOfBytes = int(str)
-        str=''
-        while (len(str) != numOfBytes):
-            str += (self._socket.recv(1))
-        return str
+        numOfBytes = int(self._rx_exact(numOfNumBytes))
+
+        buf = self._rx_exact(numOfBytes)
+
+        if dtype is None:
+            return buf
+        import numpy as np
+        return np.frombuffer(buf, dtype=dtype)
 
     def tx_txt(self, msg):
         """Send text string ending and append delimiter."""
@@ -2,11 +2,66 @@
 
 from abc import ABC, abstractmethod
 # ABC means Abstract Base Class and is basically an interface
+from contextlib import contextmanager
+from functools import wraps
+
+MAX_BATCH_LENGTH = 200  # Default maximum length (in characters) of a batched message
+RESET_COMMANDS = ('*RST',)  # Commands after which the instrument settings are unknown
+
+
+def cached_setting(num_key_args=0):
+    """
+    Decorator for setter methods of idempotent settings (wavelength, range, integration
+    time, compliance...). When the state cache of the instrument is enabled, a call with
+    the same value as the last successful one is skipped.
+    :param num_key_args: number of leading arguments that select which setting is changed
+            (e.g. the channel in set_range(channel, power_range)) rather than its value
+    """
+
+    def decorator(setter):
+
+        @wraps(setter)
+        def wrapper(self, *args, **kwargs):
+            if self._state_cache is None:
+                return setter(self, *args, **kwargs)
+
+            key = (setter.__name__,) + args[:num_key_args]
+            value = args[num_key_args:] + tuple(sorted(kwargs.items()))
+
+            if key in self._state_cache and self._state_cache[key] == value:
+                self._cache_stats['saved'] += 1
+                return None
+
+            self._cache_stats['sent'] += 1
+            try:
+                result = setter(self, *args, **kwargs)
+            except BaseException:
+                # We don't know what the instrument ended up with
+                self.invalidate_cache(setter.__name__)
+                raise
+
+            self._state_cache[key] = value
+            return result
+
+        return wrapper
+
+    return decorator
+
 
 class Instrument(ABC):
 
+    # Headers (upper case, without the leading ':') of the commands that can be
+    # joined with others in a single message. Only commands that do not need a
+    # delay or a response before the next one is sent should be listed here.
+    # Each driver lists its own; by default nothing is batched.
+    BATCH_SAFE = ()
+    MAX_BATCH_LENGTH = MAX_BATCH_LENGTH
+
     def __init__(self):
         super().__init__()
+        self._batch = None  # Commands waiting to be sent while batching
+        self._state_cache = None  # Last values of the cached settings, None if disabled
+        self._cache_stats = {'sent': 0, 'saved': 0, 'invalidations': 0}
 
     @abstractmethod
     def initialize(self):
@@ -22,4 +77,167 @@ class Instrument(ABC):
         Closes the instrument
         :return:
         """
-        pass
\ No newline at end of file
+        pass
+
+    def enable_state_cache(self, enable=True):
+        """
+        Turns on (or off) the write-through cache of settings, so that setters
+        decorated with cached_setting do not resend the value the instrument already
+        has. Only use it if nothing else (front panel, other programs) changes the settings.
+        :param enable: True to enable the cache, False to disable it
+        :return:
+        """
+        self._state_cache = {} if enable else None
+
+    def invalidate_cache(self, setting=None):
+        """
+        Forgets the cached values, so that the next call of the setters is sent.
+        Call it after anything that changes the settings behind the setters' back
+        (sweeps, resets, scripts, errors).
+        :param setting: name of the setter to forget, or None to forget all of them
+        :return:
+        """
+        if not self._state_cache:
+            return
+
+        self._cache_stats['invalidations'] += 1
+        if setting is None:
+            self._state_cache.clear()
+        else:
+            for key in [k for k in self._state_cache if k[0] == setting]:
+                del self._state_cache[key]
+
+    def cache_stats(self):
+        """
+        Returns how many calls to cached setters were sent to the instrument and
+        how many were skipped because the value was already set
+        :return: dictionary with the 'sent', 'saved' and 'invalidations' counts
+        """
+        return dict(self._cache_stats)
+
+    def batch_resource(self):
+        """
+        Returns the VISA resource that batched commands are sent to. Drivers that
+        do not store it in self.gpib have to override this.
+        :return: the open pyvisa resource
+        """
+        return self.gpib
+
+    def is_batch_safe(self, command):
+        """
+        Checks if a command can be joined with others in a single message
+        :param command: the command string
+        :return: True if its header is in BATCH_SAFE
+        """
+        header = command.strip().lstrip(':').split(' ')[0].upper()
+        return any(header.startswith(safe) for safe in self.BATCH_SAFE)
+
+    @contextmanager
+    def batch(self):
+        """
+        Context in which the commands written with self.write are deferred and
+        sent in as few messages as possible when the context exits (or before any
+        command that is not batch safe, and before any query). Batches can be nested;
+        only the outermost one sends the commands. If an exception is raised inside
+        the context, the pending commands are discarded.
+        """
+        if self._batch is not None:
+            yield self
+            return
+
+        self._batch = []
+        try:
+            yield self
+        except BaseException:
+            self._batch = None
+            raise
+        self.flush()
+        self._batch = None
+
+    def flush(self):
+        """
+        Sends the batched commands that are still pending
+        :return:
+        """
+        if not self._batch:
+            return
+
+        pending = self._batch
+        self._batch = []
+        for message in self.join_commands(pending):
+            self.batch_resource().write(message)
+
+    def join_commands(self, commands):
+        """
+        Joins commands with ';' in messages no longer than MAX_BATCH_LENGTH. Every
+        command but the first of each message is prefixed with ':' (unless it is a
+        common '*' command) so that it is parsed from the root of the SCPI tree.
+        :param commands: list of command strings
+        :return: list of messages
+        """
+        messages = []
+        current = ''
+
+        for command in commands:
+            command = command.strip()
+            if current and not command.startswith((':', '*')):
+                command = ':' + command
+
+            if current and len(current) + 1 + len(command) > self.MAX_BATCH_LENGTH:
+                messages.append(current)
+                current = command
+            elif current:
+                current = current + ';' + command
+            else:
+                current = command
+
+        if current:
+            messages.append(current)
+
+        return messages
+
+    def write(self, command):
+        """
+        Writes a command to the instrument. Inside a batch context, batch safe
+        commands are deferred and the rest are sent after the pending ones.
+        A reset clears the state cache.
+        :param command: the command string
+        :return:
+        """
+        if command.strip().upper() in RESET_COMMANDS:
+            self.invalidate_cache()
+
+        if self._batch is not None and self.is_batch_safe(command):
+            self._batch.append(command)
+            return
+
+        self.flush()
+        self.batch_resource().write(command)
+
+    def query(self, command):
+        """
+        Sends the pending batched commands and then the query
+        :param command: the query string
+        :return: the response string
+        """
+        self.flush()
+        return self.batch_resource().query(command)
+
+    def query_many(self, queries):
+        """
+        Sends several queries in as few messages as possible and returns their responses
+        :param queries: list of query strings
+        :return: list with the response string to each query
+        """
+        self.flush()
+
+        responses = []
+        for message in self.join_commands(queries):
+            num_queries = message.count('?')
+            response = self.batch_resource().query(message).strip().split(';')
+            if len(response) != num_queries:
+                raise ValueError('Expected %d responses to "%s" but got %d' %
+                                 (num_queries, message, len(response)))
+            responses.extend(r.strip() for r in response)
+
+        return responses
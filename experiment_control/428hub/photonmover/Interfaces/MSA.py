@@ -2,7 +2,7 @@ from abc import ABC, abstractmethod
 # ABC means Abstract Base Class and is basically an interface
 
 
-classMSA(ABC):
+class MSA(ABC):
 
     def __init__(self):
         super().__init__()
@@ -4,6 +4,8 @@
 from abc import ABC, abstractmethod
 # ABC means Abstract Base Class and is basically an interface
 
+POWER_LINE_FREQ = 60  # Hz, to convert integration times given in power line cycles to seconds
+
 
 class SourceMeter(ABC):
 
@@ -63,4 +65,26 @@ class SourceMeter(ABC):
         :return: A two column matrix, where the first column is voltage
         and the second is current
         """
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    def hardware_sweep(self, start, stop, n, nplc=1, delay=0):
+        """
+        Takes an IV curve with a voltage sweep sequenced by the instrument itself,
+        reading all the data back at the end instead of point by point
+        :param start: start voltage (V)
+        :param stop: stop voltage (V)
+        :param n: number of points
+        :param nplc: integration time of each measurement, in power line cycles
+        :param delay: time between setting each voltage and measuring (s)
+        :return: A two column matrix, where the first column is voltage
+        and the second is current
+        """
+        pass
+
+    def sweep_duration(self, n, nplc=1, delay=0):
+        """
+        Rough estimate of how long a hardware sweep takes, to set communication timeouts
+        :return: The duration in s
+        """
+        return n * (float(nplc) / POWER_LINE_FREQ + delay + 1e-3)
@@ -0,0 +1,218 @@
+import os
+import time
+import pickle
+from collections import OrderedDict
+import numpy as np
+
+# Tap calibration of the optical path: the real splitting ratio of the tap as a
+# function of wavelength (the factor the tap power has to be divided by to get
+# the power going into the device).
+#
+# A Calibration holds the measured factors and their wavelengths, and
+# interpolates them at any wavelength or array of wavelengths in one call, so
+# whole sweeps are calibrated at once. Calibrations are loaded once and kept in
+# a CalibrationCache, so switching between calibration sets does not read the
+# files again (unless they have been modified since).
+#
+# Supported files:
+#   .pickle  list of factors, as saved by GPIBManager.perform_calibration. The
+#            wavelengths are not in the file: they are a linear grid that has to be given.
+#   .npy     array with two rows, wavelengths (nm) and factors.
+#   .h5      datasets 'wavelength' and 'factor'. The attributes are kept as metadata.
+#            Needs h5py.
+
+INTERPOLATIONS = ['nearest', 'linear', 'spline']
+
+# Wavelength grid (nm) of the .pickle calibrations (GPIBManager start_cal_wav, stop_cal_wav, num_cal_wavs)
+PICKLE_START_WAV = 1520.0
+PICKLE_STOP_WAV = 1580.0
+PICKLE_NUM_WAVS = 70
+
+DEFAULT_CACHE_SIZE = 4  # Calibration sets kept in memory
+
+
+class Calibration:
+
+    def __init__(self, wavelengths, factors, kind='nearest', metadata=None):
+        """
+        :param wavelengths: array with the calibrated wavelengths (nm), in increasing order
+        :param factors: array with the calibration factor at each wavelength
+        :param kind: default interpolation, 'nearest', 'linear' or 'spline'
+        :param metadata: dictionary with information about the calibration (file, date...)
+        """
+        if kind not in INTERPOLATIONS:
+            raise ValueError('Unknown interpolation %s. Use one of %s' % (kind, INTERPOLATIONS))
+
+        # Own copies, not views of the caller's arrays
+        self.wavelengths = np.array(wavelengths, dtype=float)
+        self.factors = np.array(factors, dtype=float)
+        if self.wavelengths.shape != self.factors.shape or self.wavelengths.ndim != 1:
+            raise ValueError('The calibration needs one factor per wavelength')
+        if np.any(np.diff(self.wavelengths) < 0):
+            order = np.argsort(self.wavelengths)
+            self.wavelengths, self.factors = self.wavelengths[order], self.factors[order]
+
+        self.kind = kind
+        self.metadata = dict(metadata or {})
+        self.metadata['valid_range'] = (float(self.wavelengths[0]), float(self.wavelengths[-1]))
+        self._spline = None
+
+    @property
+    def valid_range(self):
+        """
+        :return: (first, last) calibrated wavelength (nm). The factors outside are those of the end points.
+        """
+        return self.metadata['valid_range']
+
+    def in_range(self, wavelengths):
+        """
+        :param wavelengths: wavelength or array of wavelengths (nm)
+        :return: boolean (or array of booleans) indicating if they are inside the calibrated range
+        """
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        return (wavelengths >= self.valid_range[0]) & (wavelengths <= self.valid_range[1])
+
+    def __call__(self, wavelengths, kind=None):
+        """
+        Calibration factors at the given wavelengths
+        :param wavelengths: wavelength or array of wavelengths (nm)
+        :param kind: interpolation, 'nearest', 'linear' or 'spline'. If None, the default of the calibration.
+        :return: the factor, or an array of factors with the shape of wavelengths
+        """
+        kind = kind or self.kind
+        wavelengths = np.clip(np.asarray(wavelengths, dtype=float), *self.valid_range)
+
+        if len(self.wavelengths) == 1:
+            return self.factors[0] * np.ones_like(wavelengths)
+
+        if kind == 'nearest':
+            index = np.clip(np.searchsorted(self.wavelengths, wavelengths), 1, len(self.wavelengths) - 1)
+            left = wavelengths - self.wavelengths[index - 1] <= self.wavelengths[index] - wavelengths
+            return self.factors[index - left]
+        elif kind == 'linear':
+            return np.interp(wavelengths, self.wavelengths, self.factors)
+        elif kind == 'spline':
+            if self._spline is None:
+                from scipy.interpolate import CubicSpline
+                self._spline = CubicSpline(self.wavelengths, self.factors)
+            return self._spline(wavelengths)[()]
+        else:
+            raise ValueError('Unknown interpolation %s. Use one of %s' % (kind, INTERPOLATIONS))
+
+    def save(self, file):
+        """
+        Saves the calibration as .npy (wavelengths and factors) or .h5 (with the metadata)
+        :param file: path of the file
+        :return:
+        """
+        if _extension(file) in ['.h5', '.hdf5']:
+            import h5py
+            with h5py.File(file, 'w') as f:
+                f['wavelength'] = self.wavelengths
+                f['factor'] = self.factors
+                for key, value in self.metadata.items():
+                    if key not in ['file', 'valid_range']:
+                        f.attrs[key] = value
+        else:
+            np.save(file, np.array([self.wavelengths, self.factors]))
+
+
+def load_calibration(file, kind='nearest', start_wav=PICKLE_START_WAV, stop_wav=PICKLE_STOP_WAV):
+    """
+    Loads a calibration file
+    :param file: path of the .pickle, .npy or .h5 file
+    :param kind: default interpolation of the calibration
+    :param start_wav: first wavelength of the calibration, for .pickle files (nm)
+    :param stop_wav: last wavelength of the calibration, for .pickle files (nm)
+    :return: the Calibration
+    """
+    extension = _extension(file)
+    metadata = {'file': file, 'loaded': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+    if extension == '.npy':
+        data = np.load(file)
+        wavelengths, factors = data[0], data[1]
+    elif extension in ['.h5', '.hdf5']:
+        import h5py
+        with h5py.File(file, 'r') as f:
+            wavelengths, factors = f['wavelength'][()], f['factor'][()]
+            metadata.update(f.attrs)
+    else:
+        with open(file, 'rb') as f:
+            try:
+                factors = pickle.load(f)
+            except UnicodeDecodeError:
+                # Saved with python 2
+                f.seek(0)
+                factors = pickle.load(f, encoding='latin1')
+        wavelengths = np.linspace(start_wav, stop_wav, len(factors))
+
+    return Calibration(wavelengths, factors, kind=kind, metadata=metadata)
+
+
+class CalibrationCache:
+    """
+    The most recently used calibrations, by file. A file modified after it was
+    cached (e.g. re-measured by another session) is loaded again.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, kind='nearest'):
+        """
+        :param max_size: number of calibrations kept. The least recently used one is dropped.
+        :param kind: default interpolation of the loaded calibrations
+        """
+        self.max_size = max_size
+        self.kind = kind
+        self._calibrations = OrderedDict()
+
+    def get(self, file):
+        """
+        Returns the calibration of a file, only loading it if it is not in the cache
+        :param file: path of the calibration file
+        :return: the Calibration
+        """
+        key = os.path.abspath(file)
+        if key in self._calibrations:
+            mtime, calibration = self._calibrations[key]
+            if mtime == _mtime(file):
+                self._calibrations.move_to_end(key)
+                return calibration
+
+        calibration = load_calibration(file, kind=self.kind)
+        self.put(file, calibration)
+        return calibration
+
+    def put(self, file, calibration):
+        """
+        Adds (or replaces) the calibration of a file, e.g. after measuring and saving it.
+        It is kept until the file is modified again.
+        :param file: path of the calibration file
+        :param calibration: the Calibration
+        :return:
+        """
+        key = os.path.abspath(file)
+        self._calibrations[key] = (_mtime(file), calibration)
+        self._calibrations.move_to_end(key)
+        while len(self._calibrations) > self.max_size:
+            self._calibrations.popitem(last=False)
+
+    def __contains__(self, file):
+        return os.path.abspath(file) in self._calibrations
+
+    def __len__(self):
+        return len(self._calibrations)
+
+    def clear(self):
+        self._calibrations.clear()
+
+
+def _extension(file):
+    return os.path.splitext(file)[1].lower()
+
+
+def _mtime(file):
+    # Modification time of the file, None if it does not exist
+    try:
+        return os.path.getmtime(file)
+    except OSError:
+        return None
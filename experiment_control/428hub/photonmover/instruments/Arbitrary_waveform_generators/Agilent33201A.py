@@ -1,6 +1,6 @@
 import sys
 sys.path.insert(0, '../..')
-import visa
+from instruments.visa_pool import open_resource, close_resource
 from Interfaces.WaveformGenerator import WaveformGenerator
 from Interfaces.Instrument import Instrument
 
@@ -27,9 +27,8 @@ class Agilent33201A(Instrument, WaveformGenerator):
         """
         print('Opening connnection to Agilent Waveform Generator')
 
-        rm = visa.ResourceManager()
         try:
-            self.gpib = rm.open_resource(GPIB_ADDR, timeout=5000)
+            self.gpib = open_resource(GPIB_ADDR, timeout=5000)
         except:
             raise ValueError('Cannot connect to the Keysight Source meter')
 
@@ -40,7 +39,7 @@ class Agilent33201A(Instrument, WaveformGenerator):
 
     def close(self):
         print('Disconnecting Agilent Waveform Generator')
-        self.gpib.close()
+        close_resource(self.gpib)
 
     def set_waveform(self, shape, freq, vpp, offset):
         """
@@ -1,6 +1,6 @@
 import sys
 sys.path.insert(0, '../..')
-import visa
+from instruments.visa_pool import open_resource, close_resource
 from Interfaces.WaveformGenerator import WaveformGenerator
 from Interfaces.Instrument import Instrument
 import numpy as np
@@ -28,9 +28,8 @@ class Agilent81180A(Instrument, WaveformGenerator):
         """
         print('Opening connnection to Agilent Waveform Generator')
 
-        rm = visa.ResourceManager()
         try:
-            self.gpib = rm.open_resource(GPIB_ADDR, timeout=5000)
+            self.gpib = open_resource(GPIB_ADDR, timeout=5000)
             self.select_channel(self.channel)
         except:
             raise ValueError('Cannot connect to Agilent Waveform Generator')
@@ -146,7 +145,7 @@ class Agilent81180A(Instrument, WaveformGenerator):
 
     def close(self):
         print('Disconnecting Agilent Waveform Generator')
-        self.gpib.close()
+        close_resource(self.gpib)
 
     def set_waveform(self, shape, freq, vpp, offset):
         """
@@ -1,7 +1,7 @@
 import sys
 sys.path.insert(0,'../..')
 import numpy as np
-import visa
+from instruments.visa_pool import open_resource, close_resource
 import time
 from Interfaces.ElectricalAttenuator import ElectricalAttenuator
 from Interfaces.Instrument import Instrument
@@ -37,15 +37,14 @@ class HP11713A(Instrument, ElectricalAttenuator):
         """
         print('Opening connnection to HP electrical attenuator')
 
-        rm = visa.ResourceManager()
         try:
-            self.gpib = rm.open_resource(GPIB_ADDR, timeout=5000)
+            self.gpib = open_resource(GPIB_ADDR, timeout=5000)
         except:
             raise ValueError('Cannot connect to the HP variable electrical attenuator')
 
     def close(self):
         print('Disconnecting HP variable electrical attenuator')
-        self.gpib.close()
+        close_resource(self.gpib)
 
     def set_attenuation(self, attenuation):
 
@@ -1,10 +1,12 @@
 import sys
 sys.path.insert(0,'../..')
-import visa
+import numpy as np
+from instruments.visa_pool import open_resource, close_resource
 import time
 from Interfaces.LightSource import LightSource
-from Interfaces.Instrument import Instrument
+from Interfaces.Instrument import Instrument, cached_setting
 from Interfaces.PowMeter import PowerMeter
+from instruments.binblock import query_visa_block
 import matplotlib.pyplot as plt
 
 # The HP Lightwave is particular because it is both a laser and a
@@ -12,10 +14,18 @@ import matplotlib.pyplot as plt
 
 HP_ADDR = "GPIB1::20::INSTR"
 DEFAULT_INTEGRATION_TIME = 0.05
+DEFAULT_SWEEP_SPEED = 5  # nm/s
+SWEEP_AVERAGING_FRACTION = 0.8  # Fraction of the time between triggers used to average each power point
+SWEEP_POLL_INTERVAL = 0.1  # s between sweep status queries
+SWEEP_TIMEOUT_MARGIN = 10  # s on top of the sweep time to wait for the logs
+SWEEP_DTYPE = np.dtype([('wavelength', float), ('rec_power', float), ('tap_power', float)])
 
 
 class HPLightWave(Instrument, LightSource, PowerMeter):
 
+    # Laser, trigger and sensor settings can be sent together
+    BATCH_SAFE = ('WAV', 'POW', 'TRIG', 'INIT', 'SENS', '*CLS')
+
     def __init__(self, tap_channel, rec_channel, integration_time = DEFAULT_INTEGRATION_TIME):
         super().__init__()
 
@@ -30,12 +40,15 @@ class HPLightWave(Instrument, LightSource, PowerMeter):
         :return:
         """
         print('Opening connnection to HP laser and power meter')
+        self.invalidate_cache()
 
-        rm = visa.ResourceManager()
-        self.lwmain = rm.open_resource(HP_ADDR, timeout=20000)
+        self.lwmain = open_resource(HP_ADDR, timeout=20000)
 
         self.initialize_sensors()
 
+    def batch_resource(self):
+        return self.lwmain
+
     def close(self):
         """
         Closes the instrument
@@ -46,7 +59,7 @@ class HPLightWave(Instrument, LightSource, PowerMeter):
         self.lwmain.write("INIT%d:CHAN1:CONT 1" % self.tap_channel)
         self.lwmain.write("INIT%d:CHAN1:CONT 1" % self.rec_channel)
 
-        self.lwmain.close()
+        close_resource(self.lwmain)
 
     def turn_off(self):
         """
@@ -64,6 +77,7 @@ class HPLightWave(Instrument, LightSource, PowerMeter):
         print('Turning on HP laser')
         self.lwmain.write(":POW:STAT 1")
 
+    @cached_setting()
     def set_power(self, power):
         """
         Set the power to the specified value (in mW)
@@ -74,6 +88,7 @@ class HPLightWave(Instrument, LightSource, PowerMeter):
         self.lwmain.write("POW %.7EMW" % power)
         time.sleep(0.01)
 
+    @cached_setting()
     def set_wavelength(self, wavelength):
         """
         Set the wavelength to the specified value (in nm)
@@ -81,14 +96,14 @@ class HPLightWave(Instrument, LightSource, PowerMeter):
         """
         print('Setting HP laser wavelength to %.4f nm' % wavelength)
 
-        self.lwmain.write("WAV %.7ENM" % wavelength)
+        with self.batch():
+            self.write("WAV %.7ENM" % wavelength)
+            self.write("SENS%d:CHAN1:POW:WAV %.7ENM" %
+                       (self.tap_channel, wavelength))
+            self.write("SENS%d:CHAN1:POW:WAV %.7ENM" %
+                       (self.rec_channel, wavelength))
         time.sleep(0.01)
 
-        self.lwmain.write("SENS%d:CHAN1:POW:WAV %.7ENM" %
-                          (self.tap_channel, wavelength))
-        self.lwmain.write("SENS%d:CHAN1:POW:WAV %.7ENM" %
-                          (self.rec_channel, wavelength))
-
     def get_powers(self):
         """
         Returns a list with the power measured in the tap port and in
@@ -98,23 +113,25 @@ class HPLightWave(Instrument, LightSource, PowerMeter):
         :return: A 2 element list with the power in mW
         """
 
-        self.lwmain.write("INIT%d:IMM" % self.tap_channel)
-        self.lwmain.write("INIT%d:IMM" % self.rec_channel)
+        with self.batch():
+            self.write("INIT%d:IMM" % self.tap_channel)
+            self.write("INIT%d:IMM" % self.rec_channel)
+
+            # Both channels are fetched in a single query
+            power_tap_string, received_power_string = self.query_many(["FETC%d:POW?" % self.tap_channel,
+                                                                       "FETC%d:POW?" % self.rec_channel])
 
-        power_tap_string = self.lwmain.query("FETC%d:POW?" % self.tap_channel)
         try:
             power_tap = max(0.0, float(power_tap_string))
         except ValueError:
             power_tap = 0.0
 
-        received_power_string = self.lwmain.query("FETC%d:POW?" % self.rec_channel)
-
         try:
             received_power = max(0.0, float(received_power_string))
         except ValueError:
             received_power = 0.0
 
-        self.lwmain.write("*CLS")
+        self.write("*CLS")
 
         return [power_tap, received_power]
 
@@ -124,26 +141,29 @@ class HPLightWave(Instrument, LightSource, PowerMeter):
         :return:
         """
 
-        # Set integration time
-        self.lwmain.write("SENS%d:CHAN1:POW:ATIME %.3fS" % (self.tap_channel, self.int_time))
-        self.lwmain.write("SENS%d:CHAN1:POW:ATIME %.3fS" % (self.rec_channel, self.int_time))
+        with self.batch():
+            # Set integration time
+            self.write("SENS%d:CHAN1:POW:ATIME %.3fS" % (self.tap_channel, self.int_time))
+            self.write("SENS%d:CHAN1:POW:ATIME %.3fS" % (self.rec_channel, self.int_time))
 
-        # Set units to mW
-        self.lwmain.write("SENS%d:CHAN1:POW:UNIT 1" % self.tap_channel)
-        self.lwmain.write("SENS%d:CHAN1:POW:UNIT 1" % self.rec_channel)
+            # Set units to mW
+            self.write("SENS%d:CHAN1:POW:UNIT 1" % self.tap_channel)
+            self.write("SENS%d:CHAN1:POW:UNIT 1" % self.rec_channel)
 
-        # Automatic power range
-        self.lwmain.write("SENS%d:CHAN1:POW:RANG:AUTO 1" % self.tap_channel)
-        self.lwmain.write("SENS%d:CHAN1:POW:RANG:AUTO 1" % self.rec_channel)
+            # Automatic power range
+            self.write("SENS%d:CHAN1:POW:RANG:AUTO 1" % self.tap_channel)
+            self.write("SENS%d:CHAN1:POW:RANG:AUTO 1" % self.rec_channel)
 
-        # Do not measure continuously
-        self.lwmain.write("INIT%d:CHAN1:CONT 0" % self.tap_channel)
-        self.lwmain.write("INIT%d:CHAN1:CONT 0" % self.rec_channel)
+            # Do not measure continuously
+            self.write("INIT%d:CHAN1:CONT 0" % self.tap_channel)
+            self.write("INIT%d:CHAN1:CONT 0" % self.rec_channel)
 
+    @cached_setting(1)
     def set_integration_time(self, channel, int_time):
         self.int_time = int_time
         self.lwmain.write("SENS%d:CHAN1:POW:ATIME %.3fS" % (channel, int_time))
 
+    @cached_setting(1)
     def set_range(self, channel, power_range):
         """
         Sets the power range of the power meter in the specified channel
@@ -181,6 +201,7 @@ class HPLightWave(Instrument, LightSource, PowerMeter):
 
 
     def start_sweep(self):
+        self.invalidate_cache('set_wavelength')
         self.lwmain.write("WAV:SWE START")
 
     def configure_sweep(self, init_wav, end_wav, num_wav):
@@ -206,75 +227,119 @@ class HPLightWave(Instrument, LightSource, PowerMeter):
 
         time.sleep(0.5)
 
-    def take_sweep(self, init_wav, end_wav, num_wav):
+    def take_sweep(self, init_wav, end_wav, num_wav, sweep_speed=DEFAULT_SWEEP_SPEED):
         """
-        Takes a wavelength sweep from init_wav to end_wav with num_wav points,
-        and measured the power.
-        :return:
+        Takes a continuous wavelength sweep from init_wav to end_wav with num_wav points,
+        logging the wavelength of every step (lambda logging) and the tap and received
+        powers triggered by the laser.
+        :param init_wav: start wavelength (nm)
+        :param end_wav: stop wavelength (nm)
+        :param num_wav: number of points
+        :param sweep_speed: sweep speed in nm/s
+        :return: A structured array with fields 'wavelength' (nm), 'rec_power' and 'tap_power' (in the
+        same units as get_powers), one entry per logged wavelength. None if the sweep is not valid.
         """
 
-        sweep_speed = 5 # in nm/s
+        if num_wav < 2 or end_wav <= init_wav:
+            print('The sweep needs at least 2 points and end_wav > init_wav. Doing nothing.')
+            return None
 
         total_sweep_time = (end_wav-init_wav)/sweep_speed  # in s
-        #sweep_speed = (end_wav-init_wav)/total_sweep_time  # in nm/s
-        #print(sweep_speed)
-        step_width = (end_wav-init_wav)/num_wav  # in nm
-        averaging_time = total_sweep_time*1e3/num_wav  # in ms
-
-        # Configure power meter logging
-        self.lwmain.write("SENS%d:CHAN1:FUNC:PAR:LOGG %d,%.7EMS" %
-                          (self.tap_channel, num_wav, averaging_time))
-        self.lwmain.write("SENS%d:CHAN1:FUNC:PAR:LOGG %d,%.7EMS" %
-                          (self.rec_channel, num_wav, averaging_time))
+        step_width = (end_wav-init_wav)/(num_wav-1)  # in nm, so that there are num_wav triggers
+        # Each power measurement has to finish before the next trigger arrives
+        averaging_time = SWEEP_AVERAGING_FRACTION*step_width/sweep_speed*1e3  # in ms
+
+        with self.batch():
+            # Configure power meter logging
+            for channel in [self.tap_channel, self.rec_channel]:
+                self.write("SENS%d:CHAN1:FUNC:PAR:LOGG %d,%.7EMS" %
+                           (channel, num_wav, averaging_time))
+
+            # Configure laser sweep
+            self.write("WAV:SWE:CYCL 1")  # We only want one sweep
+            self.write("WAV:SWE:MODE CONT")  # Set to use continuous sweep (not stepped)
+            self.write("TRIG0:OUTP STF")  # Necessary for lambda logging. SWST
+            self.write("WAV:SWE:LLOG 1")  # Turn on lambda logging
+
+            self.write("WAV:SWE:SPE %.7ENM/S" % sweep_speed)  # sweep speed in nm/s
+            self.write("WAV:SWE:STEP %.7ENM" % step_width)
+
+            self.write("WAV:SWE:STAR %.7ENM" % init_wav)  # Start wavelength
+            self.write("WAV:SWE:STOP %.7ENM" % end_wav)  # Stop wavelength
+
+        check_sweep = self.query('WAV:SWE:CHEC?').strip()
+        if not check_sweep.startswith('0'):
+            print('Sweep not correct: ' + check_sweep + '. Doing nothing.')
+            return None
+
+        with self.batch():
+            # Every laser trigger starts a single power measurement
+            for channel in [self.tap_channel, self.rec_channel]:
+                self.write("TRIG%d:CHAN1:INP SME" % channel)
+                self.write("SENS%d:CHAN1:FUNC:STAT LOGG,START" % channel)
+
+            self.write("WAV:SWE START")
+        self.invalidate_cache('set_wavelength')  # The laser stays at the end of the sweep
+
+        self.wait_sweep(total_sweep_time + SWEEP_TIMEOUT_MARGIN)
+
+        # Retrieve data. The wavelength log comes in m as 64 bit floats,
+        # the power logs as 32 bit floats in the same units as FETC:POW?
+        wavs = query_visa_block(self.lwmain, "SOUR0:READ:DATA? LLOG", dtype='<f8') * 1e9
+        rec_power = query_visa_block(self.lwmain, "SENS%d:CHAN1:FUNC:RES?" % self.rec_channel,
+                                     dtype='<f4')
+        tap_power = query_visa_block(self.lwmain, "SENS%d:CHAN1:FUNC:RES?" % self.tap_channel,
+                                     dtype='<f4')
+
+        data = np.zeros(len(wavs), dtype=SWEEP_DTYPE)
+        data['wavelength'] = wavs
+        data['rec_power'] = self.resample_log(rec_power, wavs, init_wav, step_width)
+        data['tap_power'] = self.resample_log(tap_power, wavs, init_wav, step_width)
 
-        # Configure laser sweep
-        self.lwmain.write("WAV:SWE:CYCL 1")  # We only want one sweep
+        return data
 
-        # self.lwmain.write("WAV:SWE:DWEL %.7EMS" % dwell_time)  # Dwell time (stepped sweep)
+    def wait_sweep(self, timeout):
+        """
+        Waits until the laser sweep has stopped and both power meter channels
+        have finished logging
+        :param timeout: maximum time to wait (s)
+        :return:
+        """
 
-        self.lwmain.write("WAV:SWE:MODE CONT")  # Set to use continuous sweep (not stepped)
-        self.lwmain.write("TRIG0:OUTP STF")  # Necessary for lambda logging. SWST
-        self.lwmain.write("WAV:SWE:LLOG 1")  # Turn on lambda logging
+        t_end = time.time() + timeout
 
-        self.lwmain.write("WAV:SWE:SPE %.7ENM/S" % sweep_speed)  # sweep speed in nm/s
-        self.lwmain.write("WAV:SWE:STEP %.7ENM" % step_width)
+        while True:
+            status = self.query_many(["WAV:SWE?"] + ["SENS%d:CHAN1:FUNC:STATE?" % channel
+                                                     for channel in [self.tap_channel, self.rec_channel]])
+            sweeping = int(float(status[0]))
+            logging = status[1:]
 
-        self.lwmain.write("WAV:SWE:STAR %.7ENM" % init_wav)  # Start wavelength
-        self.lwmain.write("WAV:SWE:STOP %.7ENM" % end_wav)  # Stop wavelength
+            if not sweeping and all('COMPLETE' in state for state in logging):
+                return
 
-        # = self.lwmain.query('WAV:SWE:CHEC?')
-        #print(check_sweep)
-        #if check_sweep != 'OK':
-        #    print('Sweep not correct: ' + check_sweep)
-        #    return
-
-        # Trigger sweep and acquisition
-        self.lwmain.write("TRIG%d:CHAN1:INP SME" %
-                          self.rec_channel)
-        self.lwmain.write("TRIG%d:CHAN1:INP SME" %
-                          self.tap_channel)
-
-        self.lwmain.write("SENS%d:CHAN1:FUNC:STAT LOGG,START" %
-                          self.rec_channel)
-        self.lwmain.write("SENS%d:CHAN1:FUNC:STAT LOGG,START" %
-                          self.tap_channel)
-        self.lwmain.write("WAV:SWE START")
+            if time.time() > t_end:
+                raise TimeoutError('The HP Lightwave sweep did not finish in %.1f s' % timeout)
 
-        time.sleep(total_sweep_time+10)
+            time.sleep(SWEEP_POLL_INTERVAL)
 
-        # Retrieve data
-        wavs = self.lwmain.query_ascii_values(":READ:DATA?")
-        print(wavs)
+    @staticmethod
+    def resample_log(power, wavs, init_wav, step_width):
+        """
+        Resamples a power log onto the logged wavelengths. Power sample k is taken on
+        the k-th laser trigger, which the laser sends when it reaches init_wav + k*step_width.
+        :param power: array with the logged powers
+        :param wavs: array with the logged wavelengths (nm)
+        :param init_wav: start wavelength of the sweep (nm)
+        :param step_width: wavelength step between triggers (nm)
+        :return: array with one power per logged wavelength
+        """
 
-        self.lwmain.write("SENS%d:CHAN1:FUNC:RES?" %
-                                                  self.rec_channel)
-        rec_data = self.lwmain.read_raw().decode('ascii')
-        print(rec_data)
-        tap_data = self.lwmain.query_ascii_values("SENS%d:CHAN1:FUNC:RES?" %
-                                                  self.tap_channel)
-        wavs = self.lwmain.query_ascii_values(":READ:DATA?")
+        if len(power) == len(wavs):
+            # One power per trigger, and one logged wavelength per trigger
+            return power
 
-        return [wavs, rec_data, tap_data]
+        trigger_wavs = init_wav + step_width * np.arange(len(power))
+        return np.interp(wavs, trigger_wavs, power)
 
     def log_trial(self):
         """
@@ -1,6 +1,6 @@
 import sys
 sys.path.insert(0,'../..')
-import visa
+from instruments.visa_pool import open_resource, close_resource
 import time
 from Interfaces.LightSource import LightSource
 from Interfaces.Instrument import Instrument
@@ -33,11 +33,10 @@ class SantecTSL210F(Instrument, LightSource):
         """
         print('Opening connnection to Santec laser')
 
-        rm = visa.ResourceManager()
-        self.santec1 = rm.open_resource(SANTEC_1_ADDR, timeout=1000)
-        self.santec2 = rm.open_resource(SANTEC_2_ADDR, timeout=1000)
-        self.santec3 = rm.open_resource(SANTEC_3_ADDR, timeout=1000)
-        self.santec4 = rm.open_resource(SANTEC_4_ADDR, timeout=1000)
+        self.santec1 = open_resource(SANTEC_1_ADDR, timeout=1000)
+        self.santec2 = open_resource(SANTEC_2_ADDR, timeout=1000)
+        self.santec3 = open_resource(SANTEC_3_ADDR, timeout=1000)
+        self.santec4 = open_resource(SANTEC_4_ADDR, timeout=1000)
 
     def close(self):
         """
@@ -45,10 +44,10 @@ class SantecTSL210F(Instrument, LightSource):
         :return:
         """
         print('Closing connnection to Santec laser')
-        self.santec1.close()
-        self.santec2.close()
-        self.santec3.close()
-        self.santec4.close()
+        close_resource(self.santec1)
+        close_resource(self.santec2)
+        close_resource(self.santec3)
+        close_resource(self.santec4)
 
 
     def turn_off(self):
@@ -1,9 +1,9 @@
 import sys
 sys.path.insert(0,'../..')
-import visa
+from instruments.visa_pool import open_resource, close_resource
 import time
 from Interfaces.LightSource import LightSource
-from Interfaces.Instrument import Instrument
+from Interfaces.Instrument import Instrument, cached_setting
 import matplotlib.pyplot as plt
 
 SANTEC_TSL550_GPIB_ADDRESS = 28
@@ -19,8 +19,7 @@ class SantecTSL550(Instrument, LightSource):
     def initialize(self):
 
         print('Opening connnection to Santec TSL550 laser')
-        rm = visa.ResourceManager()
-        self.gpib = rm.open_resource("GPIB1::%d" % (self.gpib_address))
+        self.gpib = open_resource("GPIB1::%d" % (self.gpib_address))
 
         # Stop any measurements that it may currently doing
         if int(self.gpib.query_ascii_values("SOUR:WAV:SWE:STAT?")[0]) != 1:
@@ -35,7 +34,7 @@ class SantecTSL550(Instrument, LightSource):
 
     def close(self):
         print('Closing connnection to Santec laser')
-        self.gpib.close()
+        close_resource(self.gpib)
 
     def disable_input_trigger(self):
         self.gpib.write(":SOUR:TRIG:INP:EXT 0")
@@ -45,7 +44,7 @@ class SantecTSL550(Instrument, LightSource):
         return self.gpib.read_raw()
 
     def reset(self):
-        self.gpib.write("*RST")
+        self.write("*RST")
 
     def turn_on_LD(self):
         self.gpib.write(":SOUR:POW:STAT 1")
@@ -65,13 +64,16 @@ class SantecTSL550(Instrument, LightSource):
 
     # mode = 0 --> dBm
     # mode = 1 --> mW
+    @cached_setting()
     def set_power_units(self, mode):
         self.gpib.write(":SOUR:POW:UNIT " + str(mode))
 
+    @cached_setting()
     def set_power(self, value):
         self.gpib.write(":SOUR:POW:LEV " + str(value))
 
     # wavelength in nm
+    @cached_setting()
     def set_wavelength(self, wav):
         self.gpib.write(":SOUR:WAV " + str(wav))
 
@@ -115,6 +117,7 @@ class SantecTSL550(Instrument, LightSource):
             self.stop_sweep()
 
         self.gpib.write("SOUR:WAV:SWE:STAT 1")
+        self.invalidate_cache('set_wavelength')
 
     # Stop sweep
     def stop_sweep(self):
@@ -123,6 +126,7 @@ class SantecTSL550(Instrument, LightSource):
     # Starts conrinuous sweep
     def start_cont_sweep(self):
         self.gpib.write("SOUR:WAV:SWE:REP")
+        self.invalidate_cache('set_wavelength')
 
     # Configures the trigger
     # mode = 0: No output trigger
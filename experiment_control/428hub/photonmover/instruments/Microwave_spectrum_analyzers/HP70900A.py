@@ -3,7 +3,7 @@ sys.path.insert(0,'../..')
 from Interfaces.MSA import MSA
 from Interfaces.Instrument import Instrument
 
-import visa
+from instruments.visa_pool import open_resource, close_resource
 import time
 import numpy as np
 import matplotlib.pyplot as plt
@@ -27,9 +27,8 @@ class HP70900A(MSA, Instrument):
     def initialize(self):
         print('Opening connnection to HP MSA')
 
-        rm = visa.ResourceManager()
         try:
-            self.gpib = rm.open_resource(GPIB_ADDRESS, timeout=5000)
+            self.gpib = open_resource(GPIB_ADDRESS, timeout=5000)
         except:
             raise ValueError('Cannot connect to the HP MSA')
 
@@ -38,9 +37,15 @@ class HP70900A(MSA, Instrument):
     def init_func(self):
         self.gpib.write('TDF P')  # Set ASCII mode for communication
 
+        # Conversion of binary trace data (measurement units) to amplitude for each
+        # amplitude setting: (number of points, scale, offset), or None if it could not be found
+        self.binary_scale = {}
+        # Amplitude settings, only queried again after the driver changes them
+        self.amplitude_settings = None
+
     def close(self):
         print('Disconnecting HP MSA')
-        self.gpib.close()
+        close_resource(self.gpib)
 
 
     def set_freq_axis(self, center, span, start_freq, end_freq):
@@ -93,6 +98,7 @@ class HP70900A(MSA, Instrument):
         :return:
         """
         self.gpib.write('IP;')
+        self.amplitude_settings = None
 
     def set_sweep_time(self, sweep_time):
         """
@@ -116,6 +122,8 @@ class HP70900A(MSA, Instrument):
         if ref_pos is not None:
             self.gpib.write('RLPOS %d;' % ref_pos)
 
+        self.amplitude_settings = None
+
     def set_peak_detection_type(self, type):
         """
         Sets the peak detection to use.
@@ -184,8 +192,100 @@ class HP70900A(MSA, Instrument):
         else:
             self.gpib.write('VAVG %d;VAVG ON;TS' % num_avg )
 
-    def read_data(self, filename=None):
+    def get_amplitude_settings(self):
+        """
+        Gets the settings that determine how measurement units map to amplitude
+        :return: tuple with the reference level and the log scale
+        """
+        return (self.gpib.query_ascii_values('RL?;')[0], self.gpib.query_ascii_values('LG?;')[0])
 
+    def refresh_amplitude_settings(self):
+        """
+        Queries the amplitude settings again. The driver only does it by itself after it changes
+        them, so call this if the reference level or scale were changed from the front panel.
+        :return: tuple with the reference level and the log scale
+        """
+        self.amplitude_settings = self.get_amplitude_settings()
+        return self.amplitude_settings
+
+    def calibrate_binary_trace(self):
+        """
+        Finds the conversion from binary trace data (measurement units) to amplitude by reading
+        the current trace both in ASCII (TDF P) and in binary (TDF B). The result (or the failure
+        to find it) is kept for the current amplitude settings, so it is only done once for them.
+        The trace has to be static (in VIEW or after a single sweep).
+        :return: True if the conversion could be found. It cannot if the trace is flat or changing.
+        """
+        if self.amplitude_settings is None:
+            self.refresh_amplitude_settings()
+        settings = self.amplitude_settings
+
+        amps = np.array(self.gpib.query_ascii_values('TRA?;'))
+        self.gpib.write('TDF B;')
+        try:
+            mu = self._read_binary_trace(len(amps))
+        finally:
+            self.gpib.write('TDF P;')
+
+        if np.ptp(mu) == 0:
+            # Flat trace, there is nothing to fit. Use ASCII for these settings.
+            print('Could not calibrate binary trace transfer. Using ASCII.')
+            self.binary_scale[settings] = None
+            return False
+
+        scale, offset = np.polyfit(mu, amps, 1)
+        if np.max(np.abs(mu * scale + offset - amps)) > 0.01 * np.ptp(amps):
+            # The trace changed between the two reads
+            print('Could not calibrate binary trace transfer. Using ASCII.')
+            self.binary_scale[settings] = None
+            return False
+
+        self.binary_scale[settings] = (len(amps), scale, offset)
+        return True
+
+    def _read_binary_trace(self, num_points):
+        """
+        Reads a trace sent in TDF B format (2 byte big-endian integers)
+        :param num_points: number of points of the trace
+        :return: numpy array with the trace in measurement units
+        """
+        self.gpib.write('TRA?;')
+        raw_data = self.gpib.read_bytes(2 * num_points)
+        return np.frombuffer(raw_data, dtype='>i2')
+
+    def _binary_ready(self):
+        # Make sure there is a valid conversion for the current amplitude settings. Settings for
+        # which the calibration failed are read in ASCII without trying again.
+        if self.amplitude_settings is None:
+            self.refresh_amplitude_settings()
+        if self.amplitude_settings not in self.binary_scale:
+            self.calibrate_binary_trace()
+        return self.binary_scale[self.amplitude_settings] is not None
+
+    def read_trace(self, binary=True):
+        """
+        Reads the current trace
+        :param binary: if True, the trace is transferred in binary (TDF B) and converted to
+                amplitude with numpy. Otherwise it is transferred in ASCII (TDF P).
+        :return: numpy array with the amplitudes
+        """
+        if binary and self._binary_ready():
+            num_points, scale, offset = self.binary_scale[self.amplitude_settings]
+            self.gpib.write('TDF B;')
+            try:
+                mu = self._read_binary_trace(num_points)
+            finally:
+                self.gpib.write('TDF P;')
+            return mu * scale + offset
+
+        return np.array(self.gpib.query_ascii_values("TRA?;"))
+
+    def get_trace_freqs(self, num_points):
+        """
+        Gets the frequency of each point of the trace
+        :param num_points: number of points of the trace
+        :return: numpy array with the frequencies in Hz
+        """
         # Get trace conditions
         self.gpib.write("TRCOND TRA?;")
         conds = self.gpib.read_raw().decode('ascii')
@@ -194,21 +294,16 @@ class HP70900A(MSA, Instrument):
         init_freq = float(conds[0])
         end_freq = float(conds[1])
 
-        # Get trace
-        self.gpib.write('TS;DONE?;')
-        self.gpib.write('VIEW TRA;')
-
-        #print(self.gpib.query_ascii_values('DONE?;'))
-        #while int(self.gpib.query_ascii_values('DONE?;')[0]) != 1:
-        #    time.sleep(0.2)
-
+        return np.linspace(init_freq, end_freq, num_points)
 
-        amps = self.gpib.query_ascii_values("TRA?;")
+    def read_data(self, filename=None, binary=True):
 
-        #while int(self.gpib.query_ascii_values('DONE?;')[0]) != 1:
-        #    time.sleep(0.2)
+        # Get trace, waiting for the sweep to finish
+        self.gpib.query_ascii_values('TS;DONE?;')
+        self.gpib.write('VIEW TRA;')
 
-        freqs = np.linspace(init_freq, end_freq, len(amps))
+        amps = self.read_trace(binary=binary)
+        freqs = self.get_trace_freqs(len(amps))
 
         # Save the data if necessary. Each channel will be stored in a different file
         if filename is not None:
@@ -221,6 +316,56 @@ class HP70900A(MSA, Instrument):
 
         return [freqs, amps]
 
+    def capture_traces(self, num_traces, filename=None, binary=True):
+        """
+        Takes num_traces single sweeps in a row, without changing the configuration in between
+        :param num_traces: number of traces to capture
+        :param filename: if specified, a csv is saved with the frequencies in the first row
+                and one trace per row after it
+        :param binary: if True, the traces are transferred in binary (TDF B)
+        :return: [freqs, traces], where traces is a (num_traces, num_points) numpy array
+        """
+
+        self.gpib.write('SNGLS;')
+        try:
+            self.gpib.query_ascii_values('TS;DONE?;')
+
+            if binary and self._binary_ready():
+                num_points, scale, offset = self.binary_scale[self.amplitude_settings]
+            else:
+                binary = False
+                num_points = len(self.gpib.query_ascii_values('TRA?;'))
+
+            freqs = self.get_trace_freqs(num_points)
+            traces = np.empty((num_traces, num_points))
+
+            if binary:
+                self.gpib.write('TDF B;')
+            try:
+                for i in range(num_traces):
+                    self.gpib.query_ascii_values('TS;DONE?;')
+                    if binary:
+                        traces[i] = self._read_binary_trace(num_points)
+                    else:
+                        traces[i] = self.gpib.query_ascii_values('TRA?;')
+            finally:
+                if binary:
+                    self.gpib.write('TDF P;')
+        finally:
+            # Go back to continuous sweeps
+            self.set_continuous_acq()
+
+        if binary:
+            traces = traces * scale + offset
+
+        if filename is not None:
+            with open(filename, 'w+') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(freqs)
+                writer.writerows(traces)
+
+        return [freqs, traces]
+
 
 if __name__ == '__main__':
 
@@ -1,15 +1,19 @@
 import sys
 sys.path.insert(0, '../..')
-import visa
+from instruments.visa_pool import open_resource, close_resource
 import numpy as np
 import time
 import csv
-import struct
-import binascii
 from Interfaces.Instrument import Instrument
+from instruments.binblock import query_visa_block
 
 GPIB_ADDR = "USB0::0x1AB1::0x04CE::DS1ZA201205030::INSTR"  # VISA adress
 
+# Maximum number of points the oscilloscope sends in one :WAV:DATA? reply for each format
+WAV_MAX_POINTS = {"BYTE": 250000, "WORD": 125000, "ASCII": 15625}
+# Binary formats: one unsigned byte per point, or two (little-endian, only the low byte is used)
+WAV_DTYPES = {"BYTE": 'u1', "WORD": '<u2'}
+
 
 class RigolDS1000(Instrument):
     """
@@ -30,16 +34,15 @@ class RigolDS1000(Instrument):
         """
         print('Opening connnection to Rigol Oscilloscope')
 
-        rm = visa.ResourceManager()
         try:
-            self.gpib = rm.open_resource(GPIB_ADDR, timeout=10000)
+            self.gpib = open_resource(GPIB_ADDR, timeout=10000)
         except:
             raise ValueError('Cannot connect to Rigol Oscilloscope')
 
 
     def close(self):
         print('Disconnecting Rigol Oscilloscope')
-        self.gpib.close()
+        close_resource(self.gpib)
 
     def autoscale(self):
         self.gpib.write(":AUT")
@@ -241,64 +244,124 @@ class RigolDS1000(Instrument):
         if level is not None:
             self.gpib.write(":TRIG:%s:LEV %.4f" % (mode, level))
 
-    def read_waveform(self, channels, file_name=None):
+    def get_preamble(self):
+        """
+        Gets the waveform preamble of the current source, mode and format
+        :return: list [format, type, points, count, xincrement, xorigin, xreference,
+                yincrement, yorigin, yreference]
+        """
+        return self.gpib.query_ascii_values(":WAV:PRE?")
+
+    def get_time_axis(self, preamble):
+        """
+        Gets the time of each point of a waveform read with the given preamble
+        :param preamble: preamble returned by read_waveform or get_preamble
+        :return: numpy array with the time of each point in s
+        """
+        points, xincrement, xorigin, xreference = preamble[2], preamble[4], preamble[5], preamble[6]
+        return (np.arange(int(points)) - xreference) * xincrement + xorigin
+
+    def read_waveform(self, channels, file_name=None, data_format="BYTE", mode="NORM"):
         """
         Reads the waveform in the specified channels
         :param channels: list with the channels whose waveform we w ant to obtain.
         :param file_name: if specified, it will save the data with the specified file name. Do not include the ".csv".
+        :param data_format: "BYTE", "WORD" or "ASCII". BYTE and WORD are transferred in binary and scaled
+                to volts using the preamble, which is much faster than ASCII.
+        :param mode: "NORM" to read the points on screen, "RAW" to read the full acquisition memory.
+                In RAW mode the oscilloscope is stopped first (so that all channels come from the same
+                acquisition), and set running again at the end if it was running before.
         :return: 2 lists, each with n elemnts, where n is the number of channels.
                 List 1: [preamble_channel1, preamble_channel2, ...]
-                List 2: [channel1_data, channel2_data, ...]
+                List 2: [channel1_data, channel2_data, ...], each a numpy array in V
         """
 
+        if data_format not in ["BYTE", "WORD", "ASCII"]:
+            print("Data format not supported. Doing nothing.")
+            return
+
+        if mode not in ["NORM", "RAW"]:
+            print("Waveform mode not supported. Doing nothing.")
+            return
+
         all_preambles = []
         all_waveforms = []
 
-        # Set waveform reading mode to normal
-        self.gpib.write(":WAV:MODE NORM")
+        was_running = False
+        if mode == "RAW":
+            was_running = self.gpib.query(":TRIG:STAT?").strip() != "STOP"
+            self.stop()
 
-        # Set to send ascii
-        self.gpib.write(":WAV:FORM ASCII")
+        try:
+            # The format and mode are shared by all the channels, so set them once
+            self.gpib.write(":WAV:MODE %s" % mode)
+            self.gpib.write(":WAV:FORM %s" % data_format)
 
-        for c in channels:
-            if c not in [1, 2, 3, 4]:
-                print("Specified channel not correct. Skipping it")
-                continue
+            for c in channels:
+                if c not in [1, 2, 3, 4]:
+                    print("Specified channel not correct. Skipping it")
+                    continue
 
-            # Choose source
-            self.gpib.write(":WAV:SOUR CHAN%d" % c)
+                # Choose source
+                self.gpib.write(":WAV:SOUR CHAN%d" % c)
 
-            self.gpib.write("WAV:DATA?")
-            data = self.gpib.read_raw()
-            #print(data)
-            num_bytes = int(data[7:11])
-            #print(num_bytes)
-            raw_data = data[11:]
-            #print(raw_data)
-            #input()
+                preamble = self.get_preamble()
+                wav_data = self._read_points(int(preamble[2]), data_format)
 
-            wav_data_str = (str(raw_data)[2:-3]).split(',')
+                if data_format != "ASCII":
+                    # Convert the ADC codes to volts
+                    yincrement, yorigin, yreference = preamble[7], preamble[8], preamble[9]
+                    wav_data = (wav_data - (yorigin + yreference)) * yincrement
 
-            wav_data = [float(i) for i in wav_data_str]
-            #print(wav_data)
+                # Save the data if necessary. Each channel will be stored in a different file
+                if file_name is not None:
 
-            preamble = self.gpib.query_ascii_values("WAV:PRE?")
+                    # Create the csv file
+                    file_name_chan = file_name + "_channel_" + str(c) + ".csv"
 
-            # Save the data if necessary. Each channel will be stored in a different file
-            if file_name is not None:
+                    with open(file_name_chan, 'w+') as csvfile:
+                        writer = csv.writer(csvfile)
+                        writer.writerow(preamble)
+                        writer.writerow(wav_data)
 
-                # Create the csv file
-                file_name_chan = file_name + "_channel_" + str(c) + ".csv"
+                all_preambles.append(preamble)
+                all_waveforms.append(wav_data)
+        finally:
+            if was_running:
+                self.run()
 
-                with open(file_name_chan, 'w+') as csvfile:
-                    writer = csv.writer(csvfile)
-                    writer.writerow(preamble)
-                    writer.writerow(wav_data)
+        return all_preambles, all_waveforms
 
-            all_preambles.append(preamble)
-            all_waveforms.append(wav_data)
+    def _read_points(self, num_points, data_format):
+        """
+        Reads num_points points of the current source in chunks no longer than what
+        the oscilloscope can send in one reply
+        :param num_points: number of points to read
+        :param data_format: "BYTE", "WORD" or "ASCII" (has to be the current format)
+        :return: numpy array with the ADC codes (BYTE, WORD) or voltages (ASCII). Points that
+                were not received are NaN.
+        """
+        max_points = WAV_MAX_POINTS[data_format]
+        data = np.full(num_points, np.nan)
 
-        return all_preambles, all_waveforms
+        for start in range(0, num_points, max_points):
+            stop = min(start + max_points, num_points)
+            self.gpib.write(":WAV:STAR %d" % (start + 1))
+            self.gpib.write(":WAV:STOP %d" % stop)
+
+            if data_format == "ASCII":
+                # In ASCII mode the block payload is a comma separated list of voltages
+                raw_data = query_visa_block(self.gpib, ":WAV:DATA?", dtype='u1')
+                chunk = np.array(raw_data.tobytes().strip(b', \n').split(b','), dtype=float)
+            else:
+                chunk = query_visa_block(self.gpib, ":WAV:DATA?", dtype=WAV_DTYPES[data_format])
+
+            if len(chunk) < stop - start:
+                print("Only received %d of the points %d to %d" % (len(chunk), start + 1, stop))
+            chunk = chunk[:stop - start]
+            data[start:start + len(chunk)] = chunk
+
+        return data
 
 
 if __name__ == '__main__':
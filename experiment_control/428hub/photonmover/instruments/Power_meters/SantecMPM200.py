@@ -1,21 +1,33 @@
 import sys
 sys.path.insert(0,'../..')
-import visa
+import os
+import pickle
+from instruments.visa_pool import open_resource, close_resource
 import instruments.Power_meters.real_plotter as real_plotter
-import struct
+from instruments.binblock import query_visa_block
 import matplotlib.pyplot as pyplot
 import time
-import math
 import numpy as np
-from Interfaces.Instrument import Instrument
+from Interfaces.Instrument import Instrument, cached_setting
 from Interfaces.PowMeter import PowerMeter
 
 SANTEC_MPM200_GPIB_ADDRESS = 16
 
+# Wavelengths (nm) of the 19 points of the calibrated power offset table of each port (CWAVPO?)
+POWER_OFFSET_WAVELENGTHS = 1270 + 20 * np.arange(19)
+# File where the power offset tables are kept between sessions, keyed by instrument ID. It is in
+# the user's cache directory (%LOCALAPPDATA%\photonmover on Windows, ~/.cache/photonmover otherwise).
+if sys.platform.startswith('win'):
+    _CACHE_DIR = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+else:
+    _CACHE_DIR = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+POWER_OFFSET_CACHE_FILE = os.path.join(_CACHE_DIR, 'photonmover', 'mpm200_power_offsets.pickle')
+
 # Power meter with GPIB interface
 class SantecMPM200(Instrument, PowerMeter):
 
-    def __init__(self, rec_port=1, tap_port=None, module=0, gpib_address=SANTEC_MPM200_GPIB_ADDRESS, wait=0.5):
+    def __init__(self, rec_port=1, tap_port=None, module=0, gpib_address=SANTEC_MPM200_GPIB_ADDRESS, wait=0.5,
+                 offset_cache_file=POWER_OFFSET_CACHE_FILE):
 
         super().__init__()
         self.gpib_address = gpib_address
@@ -23,6 +35,7 @@ class SantecMPM200(Instrument, PowerMeter):
         self.tap_port = tap_port
         self.wait = wait
         self.module = module
+        self.offset_cache_file = offset_cache_file  # None to always read the offset tables from the instrument
 
     def initialize(self):
         """
@@ -31,8 +44,7 @@ class SantecMPM200(Instrument, PowerMeter):
         """
         print('Opening connnection to Santec MPM200 power meter')
 
-        rm = visa.ResourceManager()
-        self.gpib = rm.open_resource("GPIB1::%d" % (self.gpib_address))
+        self.gpib = open_resource("GPIB1::%d" % (self.gpib_address))
 
         # Stop any measurements that it may currently doing
         if int(self.gpib.query_ascii_values("STAT?")[0]) != 1:
@@ -42,8 +54,10 @@ class SantecMPM200(Instrument, PowerMeter):
         self.read_all_errors(print_errors=False)
         # self.set_range(None, -20)
 
-        # Create variable for wavelength offset power table
-        self.wop = dict()
+        # Wavelength offset power tables, {(module, port): table}. Tables read in a
+        # previous session with this same instrument are loaded from the cache.
+        self.init_id()
+        self.wop = self.load_power_offset_cache()
 
     def close(self):
         """
@@ -52,11 +66,57 @@ class SantecMPM200(Instrument, PowerMeter):
         """
         print('Closing connnection to Santec MPM200')
 
-        self.gpib.close()
+        close_resource(self.gpib)
 
     def init_id(self):
         self.gpib.write("*IDN?")
-        self.id_str = self.gpib.read_raw().strip()
+        self.id_str = self.gpib.read_raw().strip().decode()
+
+    def load_power_offset_cache(self):
+        """
+        Loads the power offset tables cached for this instrument
+        :return: dictionary {(module, port): table}, empty if there is nothing cached
+        """
+        if self.offset_cache_file is None or not os.path.isfile(self.offset_cache_file):
+            return dict()
+        try:
+            with open(self.offset_cache_file, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception as e:
+            print("Could not read power offset cache %s: %s" % (self.offset_cache_file, e))
+            return dict()
+        return dict(cache.get(self.id_str, dict()))
+
+    def save_power_offset_cache(self):
+        """
+        Saves the power offset tables read so far to the cache file, under this instrument's ID
+        :return:
+        """
+        if self.offset_cache_file is None:
+            return
+        cache = dict()
+        if os.path.isfile(self.offset_cache_file):
+            try:
+                with open(self.offset_cache_file, 'rb') as f:
+                    cache = pickle.load(f)
+            except Exception:
+                pass
+        cache[self.id_str] = self.wop
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.offset_cache_file)), exist_ok=True)
+            with open(self.offset_cache_file, 'wb') as f:
+                pickle.dump(cache, f)
+        except OSError as e:
+            print("Could not save power offset cache %s: %s" % (self.offset_cache_file, e))
+
+    def clear_power_offset_cache(self):
+        """
+        Forgets the power offset tables of this instrument (e.g. after it has been recalibrated),
+        so that they are read again from the instrument
+        :return:
+        """
+        self.wop = dict()
+        self.save_power_offset_cache()
 
     def read_all_errors(self, print_errors=True):
         self.gpib.write('ERR?')
@@ -64,6 +124,8 @@ class SantecMPM200(Instrument, PowerMeter):
         while "0," not in str(err):
             if print_errors:
                 print("Error: %s" % err)
+            # A rejected command may have left any setting different from what we sent
+            self.invalidate_cache()
             self.gpib.write('ERR?')
             err = self.gpib.read_raw()
 
@@ -115,6 +177,7 @@ class SantecMPM200(Instrument, PowerMeter):
             return
         self.gpib.write("FGSAVG %.2f" % time)
 
+    @cached_setting()
     def set_wavelength(self, wave):
         if (wave < 1260 or wave > 1630):
             print("Wavelength out of range")
@@ -133,6 +196,7 @@ class SantecMPM200(Instrument, PowerMeter):
     # Lev = 3 goes up to -15dBm
     # Lev = 4 goes up to -25dBm
     # Lev = 5 goes up to -40dBm
+    @cached_setting(1)
     def set_range(self, channel, rng):
 
         # Ignore the channel, just have it here to comply with the interface
@@ -163,27 +227,24 @@ class SantecMPM200(Instrument, PowerMeter):
         self.gpib.write("STOP")
 
     def create_power_offset_table(self, port):
-        wop = [-1e9]
-        # Get all the calibrated power offset data
-        for i in range(1, 20):
-            wop.append(float(self.gpib.query_ascii_values("CWAVPO? %d,%d,%d" % (self.module, port, i))[0]))
-        self.wop[(self.module, port)] = wop
+        # Get all the calibrated power offset data and keep it for later sessions
+        wop = [float(self.gpib.query_ascii_values("CWAVPO? %d,%d,%d" % (self.module, port, i))[0])
+               for i in range(1, 20)]
+        self.wop[(self.module, port)] = np.array(wop)
+        self.save_power_offset_cache()
 
     def get_power_offset_raw(self, port, wavelength):
+        """
+        Gets the calibrated power offset of the port, linearly interpolated from the 20 nm spaced table
+        and clamped to its end points
+        :param port: port of the current module
+        :param wavelength: wavelength or array of wavelengths in nm
+        :return: the offset in dB, with the same shape as wavelength
+        """
         if (self.module, port) not in self.wop:
             self.create_power_offset_table(port)
 
-        wop = self.wop[(self.module, port)]
-        x0_num = int(min(max(math.floor((wavelength - 1270) / 20) + 1, 1), 19))
-        x1_num = int(min(max(math.ceil((wavelength - 1270) / 20) + 1, 1), 19))
-        if x0_num == x1_num:
-            return wop[x0_num]
-        else:
-            x0 = (20 * (x0_num - 1)) + 1270
-            x1 = (20 * (x1_num - 1)) + 1270
-            y0 = wop[x0_num]
-            y1 = wop[x1_num]
-            return (y1 - y0) / (x1 - x0) * (wavelength - x0) + y0
+        return np.interp(wavelength, POWER_OFFSET_WAVELENGTHS, self.wop[(self.module, port)])
 
     def get_power_offsets(self, port, wavelengths, wave_ref):
         if self.module < 0 or self.module > 4:
@@ -193,13 +254,9 @@ class SantecMPM200(Instrument, PowerMeter):
             print("Port number out of range")
             return
 
-        # Perform offset calculation for the fixed wavelength
+        # Offsets of all wavelengths, relative to the one at the fixed wavelength
         fwop = self.get_power_offset_raw(port, wave_ref)
-        # Perform offset calculation for all wavelengths
-        po = []
-        for wavelength in wavelengths:
-            po.append(self.get_power_offset_raw(port, wavelength) - fwop)
-        return po
+        return self.get_power_offset_raw(port, np.asarray(wavelengths, dtype=float)) - fwop
 
     def get_logged_data(self, port):
         if self.module < 0 or self.module > 4:
@@ -209,26 +266,8 @@ class SantecMPM200(Instrument, PowerMeter):
             print("Port number out of range")
             return
 
-        # Read the status indicator and the number of digits of the length sequence
-        self.gpib.write("LOGG? %d,%d" % (self.module, port))
-        status = self.gpib.read_raw()  # buf_size = 2 read_raw
-        #print(status)
-        # Detect if the logged data is invalid
-        if status[0:1] != b'#':
-            raise Exception("Logged data is invalid!")
-
-        # Read the number of bytes to read to read the length of the data sequence
-        #print(int(status[1:2]))
-        num_bytes = int(status[2:2 + int(status[1:2])])
-        #print(num_bytes)
-
-        # Need a while loop to read everything
-        raw_data = status[2 + int(status[1:2]) : 2 + int(status[1:2]) + num_bytes]
-
-        data = []
-        for i in range(0, num_bytes, 4):
-            data += struct.unpack('f', raw_data[i:i + 4])
-        return data
+        # The logged powers come back as a binary block of little-endian floats
+        return query_visa_block(self.gpib, "LOGG? %d,%d" % (self.module, port), dtype='<f4')
 
     def get_powers(self):
         all_powers = self.get_all_powers()
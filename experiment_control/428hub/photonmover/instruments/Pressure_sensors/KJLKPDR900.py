@@ -2,6 +2,7 @@ import sys
 sys.path.insert(0, '../..')
 from Interfaces.Instrument import Instrument
 import serial
+from instruments.command_trace import traced
 import time
 
 COM_ADDRESS = 'COM2'
@@ -18,7 +19,7 @@ class KJLKPDR900(Instrument):
         :return:
         """
         print("Initializing connection to Tunable Filter")
-        self.ser = serial.Serial(COM_ADDRESS, timeout=3)
+        self.ser = traced(serial.Serial(COM_ADDRESS, timeout=3), COM_ADDRESS)
 
     def close(self):
         """
@@ -0,0 +1,242 @@
+import time
+import numpy as np
+
+# State shared by the simulated instruments: the laser (wavelength, power,
+# sweeps), the device under test and the bias applied to it. The simulated
+# power meters read the light that the simulated laser sends through the device,
+# and the simulated source meters measure the device's IV curve, so the data
+# looks like a real measurement (resonances, diode curves) and follows what the
+# other instruments are doing.
+#
+# Times are simulated seconds. With time_scale < 1 everything (bus transfers,
+# measurements, sweeps) runs that much faster in real time. The drivers' own
+# time.sleep calls are not scaled, so only time_scale = 1 gives realistic totals.
+
+THERMAL_VOLTAGE = 0.02585  # V, at room temperature
+
+
+class RingResonator:
+    """
+    Transmission of an all-pass ring resonator: Lorentzian dips every FSR
+    """
+
+    def __init__(self, resonance=1550.3, fsr=2.0, fwhm=0.05, extinction=0.9, insertion_loss=3.0,
+                 tuning=0.02, bandwidth=10e9):
+        """
+        :param resonance: wavelength of one of the resonances at 0 V (nm)
+        :param fsr: free spectral range (nm)
+        :param fwhm: full width at half maximum of the resonances (nm)
+        :param extinction: fraction of the power removed at resonance
+        :param insertion_loss: off-resonance loss (dB)
+        :param tuning: resonance shift with the applied bias (nm/V)
+        :param bandwidth: 3 dB electro-optic bandwidth (Hz)
+        """
+        self.resonance = resonance
+        self.fsr = fsr
+        self.fwhm = fwhm
+        self.extinction = extinction
+        self.insertion_loss = insertion_loss
+        self.tuning = tuning
+        self.bandwidth = bandwidth
+
+    def transmission(self, wavelengths, bias=0.0):
+        """
+        :param wavelengths: wavelength or array of wavelengths (nm)
+        :param bias: voltage applied to the device (V)
+        :return: linear power transmission, same shape as wavelengths
+        """
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        detuning = np.mod(wavelengths - self.resonance - self.tuning * bias + self.fsr / 2, self.fsr) - self.fsr / 2
+        half_width = self.fwhm / 2
+        dip = self.extinction * half_width ** 2 / (detuning ** 2 + half_width ** 2)
+        return np.power(10, -self.insertion_loss / 10) * (1 - dip)
+
+    def s21(self, freqs):
+        """
+        :param freqs: array of frequencies (Hz)
+        :return: complex electro-optic response (single pole)
+        """
+        return 1 / (1 + 1j * np.asarray(freqs, dtype=float) / self.bandwidth)
+
+
+class Diode:
+    """
+    Photodiode: Shockley diode in parallel with the photocurrent
+    """
+
+    def __init__(self, saturation_current=1e-12, ideality=1.5, responsivity=0.8, dark_current=1e-9):
+        """
+        :param saturation_current: (A)
+        :param ideality: ideality factor
+        :param responsivity: photocurrent per optical power (A/W)
+        :param dark_current: reverse leakage (A)
+        """
+        self.saturation_current = saturation_current
+        self.ideality = ideality
+        self.responsivity = responsivity
+        self.dark_current = dark_current
+
+    def current(self, voltage, optical_power=0.0):
+        """
+        :param voltage: voltage or array of voltages (V)
+        :param optical_power: optical power reaching the diode (W)
+        :return: current (A), same shape as voltage
+        """
+        voltage = np.asarray(voltage, dtype=float)
+        forward = self.saturation_current * np.expm1(np.minimum(voltage / (self.ideality * THERMAL_VOLTAGE), 50))
+        return forward - self.dark_current * (voltage < 0) - self.responsivity * optical_power
+
+
+class SimBench:
+
+    def __init__(self, dut=None, diode=None, time_scale=1.0, noise=1e-3, tap_fraction=0.1, seed=0):
+        """
+        :param dut: device under test, with transmission(wavelengths, bias) and s21(freqs). RingResonator() if None.
+        :param diode: Diode measured by the source meters. Diode() if None.
+        :param time_scale: real seconds per simulated second
+        :param noise: relative noise of the optical power readings
+        :param tap_fraction: fraction of the laser power going to the tap port
+        :param seed: seed of the noise generator
+        """
+        self.dut = dut if dut is not None else RingResonator()
+        self.diode = diode if diode is not None else Diode()
+        self.time_scale = time_scale
+        self.noise = noise
+        self.tap_fraction = tap_fraction
+        self.rng = np.random.default_rng(seed)
+        self._start = time.time()
+
+        # Laser
+        self.laser_on = False
+        self.laser_power = 1.0  # mW
+        self.wavelength = 1550.0  # nm, when not sweeping
+        self.sweep = None  # dict with the current sweep, see start_sweep
+
+        # Voltage applied to the device by the source meter
+        self.bias = 0.0
+
+        # Power range (dBm) of the power meters whose analog outputs go to the
+        # DAQ, {'through': range, 'tap': range}. The outputs give 1 V at full range.
+        self.analog_range = {'through': 0.0, 'tap': 0.0}
+
+    # Time
+
+    def now(self):
+        """
+        :return: simulated time (s) since the bench was created
+        """
+        return (time.time() - self._start) / self.time_scale
+
+    def sleep(self, duration):
+        if duration > 0:
+            time.sleep(duration * self.time_scale)
+
+    def wait_until(self, t):
+        self.sleep(t - self.now())
+
+    # Laser
+
+    def set_wavelength(self, wavelength):
+        self.stop_sweep()
+        self.wavelength = wavelength
+
+    def start_sweep(self, start, stop, speed, step=None, t=None):
+        """
+        Starts a continuous laser sweep
+        :param start: start wavelength (nm)
+        :param stop: stop wavelength (nm)
+        :param speed: sweep speed (nm/s)
+        :param step: wavelength step between output triggers (nm), None if there are none
+        :param t: start time, now if None
+        :return: the sweep dictionary (start, stop, speed, step, t_start, t_end)
+        """
+        t_start = self.now() if t is None else t
+        self.sweep = {'start': start, 'stop': stop, 'speed': speed, 'step': step,
+                      't_start': t_start, 't_end': t_start + abs(stop - start) / speed}
+        return self.sweep
+
+    def stop_sweep(self):
+        if self.sweep is not None:
+            self.wavelength = self.wavelength_at(self.now())
+            self.sweep = None
+
+    def sweeping(self, t=None):
+        t = self.now() if t is None else t
+        return self.sweep is not None and t < self.sweep['t_end']
+
+    def wavelength_at(self, t):
+        """
+        :param t: simulated time or array of times
+        :return: laser wavelength (nm) at those times
+        """
+        if self.sweep is None:
+            return np.full(np.shape(t), self.wavelength, dtype=float) if np.ndim(t) else self.wavelength
+
+        s = self.sweep
+        direction = np.sign(s['stop'] - s['start'])
+        wav = s['start'] + direction * s['speed'] * (np.asarray(t, dtype=float) - s['t_start'])
+        return np.clip(wav, min(s['start'], s['stop']), max(s['start'], s['stop']))
+
+    def trigger_times(self):
+        """
+        :return: array with the times of the output triggers of the current sweep (one per step)
+        """
+        s = self.sweep
+        if s is None or not s['step']:
+            return np.zeros(0)
+        num_steps = int(np.floor(abs(s['stop'] - s['start']) / s['step'] + 1e-9)) + 1
+        return s['t_start'] + np.arange(num_steps) * s['step'] / s['speed']
+
+    # Optical powers (mW)
+
+    def _with_noise(self, power):
+        power = np.asarray(power, dtype=float)
+        return np.maximum(power * (1 + self.noise * self.rng.standard_normal(power.shape)), 0.0)
+
+    def laser_output(self):
+        return self.laser_power if self.laser_on else 0.0
+
+    def through_power(self, wavelengths):
+        """
+        :param wavelengths: wavelength or array of wavelengths (nm)
+        :return: power (mW) after the device under test
+        """
+        power = (1 - self.tap_fraction) * self.laser_output() * self.dut.transmission(wavelengths, self.bias)
+        return self._with_noise(power)
+
+    def tap_power(self, wavelengths):
+        """
+        :param wavelengths: wavelength or array of wavelengths (nm)
+        :return: power (mW) at the tap
+        """
+        power = self.tap_fraction * self.laser_output() * np.ones(np.shape(wavelengths))
+        return self._with_noise(power)
+
+    def analog_output(self, port, wavelengths):
+        """
+        :param port: 'through' or 'tap'
+        :param wavelengths: wavelength or array of wavelengths (nm)
+        :return: voltage (V) at the analog output of the power meter of that port
+        """
+        power = self.through_power(wavelengths) if port == 'through' else self.tap_power(wavelengths)
+        return power / np.power(10, self.analog_range[port] / 10)
+
+    # Electrical
+
+    def device_current(self, voltage):
+        """
+        :param voltage: voltage or array of voltages applied to the device (V)
+        :return: current (A)
+        """
+        optical_power = float(self.through_power(self.wavelength_at(self.now()))) * 1e-3
+        current = self.diode.current(voltage, optical_power)
+        return current * (1 + self.noise * self.rng.standard_normal(np.shape(current)))
+
+    def device_voltage(self, current):
+        """
+        :param current: current forced through the device (A)
+        :return: voltage across the device (V)
+        """
+        voltages = np.linspace(-10, 2, 12001)
+        currents = self.device_current(voltages)
+        return float(np.interp(current, np.maximum.accumulate(currents), voltages))
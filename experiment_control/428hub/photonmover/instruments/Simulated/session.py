@@ -0,0 +1,269 @@
+import re
+from collections import deque
+
+# In-process stand-in for a pyvisa resource. The drivers talk to it exactly as
+# they talk to a real instrument (write, read_raw, query_ascii_values, binary
+# blocks through visalib.read...), and every transfer costs the time a GPIB
+# transaction would take, so that timing a measurement routine against the
+# simulated instruments gives numbers that mean something.
+#
+# Subclasses list the commands they understand in COMMANDS, as (regular
+# expression, method name) pairs. Each command (messages with several SCPI
+# commands separated by ';' are split) is matched against them in order, and the
+# method is called with the groups of the expression. It returns None, or the
+# response to a query. The response can be a (response, ready_time) tuple if the
+# instrument can only answer at a later (simulated) time, e.g. after a
+# measurement or a sweep finishes. Unknown commands go to the error queue.
+
+# pyvisa status of a read that stopped because the requested count was reached
+VI_SUCCESS = 0
+VI_SUCCESS_MAX_CNT = 0x3FFF0006
+
+_NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+
+def number(text):
+    """
+    Parses the first number in a command argument, ignoring units (e.g. '1.55E+03NM')
+    :param text: the argument string
+    :return: the number as a float
+    """
+    match = _NUMBER.search(text)
+    if match is None:
+        raise ValueError('No number in "%s"' % text)
+    return float(match.group(0))
+
+
+def numbers(text):
+    """
+    Parses all the numbers in a string of comma separated arguments
+    :param text: the arguments string
+    :return: list of floats
+    """
+    return [number(arg) for arg in text.split(',') if _NUMBER.search(arg)]
+
+
+def unit(text):
+    """
+    :param text: a command argument, e.g. '5.0000000E+00NM/S'
+    :return: the unit suffix after the number, in upper case ('' if there is none)
+    """
+    return _NUMBER.sub('', text.strip(), count=1).strip().upper()
+
+
+def with_units(text, units, default=1.0):
+    """
+    Parses a number followed by an optional unit suffix
+    :param text: the argument string, e.g. '2.0000000E+01MS'
+    :param units: dictionary suffix -> multiplier, e.g. {'MS': 1e-3, 'S': 1}
+    :param default: multiplier if there is no known suffix
+    :return: the number times the multiplier of its unit
+    """
+    return number(text) * units.get(unit(text), default)
+
+
+def wavelength_nm(text):
+    """
+    Parses a wavelength argument. SCPI wavelengths without units are in m.
+    :param text: the argument string, e.g. '1.5500000E+03NM' or '1.55E-6'
+    :return: the wavelength in nm
+    """
+    value = number(text)
+    if unit(text).startswith('NM'):
+        return value
+    return value * 1e9 if value < 1e-3 else value
+
+
+def definite_block(payload):
+    """
+    Wraps binary data in an IEEE 488.2 definite-length block header
+    :param payload: bytes
+    :return: '#<n><length><payload>' bytes
+    """
+    length = str(len(payload)).encode()
+    return b'#' + str(len(length)).encode() + length + payload
+
+
+class SimTimeoutError(TimeoutError):
+    pass
+
+
+class LatencyModel:
+    """
+    Timing of the bus and the instrument's command parser
+    """
+
+    def __init__(self, command_latency=2e-3, read_latency=1e-3, bandwidth=300e3):
+        """
+        :param command_latency: time (s) for the instrument to take and parse each message
+        :param read_latency: time (s) to address the instrument and start each read
+        :param bandwidth: transfer rate of the bus, in bytes/s
+        """
+        self.command_latency = command_latency
+        self.read_latency = read_latency
+        self.bandwidth = bandwidth
+
+    def write_time(self, num_bytes):
+        return self.command_latency + num_bytes / self.bandwidth
+
+    def read_time(self, num_bytes):
+        return self.read_latency + num_bytes / self.bandwidth
+
+
+class _SimVisaLib:
+    """
+    The part of the pyvisa library object that the binary block reader uses
+    """
+
+    def __init__(self, session):
+        self._session = session
+
+    def read(self, session, count):
+        return self._session.read_chunk(count)
+
+
+class SimSession:
+
+    # SCPI instruments accept several commands per message, separated by ';'
+    SPLIT_COMMANDS = True
+    LATENCY = LatencyModel()
+    COMMANDS = []
+
+    def __init__(self, address, bench, latency=None, timeout=2000, **kwargs):
+        """
+        :param address: VISA address the session is registered at
+        :param bench: SimBench with the state of the simulated setup
+        :param latency: LatencyModel. If None, the default of the instrument.
+        :param timeout: timeout in ms, as in pyvisa
+        :param kwargs: other pyvisa open_resource arguments, ignored
+        """
+        self.resource_name = address
+        self.bench = bench
+        self.latency = latency if latency is not None else self.LATENCY
+        self.timeout = timeout
+        self.session = id(self)
+        self.visalib = _SimVisaLib(self)
+
+        self._output = deque()  # (ready_time, response bytes) waiting to be read
+        self._current = None  # Response being read in chunks
+        self.stats = {'writes': 0, 'reads': 0, 'bytes_written': 0, 'bytes_read': 0}
+        self.errors = deque()  # Error messages, as the instrument's error queue
+        self.closed = False
+
+        self._commands = [(re.compile(pattern, re.IGNORECASE), getattr(self, method))
+                          for pattern, method in self.COMMANDS]
+
+    def handle(self, command):
+        """
+        Processes a single command
+        :param command: the command, without the leading ':' and surrounding whitespace
+        :return: None, the response (str or bytes) to a query, or a (response, ready_time) tuple
+        """
+        for pattern, method in self._commands:
+            match = pattern.fullmatch(command)
+            if match:
+                return method(*match.groups())
+
+        self.errors.append('-113,"Undefined header: %s"' % command)
+        return None
+
+    def next_error(self):
+        return self.errors.popleft() if self.errors else '0,"No error"'
+
+    def split_message(self, message):
+        if not self.SPLIT_COMMANDS:
+            return [message.strip()]
+
+        commands = []
+        for command in re.split(r';(?=(?:[^"]*"[^"]*")*[^"]*$)', message):
+            command = command.strip().lstrip(':').strip()
+            if command:
+                commands.append(command)
+        return commands
+
+    # pyvisa resource methods
+
+    def write(self, message):
+        data = message.encode() if isinstance(message, str) else bytes(message)
+        self.bench.sleep(self.latency.write_time(len(data) + 1))
+        self.stats['writes'] += 1
+        self.stats['bytes_written'] += len(data) + 1
+
+        responses = []
+        ready_time = self.bench.now()
+        for command in self.split_message(data.decode('ascii', errors='replace')):
+            response = self.handle(command)
+            if response is None:
+                continue
+            if isinstance(response, tuple):
+                response, ready = response
+                ready_time = max(ready_time, ready)
+            responses.append(response.encode() if isinstance(response, str) else bytes(response))
+
+        if responses:
+            self._output.append((ready_time, b';'.join(responses) + b'\n'))
+
+        return len(data)
+
+    def read_chunk(self, count):
+        """
+        Reads up to count bytes of the current response
+        :return: (data, status) as pyvisa's visalib.read
+        """
+        if not self._current:
+            self._current = bytearray(self._next_response())
+
+        data = bytes(self._current[:count])
+        del self._current[:count]
+
+        self.bench.sleep(self.latency.read_time(len(data)))
+        self.stats['reads'] += 1
+        self.stats['bytes_read'] += len(data)
+
+        return data, (VI_SUCCESS_MAX_CNT if self._current else VI_SUCCESS)
+
+    def read_raw(self, size=None):
+        data, status = self.read_chunk(len(self._current) if self._current else 1 << 30)
+        return data
+
+    def read_bytes(self, count, chunk_size=None, break_on_termchar=False):
+        data = bytearray()
+        while len(data) < count:
+            chunk, status = self.read_chunk(count - len(data))
+            data += chunk
+        return bytes(data)
+
+    def read(self, termination=None, encoding=None):
+        return self.read_raw().decode('ascii').rstrip('\r\n')
+
+    def query(self, message, delay=None):
+        self.write(message)
+        return self.read()
+
+    def query_ascii_values(self, message, converter='f', separator=',', container=list, delay=None):
+        response = self.query(message).strip()
+        convert = int if converter == 'd' else float
+        return container([convert(float(v)) for v in response.split(separator) if v.strip()])
+
+    def clear(self):
+        self._output.clear()
+        self._current = None
+
+    def close(self):
+        self.closed = True
+
+    def _next_response(self):
+        if not self._output:
+            self.bench.sleep(self.timeout / 1000.0)
+            raise SimTimeoutError('%s: nothing to read (no query pending)' % self.resource_name)
+
+        ready_time, response = self._output[0]
+        wait = ready_time - self.bench.now()
+        if wait > self.timeout / 1000.0:
+            self.bench.sleep(self.timeout / 1000.0)
+            raise SimTimeoutError('%s: the response is not ready within the %d ms timeout' %
+                                  (self.resource_name, self.timeout))
+
+        self.bench.wait_until(ready_time)
+        self._output.popleft()
+        return response
@@ -0,0 +1,68 @@
+import numpy as np
+from Interfaces.Instrument import Instrument
+from instruments.Simulated.session import SimTimeoutError
+
+# Simulated NI DAQ card, with the same methods as NiDAQ. The analog inputs see
+# the analog outputs of the power meters of the bench, and are sampled on the
+# output triggers of the laser sweep when a clock channel is given.
+
+DEFAULT_CHANNELS = {'Dev1/ai0': 'through', 'Dev1/ai1': 'tap'}
+TASK_TIMEOUT = 50  # s, same as NiDAQ.wait_task
+
+
+class SimNiDAQ(Instrument):
+
+    def __init__(self, bench, channels=None):
+        """
+        :param bench: SimBench with the state of the simulated setup
+        :param channels: dictionary analog input -> power meter port ('through' or 'tap') connected to it
+        """
+        super().__init__()
+        self.bench = bench
+        self.channels = dict(DEFAULT_CHANNELS) if channels is None else channels
+
+        self.input_channels = []
+        self.clk_channel = None
+        self.num_points = 0
+        self.sampling_freq = 1000
+        self.started_at = None
+        self.sample_times = None
+
+    def initialize(self):
+        pass
+
+    def close(self):
+        self.started_at = None
+
+    def configure_nsampl_acq(self, input_channels, clk_channel=None, num_points=2, max_sampling_freq=1000):
+        self.input_channels = list(input_channels)
+        self.clk_channel = clk_channel
+        self.num_points = num_points
+        self.sampling_freq = max_sampling_freq
+        self.started_at = None
+
+    def start_task(self):
+        self.started_at = self.bench.now()
+        self.sample_times = None
+
+    def wait_task(self):
+        if self.clk_channel is None:
+            times = self.started_at + np.arange(self.num_points) / self.sampling_freq
+        else:
+            # One sample per laser trigger after the task was started
+            times = self.bench.trigger_times()
+            times = times[times >= self.started_at][:self.num_points]
+
+        if len(times) < self.num_points or times[-1] > self.started_at + TASK_TIMEOUT:
+            self.bench.wait_until(self.started_at + TASK_TIMEOUT)
+            raise SimTimeoutError('The DAQ got %d of %d samples' % (len(times), self.num_points))
+
+        self.bench.wait_until(times[-1])
+        self.sample_times = times
+
+    def read_data(self, num_points):
+        if self.sample_times is None:
+            self.wait_task()
+
+        wavs = self.bench.wavelength_at(self.sample_times[:num_points])
+        return [list(self.bench.analog_output(self.channels[channel], wavs)) for channel in self.input_channels]
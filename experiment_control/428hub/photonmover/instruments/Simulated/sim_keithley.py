@@ -0,0 +1,365 @@
+import re
+import numpy as np
+from Interfaces.SourceMeter import POWER_LINE_FREQ
+from instruments.Simulated.session import SimSession, LatencyModel, number, numbers
+
+# Simulated Keithley source meters. The 2635A understands the TSP (Lua)
+# statements sent by Keithley2635A, including its trigger model sweeps, the
+# scripts in TSP_SCRIPTS and printbuffer in ASCII and REAL64. The 2400 understands
+# the SCPI subset used by Keithley2400. Both source the device of the bench, so
+# the measured currents follow its diode curve and the light reaching it.
+
+MEASUREMENT_OVERHEAD = 1e-3  # s per measurement on top of the integration time and delay
+
+
+class SimKeithley2635A(SimSession):
+
+    # TSP statements are sent one per message and can contain ';' or quotes
+    SPLIT_COMMANDS = False
+    LATENCY = LatencyModel(command_latency=1e-3, read_latency=1e-3, bandwidth=500e3)
+
+    COMMANDS = [
+        (r'loadscript (\w+)', 'load_script'),
+        (r'(\w+)\.run\(\)', 'run_script'),
+        (r'smua\.source\.output\s*=\s*smua\.OUTPUT_(ON|OFF)', 'set_output'),
+        (r'smua\.source\.func\s*=\s*smua\.OUTPUT_DC(VOLTS|AMPS)', 'set_func'),
+        (r'smua\.source\.(levelv|leveli|limitv|limiti|rangev|rangei)\s*=\s*(\S+)', 'set_source'),
+        (r'smua\.measure\.(\w+)\s*=\s*(\S+)', 'set_measure'),
+        (r'(\w+)\s*=\s*smua\.measure\.(i|v)\(\)', 'measure'),
+        (r'print\((\w+)\)', 'print_variable'),
+        (r'print\(smua\.source\.(levelv|leveli|limitv|limiti|rangev|rangei)\)', 'print_source'),
+        (r'smua\.nvbuffer1\.clear\(\)', 'clear_buffer'),
+        (r'smua\.nvbuffer1\.(\w+)\s*=\s*(\S+)', 'set_buffer'),
+        (r'smua\.trigger\.source\.linearv\((.+)\)', 'set_linear_sweep'),
+        (r'smua\.trigger\.count\s*=\s*(\d+)', 'set_trigger_count'),
+        (r'smua\.trigger\.initiate\(\)', 'initiate'),
+        (r'smua\.trigger\..*', 'set_trigger_model'),
+        (r'format\.(data|byteorder)\s*=\s*format\.(\w+)', 'set_format'),
+        (r'(?:errorqueue\.clear|waitcomplete|reset)\(\)', 'no_op'),
+        (r'printbuffer\(1,\s*(\d+),\s*(.+)\)', 'print_buffer'),
+        (r'(\w+)\((.*)\)', 'call_function'),
+    ]
+
+    def __init__(self, address, bench, **kwargs):
+        super().__init__(address, bench, **kwargs)
+
+        self.output = False
+        self.func = 'VOLTS'
+        self.source = {'levelv': 0.0, 'leveli': 0.0, 'limitv': 20.0, 'limiti': 0.1, 'rangev': 20.0,
+                       'rangei': 0.1}
+        self.measure_settings = {'nplc': 1.0, 'delay': 0.0, 'interval': 0.0, 'count': 1}
+        self.format = {'data': 'ASCII', 'byteorder': 'LITTLEENDIAN'}
+        self.variables = {}  # Lua variables holding measurements, name -> (value, ready time)
+
+        self.buffer = {'readings': np.zeros(0), 'sourcevalues': np.zeros(0), 'timestamps': np.zeros(0)}
+        self.append_mode = False
+        self.sweep_voltages = np.zeros(0)
+        self.trigger_count = 1
+        self.busy_until = 0.0  # The instrument processes commands sequentially
+
+        self.loading = None  # (name, lines) of the script being loaded
+        self.scripts = {}  # Loaded scripts, name -> source
+        self.functions = set()  # Functions defined by the scripts that have been run
+
+    def handle(self, command):
+        if self.loading is not None:
+            name, lines = self.loading
+            if command == 'endscript':
+                self.scripts[name] = '\n'.join(lines)
+                self.loading = None
+            else:
+                lines.append(command)
+            return None
+
+        return super().handle(command)
+
+    def start_time(self):
+        return max(self.bench.now(), self.busy_until)
+
+    def measurement_time(self, nplc=None):
+        nplc = self.measure_settings['nplc'] if nplc is None else nplc
+        return nplc / POWER_LINE_FREQ + self.measure_settings['delay'] + MEASUREMENT_OVERHEAD
+
+    def update_bias(self):
+        on = self.output and self.func == 'VOLTS'
+        self.bench.bias = self.source['levelv'] if on else 0.0
+
+    # Scripts
+
+    def load_script(self, name):
+        self.loading = (name, [])
+
+    def run_script(self, name):
+        if name not in self.scripts:
+            self.errors.append('-285,"Program syntax error: %s is not loaded"' % name)
+            return
+        self.functions.update(re.findall(r'function (\w+)\(', self.scripts[name]))
+
+    def call_function(self, name, args):
+        if name not in self.functions:
+            self.errors.append('-285,"Program syntax error: %s is not defined"' % name)
+            return
+
+        values = []
+        for arg in args.split(','):
+            try:
+                values.append(float(arg))
+            except ValueError:
+                values.append(arg.strip())  # Lua expression, e.g. the gate SMU
+        getattr(self, 'script_' + name)(*values)
+
+    def script_pulsed_iv(self, vbias, vstart, vstop, n, width, period, nplc, ilimit):
+        n = int(n)
+        volts = np.linspace(vstart, vstop, n)
+        t0 = self.start_time()
+        self.fill_buffer(volts, self.bench.device_current(volts), t0 + np.arange(n) * period)
+        self.busy_until = t0 + n * period
+        self.source['levelv'] = vbias
+        self.output = True
+        self.update_bias()
+
+    def script_output_curve(self, gate, vgs_start, vgs_stop, n_vgs, vds_start, vds_stop, n_vds, nplc,
+                            ilimit_d, ilimit_g):
+        # The gate SMU is not simulated: every gate voltage gives the drain curve of the bench device
+        volts = np.tile(np.linspace(vds_start, vds_stop, int(n_vds)), int(n_vgs))
+        t0 = self.start_time()
+        times = t0 + np.arange(len(volts)) * self.measurement_time(nplc)
+        self.fill_buffer(volts, self.bench.device_current(volts), times)
+        self.busy_until = t0 + len(volts) * self.measurement_time(nplc)
+        self.output = True
+        self.source['levelv'] = vds_stop
+        self.update_bias()
+
+    def script_current_logger(self, n, interval, nplc):
+        n = int(n)
+        period = max(interval, self.measurement_time(nplc))
+        t0 = self.start_time()
+        times = np.arange(n) * period
+        self.fill_buffer(np.full(n, self.bench.bias), self.bench.device_current(np.full(n, self.bench.bias)),
+                         times)
+        self.busy_until = t0 + n * period
+
+    # Source and measure
+
+    def set_output(self, state):
+        self.output = state.upper() == 'ON'
+        self.update_bias()
+
+    def set_func(self, func):
+        self.func = func.upper()
+        self.update_bias()
+
+    def set_source(self, setting, value):
+        self.source[setting] = float(value)
+        self.update_bias()
+
+    def set_measure(self, setting, value):
+        try:
+            self.measure_settings[setting] = float(value)
+        except ValueError:
+            pass  # Constants like smua.AUTOZERO_ONCE
+
+    def measure(self, variable, quantity):
+        ready = self.start_time() + self.measurement_time()
+        if quantity == 'i':
+            value = float(self.bench.device_current(self.bench.bias))
+        else:
+            value = self.bench.bias if self.func == 'VOLTS' else self.bench.device_voltage(self.source['leveli'])
+        self.variables[variable] = (value, ready)
+        self.busy_until = ready
+
+    def print_variable(self, variable):
+        if variable not in self.variables:
+            return 'nil'
+        value, ready = self.variables[variable]
+        return '%.8e' % value, ready
+
+    def print_source(self, setting):
+        return '%.8e' % self.source[setting]
+
+    # Buffer and trigger model
+
+    def clear_buffer(self):
+        self.buffer = {field: np.zeros(0) for field in self.buffer}
+
+    def set_buffer(self, setting, value):
+        if setting == 'appendmode':
+            self.append_mode = bool(int(value))
+
+    def fill_buffer(self, sourcevalues, readings, timestamps):
+        new = {'sourcevalues': sourcevalues, 'readings': readings, 'timestamps': timestamps}
+        for field in self.buffer:
+            if self.append_mode:
+                self.buffer[field] = np.concatenate((self.buffer[field], new[field]))
+            else:
+                self.buffer[field] = np.asarray(new[field], dtype=float)
+
+    def set_linear_sweep(self, args):
+        start, stop, n = numbers(args)
+        self.sweep_voltages = np.linspace(start, stop, int(n))
+
+    def set_trigger_count(self, count):
+        self.trigger_count = int(count)
+
+    def set_trigger_model(self):
+        pass  # Actions and stimuli: the simulated sweeps always source and measure every point
+
+    def initiate(self):
+        volts = self.sweep_voltages[:self.trigger_count]
+        t0 = self.start_time()
+        times = t0 + (np.arange(len(volts)) + 1) * self.measurement_time()
+        self.fill_buffer(volts, self.bench.device_current(volts), times)
+        self.busy_until = t0 + len(volts) * self.measurement_time()
+        if len(volts):
+            self.source['levelv'] = volts[-1]  # SOURCE_HOLD
+            self.update_bias()
+
+    def set_format(self, setting, value):
+        self.format[setting] = value.upper()
+
+    def no_op(self):
+        pass
+
+    def print_buffer(self, num_points, fields):
+        fields = [f.strip().split('.')[-1] for f in fields.split(',')]
+        num_points = int(num_points)
+        data = np.column_stack([self.buffer[f][:num_points] for f in fields]).ravel()
+
+        if self.format['data'] == 'REAL64':
+            dtype = '<f8' if self.format['byteorder'].startswith('LITTLE') else '>f8'
+            response = b'#0' + data.astype(dtype).tobytes()
+        else:
+            response = ', '.join('%.8e' % v for v in data)
+
+        return response, self.busy_until
+
+
+class SimKeithley2400(SimSession):
+
+    LATENCY = LatencyModel(command_latency=2e-3, read_latency=1e-3, bandwidth=200e3)
+
+    COMMANDS = [
+        (r'\*IDN\?', 'idn'),
+        (r'\*RST', 'rst'),
+        (r'OUTP (ON|OFF|1|0)', 'set_output'),
+        (r'SOUR:FUNC:MODE (\w+)', 'set_func'),
+        (r'SOUR:VOLT (\S+)', 'set_voltage'),
+        (r'SOUR:CURR (\S+)', 'set_current'),
+        (r'SOUR:VOLT:MODE (\w+)', 'set_voltage_mode'),
+        (r'SOUR:VOLT:STAR (\S+)', 'set_sweep_start'),
+        (r'SOUR:VOLT:STOP (\S+)', 'set_sweep_stop'),
+        (r'SOUR:SWE:POIN (\d+)', 'set_sweep_points'),
+        (r'SOUR:DEL (\S+)', 'set_delay'),
+        (r'SOUR:DEL\?', 'source_delay'),
+        (r'SENS:CURR:NPLC (\S+)', 'set_nplc'),
+        (r'TRIG:COUN (\d+)', 'set_trigger_count'),
+        (r'FORM:ELEM (.+)', 'set_elements'),
+        (r'FORM:ELEM\?', 'elements'),
+        (r'MEAS:CURR\?', 'measure_current'),
+        (r'MEAS:VOLT\?', 'measure_voltage'),
+        (r'READ\?', 'read_sweep'),
+        (r'(?:SENS|SOUR|DATA|SYST)[^?]*', 'other_setting'),
+    ]
+
+    def __init__(self, address, bench, **kwargs):
+        super().__init__(address, bench, **kwargs)
+        self.rst()
+
+    def idn(self):
+        return 'KEITHLEY INSTRUMENTS INC.,MODEL 2400,SIM00000,C30'
+
+    def rst(self):
+        self.output = False
+        self.func = 'VOLT'
+        self.level = {'VOLT': 0.0, 'CURR': 0.0}
+        self.voltage_mode = 'FIXE'
+        self.sweep = {'start': 0.0, 'stop': 0.0, 'points': 2}
+        self.delay = 0.0
+        self.nplc = 1.0
+        self.trigger_count = 1
+        self.element_list = 'VOLT,CURR,RES,TIME,STAT'
+        self.busy_until = 0.0
+
+    def update_bias(self):
+        on = self.output and self.func == 'VOLT'
+        self.bench.bias = self.level['VOLT'] if on else 0.0
+
+    def set_output(self, state):
+        self.output = state.upper() in ['ON', '1']
+        self.update_bias()
+
+    def set_func(self, func):
+        self.func = func.upper()
+        self.update_bias()
+
+    def set_voltage(self, value):
+        self.level['VOLT'] = number(value)
+        self.update_bias()
+
+    def set_current(self, value):
+        self.level['CURR'] = number(value)
+
+    def set_voltage_mode(self, mode):
+        self.voltage_mode = mode.upper()
+
+    def set_sweep_start(self, value):
+        self.sweep['start'] = number(value)
+
+    def set_sweep_stop(self, value):
+        self.sweep['stop'] = number(value)
+
+    def set_sweep_points(self, points):
+        self.sweep['points'] = int(points)
+
+    def set_delay(self, value):
+        self.delay = number(value)
+
+    def source_delay(self):
+        return '%.6E' % self.delay
+
+    def set_nplc(self, value):
+        self.nplc = number(value)
+
+    def set_trigger_count(self, count):
+        self.trigger_count = int(count)
+
+    def set_elements(self, elements):
+        self.element_list = elements.strip().upper()
+
+    def elements(self):
+        return self.element_list
+
+    def other_setting(self):
+        pass  # Ranges, compliances and data format do not change the simulated readings
+
+    def measurement_time(self):
+        return self.nplc / POWER_LINE_FREQ + self.delay + MEASUREMENT_OVERHEAD
+
+    def measure_current(self):
+        ready = max(self.bench.now(), self.busy_until) + self.measurement_time()
+        self.busy_until = ready
+        return '%.6E' % float(self.bench.device_current(self.bench.bias)), ready
+
+    def measure_voltage(self):
+        ready = max(self.bench.now(), self.busy_until) + self.measurement_time()
+        self.busy_until = ready
+        return '%.6E' % self.bench.bias, ready
+
+    def read_sweep(self):
+        if self.voltage_mode.startswith('SWE'):
+            volts = np.linspace(self.sweep['start'], self.sweep['stop'], self.sweep['points'])
+        else:
+            volts = np.full(1, self.level['VOLT'])
+        volts = np.resize(volts, self.trigger_count)
+
+        ready = max(self.bench.now(), self.busy_until) + len(volts) * self.measurement_time()
+        self.busy_until = ready
+        self.level['VOLT'] = volts[-1]
+        self.update_bias()
+
+        elements = {'VOLT': volts, 'CURR': self.bench.device_current(volts),
+                    'RES': volts / (self.bench.device_current(volts) + 1e-15),
+                    'TIME': ready - (len(volts) - 1 - np.arange(len(volts))) * self.measurement_time(),
+                    'STAT': np.zeros(len(volts))}
+        data = np.column_stack([elements[e] for e in self.element_list.split(',')]).ravel()
+        return ','.join('%+.6E' % v for v in data), ready
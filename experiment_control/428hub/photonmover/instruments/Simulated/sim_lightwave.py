@@ -0,0 +1,310 @@
+import numpy as np
+from instruments.Simulated.session import SimSession, LatencyModel, number, unit, with_units, \
+    wavelength_nm, definite_block
+
+# Simulated HP/Agilent 8164 lightwave mainframe: tunable laser in slot 0 and
+# power sensors in the other slots. Understands the commands used by
+# HPLightWave (short forms only): laser power and wavelength, single power
+# measurements (INIT:IMM / FETC?), and continuous sweeps with lambda logging and
+# power logging triggered by the laser.
+
+POWER_UNITS = {'DBM': None, 'MW': 1.0, 'UW': 1e-3, 'NW': 1e-6, 'W': 1e3}
+TIME_UNITS = {'S': 1.0, 'MS': 1e-3, 'US': 1e-6}
+
+_CH = r'(?::CHAN\d)?'  # Optional channel of the slot, all sensors have a single one
+
+
+class _PowerSensor:
+    """
+    State of a power sensor slot
+    """
+
+    def __init__(self, port):
+        self.port = port  # 'tap' or 'through'
+        self.atime = 0.1  # Averaging time (s)
+        self.unit = 1  # 0: dBm, 1: W
+        self.auto_range = True
+        self.range = 0.0  # dBm
+        self.continuous = True
+        self.meas_start = None  # Start of the last single measurement
+        self.log_points = 100
+        self.log_atime = 0.1  # Averaging time of each logged point (s)
+        self.trigger_input = 'IGN'
+        self.armed_at = None  # Time logging was started
+
+
+class SimHPLightWave(SimSession):
+
+    # Time the laser takes to get to the start wavelength and start sweeping (s)
+    SWEEP_SETUP_TIME = 0.5
+    LATENCY = LatencyModel(command_latency=3e-3, read_latency=1e-3, bandwidth=500e3)
+
+    COMMANDS = [
+        (r'\*IDN\?', 'idn'),
+        (r'\*OPC\?', 'opc'),
+        (r'\*CLS', 'cls'),
+        (r'\*RST', 'rst'),
+        (r'SYST:ERR\?', 'next_error'),
+        (r'POW:STAT (\d)', 'set_laser_state'),
+        (r'POW:STAT\?', 'laser_state'),
+        (r'POW (.+)', 'set_power'),
+        (r'POW\?', 'power'),
+        (r'WAV (.+)', 'set_wavelength'),
+        (r'WAV\?', 'wavelength'),
+        (r'WAV:SWE:CYCL (.+)', 'set_sweep_cycles'),
+        (r'WAV:SWE:MODE (\w+)', 'set_sweep_mode'),
+        (r'WAV:SWE:LLOG (\d)', 'set_lambda_logging'),
+        (r'WAV:SWE:SPE (.+)', 'set_sweep_speed'),
+        (r'WAV:SWE:STEP (.+)', 'set_sweep_step'),
+        (r'WAV:SWE:STAR (.+)', 'set_sweep_start'),
+        (r'WAV:SWE:STOP (.+)', 'set_sweep_stop'),
+        (r'WAV:SWE:CHEC\?', 'check_sweep'),
+        (r'WAV:SWE (\w+)', 'sweep'),
+        (r'WAV:SWE\?', 'sweep_state'),
+        (r'TRIG0:OUTP (\w+)', 'set_output_trigger'),
+        (r'TRIG(\d)' + _CH + r':INP (\w+)', 'set_input_trigger'),
+        (r'SENS(\d)' + _CH + r':POW:WAV (.+)', 'set_sensor_wavelength'),
+        (r'SENS(\d)' + _CH + r':POW:ATIME (.+)', 'set_atime'),
+        (r'SENS(\d)' + _CH + r':POW:UNIT (\d)', 'set_unit'),
+        (r'SENS(\d)' + _CH + r':POW:RANG:AUTO (\d)', 'set_auto_range'),
+        (r'SENS(\d)' + _CH + r':POW:RANG (.+)', 'set_range'),
+        (r'SENS(\d)' + _CH + r':FUNC:PAR:LOGG (.+)', 'set_logging'),
+        (r'SENS(\d)' + _CH + r':FUNC:STAT (\w+),(\w+)', 'set_function_state'),
+        (r'SENS(\d)' + _CH + r':FUNC:STATE?\?', 'function_state'),
+        (r'SENS(\d)' + _CH + r':FUNC:RES\?', 'logged_powers'),
+        (r'INIT(\d)' + _CH + r':CONT (\d)', 'set_continuous'),
+        (r'INIT(\d)' + _CH + r':IMM', 'start_measurement'),
+        (r'FETC(\d)' + _CH + r':POW\?', 'fetch_power'),
+        (r'SOUR0:READ:DATA\? LLOG', 'lambda_log'),
+    ]
+
+    def __init__(self, address, bench, tap_channel=1, num_slots=4, **kwargs):
+        """
+        :param tap_channel: slot of the sensor measuring the tap. The others measure the through port.
+        :param num_slots: number of power sensor slots
+        """
+        super().__init__(address, bench, **kwargs)
+
+        self.sensors = {slot: _PowerSensor('tap' if slot == tap_channel else 'through')
+                        for slot in range(1, num_slots + 1)}
+
+        self.sweep_settings = {'cycles': 1, 'mode': 'CONT', 'llog': False, 'speed': 5.0, 'step': 0.1,
+                               'start': 1520.0, 'stop': 1580.0, 'output_trigger': 'DIS'}
+        self.last_sweep = None  # Sweep dictionary of the bench for the last sweep started here
+
+    def sensor(self, slot):
+        return self.sensors[int(slot)]
+
+    # Common commands
+
+    def idn(self):
+        return 'HEWLETT-PACKARD,8164A,SIM00000,V4.1'
+
+    def opc(self):
+        return '+1'
+
+    def cls(self):
+        self.errors.clear()
+
+    def rst(self):
+        self.bench.laser_on = False
+        self.bench.stop_sweep()
+        self.last_sweep = None
+        self.sensors = {slot: _PowerSensor(sensor.port) for slot, sensor in self.sensors.items()}
+
+    # Laser
+
+    def set_laser_state(self, state):
+        self.bench.laser_on = bool(int(state))
+
+    def laser_state(self):
+        return '+%d' % int(self.bench.laser_on)
+
+    def set_power(self, arg):
+        multiplier = POWER_UNITS.get(unit(arg), 1e3)
+        if multiplier is None:
+            self.bench.laser_power = np.power(10, number(arg) / 10)
+        else:
+            self.bench.laser_power = number(arg) * multiplier
+
+    def power(self):
+        return '%E' % (self.bench.laser_power * 1e-3)
+
+    def set_wavelength(self, arg):
+        self.bench.set_wavelength(wavelength_nm(arg))
+
+    def wavelength(self):
+        return '%E' % (float(self.bench.wavelength_at(self.bench.now())) * 1e-9)
+
+    # Sweeps
+
+    def set_sweep_cycles(self, arg):
+        self.sweep_settings['cycles'] = int(number(arg))
+
+    def set_sweep_mode(self, mode):
+        self.sweep_settings['mode'] = mode.upper()
+
+    def set_lambda_logging(self, state):
+        self.sweep_settings['llog'] = bool(int(state))
+
+    def set_sweep_speed(self, arg):
+        self.sweep_settings['speed'] = wavelength_nm(arg)
+
+    def set_sweep_step(self, arg):
+        self.sweep_settings['step'] = wavelength_nm(arg)
+
+    def set_sweep_start(self, arg):
+        self.sweep_settings['start'] = wavelength_nm(arg)
+
+    def set_sweep_stop(self, arg):
+        self.sweep_settings['stop'] = wavelength_nm(arg)
+
+    def set_output_trigger(self, mode):
+        self.sweep_settings['output_trigger'] = mode.upper()
+
+    def check_sweep(self):
+        s = self.sweep_settings
+        if s['stop'] <= s['start']:
+            return '368,End Wavelength must be greater than Start Wavelength'
+        if s['step'] <= 0 or s['step'] > s['stop'] - s['start']:
+            return '369,Step size too large or too small'
+        if s['llog'] and (s['mode'] != 'CONT' or not s['output_trigger'].startswith('STF')):
+            return '321,Lambda logging only in continuous mode with STFinished trigger'
+        return '0,OK'
+
+    def sweep(self, action):
+        action = action.upper()
+        if action.startswith('STAR'):
+            s = self.sweep_settings
+            step = s['step'] if s['output_trigger'] != 'DIS' else None
+            self.last_sweep = self.bench.start_sweep(s['start'], s['stop'], s['speed'], step=step,
+                                                     t=self.bench.now() + self.SWEEP_SETUP_TIME)
+        elif action.startswith('STOP'):
+            self.bench.stop_sweep()
+        else:
+            self.errors.append('-224,"Illegal parameter value: %s"' % action)
+
+    def sweep_state(self):
+        sweeping = self.last_sweep is not None and self.bench.sweep is self.last_sweep and \
+                   self.bench.now() < self.last_sweep['t_end']
+        return '+%d' % int(sweeping)
+
+    def sweep_triggers(self):
+        """
+        :return: array with the times of the output triggers of the last sweep
+        """
+        if self.last_sweep is None or self.bench.sweep is not self.last_sweep:
+            return np.zeros(0)
+        return self.bench.trigger_times()
+
+    def lambda_log(self):
+        if not self.sweep_settings['llog'] or self.last_sweep is None:
+            self.errors.append('-221,"Settings conflict: no lambda logging data"')
+            return definite_block(b'')
+
+        s = self.last_sweep
+        wavs = s['start'] + np.arange(len(self.sweep_triggers())) * (s['step'] or 0)
+        # Available once the sweep has finished
+        return definite_block((wavs * 1e-9).astype('<f8').tobytes()), s['t_end']
+
+    # Power sensors
+
+    def set_input_trigger(self, slot, mode):
+        self.sensor(slot).trigger_input = mode.upper()
+
+    def set_sensor_wavelength(self, slot, arg):
+        pass  # The simulated sensors are not wavelength dependent
+
+    def set_atime(self, slot, arg):
+        self.sensor(slot).atime = with_units(arg, TIME_UNITS)
+
+    def set_unit(self, slot, unit):
+        self.sensor(slot).unit = int(unit)
+
+    def set_auto_range(self, slot, state):
+        self.sensor(slot).auto_range = bool(int(state))
+
+    def set_range(self, slot, arg):
+        sensor = self.sensor(slot)
+        sensor.range = number(arg)
+        self.bench.analog_range[sensor.port] = sensor.range
+
+    def set_continuous(self, slot, state):
+        self.sensor(slot).continuous = bool(int(state))
+
+    def start_measurement(self, slot):
+        self.sensor(slot).meas_start = self.bench.now()
+
+    def measure(self, sensor, wavelengths):
+        """
+        :return: power (in the units of the sensor) at the given wavelengths
+        """
+        if sensor.port == 'tap':
+            power = self.bench.tap_power(wavelengths)
+        else:
+            power = self.bench.through_power(wavelengths)
+
+        if sensor.unit == 0:
+            return 10 * np.log10(power + 1e-12)
+        return power * 1e-3
+
+    def fetch_power(self, slot):
+        sensor = self.sensor(slot)
+        if sensor.continuous or sensor.meas_start is None:
+            t = self.bench.now()
+            ready = t
+        else:
+            t = sensor.meas_start + sensor.atime / 2
+            ready = sensor.meas_start + sensor.atime
+
+        power = self.measure(sensor, self.bench.wavelength_at(t))
+        return '%+.7E' % power, ready
+
+    def set_logging(self, slot, args):
+        num_points, atime = args.split(',')
+        sensor = self.sensor(slot)
+        sensor.log_points = int(number(num_points))
+        sensor.log_atime = with_units(atime, TIME_UNITS)
+
+    def set_function_state(self, slot, function, action):
+        sensor = self.sensor(slot)
+        if action.upper().startswith('STAR'):
+            sensor.armed_at = self.bench.now()
+        else:
+            sensor.armed_at = None
+
+    def log_times(self, sensor):
+        """
+        :return: array with the start times of the logged points of the sensor (only those
+                that have already been triggered), and the time the whole log is complete
+                (None if there are not enough triggers to complete it)
+        """
+        if sensor.armed_at is None:
+            return np.zeros(0), None
+
+        if sensor.trigger_input.startswith('SME'):
+            triggers = self.sweep_triggers()
+            triggers = triggers[triggers >= sensor.armed_at][:sensor.log_points]
+        else:
+            # Free running
+            triggers = sensor.armed_at + np.arange(sensor.log_points) * sensor.log_atime
+
+        t_done = triggers[-1] + sensor.log_atime if len(triggers) == sensor.log_points else None
+        return triggers, t_done
+
+    def function_state(self, slot):
+        triggers, t_done = self.log_times(self.sensor(slot))
+        if t_done is not None and self.bench.now() >= t_done:
+            return 'LOGGING_STABILITY,COMPLETE'
+        return 'LOGGING_STABILITY,PROGRESS'
+
+    def logged_powers(self, slot):
+        sensor = self.sensor(slot)
+        triggers, t_done = self.log_times(sensor)
+        if t_done is None:
+            self.errors.append('-230,"Data corrupt or stale: logging not complete"')
+            return definite_block(b'')
+
+        wavs = self.bench.wavelength_at(triggers + sensor.log_atime / 2)
+        powers = self.measure(sensor, wavs)
+        return definite_block(powers.astype('<f4').tobytes()), t_done
@@ -0,0 +1,280 @@
+import numpy as np
+from instruments.Simulated.session import SimSession, LatencyModel, number, wavelength_nm, definite_block
+
+# Simulated Santec TSL-550 tunable laser and MPM-200 power meter, with the
+# commands used by SantecTSL550 and SantecMPM200. The power meter logs the
+# light that the laser sends through the device when it is triggered by the
+# start of a laser sweep, the way the two are wired for perform_tx_measurement_MPM200.
+
+NOISE_FLOOR = -80.0  # dBm, reading of the ports without light
+
+
+def power_offset(wavelengths):
+    """
+    Calibrated wavelength dependence of the MPM-200 sensors (CWAVPO?)
+    :param wavelengths: wavelength or array of wavelengths (nm)
+    :return: offset (dB) that has to be added to the raw readings
+    """
+    return 0.5 * ((np.asarray(wavelengths, dtype=float) - 1450.0) / 180.0) ** 2
+
+
+class SimSantecTSL550(SimSession):
+
+    # Time the laser takes to get to the start wavelength and start sweeping (s)
+    SWEEP_SETUP_TIME = 0.2
+    LATENCY = LatencyModel(command_latency=5e-3, read_latency=2e-3, bandwidth=200e3)
+
+    COMMANDS = [
+        (r'\*IDN\?', 'idn'),
+        (r'\*RST', 'rst'),
+        (r'SOUR:TRIG:INP:EXT (\d)', 'set_input_trigger'),
+        (r'SOUR:TRIG:OUTP (\d)', 'set_output_trigger'),
+        (r'SOUR:TRIG:OUTP:STEP:WIDT (.+)', 'set_trigger_step'),
+        (r'SOUR:POW:STAT (\d)', 'set_diode_state'),
+        (r'SOUR:POW:STAT\?', 'diode_state'),
+        (r'SOUR:POW:SHUT (\d)', 'set_shutter'),
+        (r'SOUR:POW:UNIT (\d)', 'set_power_unit'),
+        (r'SOUR:POW:LEV (.+)', 'set_power'),
+        (r'SOUR:WAV (.+)', 'set_wavelength'),
+        (r'SOUR:WAV:SWE:(CYCL|DEL|DWEL|MOD|SPE|STAR|STOP|STEP) (.+)', 'set_sweep_setting'),
+        (r'SOUR:WAV:SWE:STAT (\d)', 'set_sweep_state'),
+        (r'SOUR:WAV:SWE:STAT\?', 'sweep_state'),
+        (r'SOUR:WAV:SWE:REP', 'repeat_sweep'),
+    ]
+
+    def __init__(self, address, bench, **kwargs):
+        super().__init__(address, bench, **kwargs)
+
+        self.diode_on = False
+        self.shutter = True
+        self.power_unit = 0  # 0: dBm, 1: mW
+        self.output_trigger = 0
+        self.trigger_step = 0.1
+        self.sweep_settings = {'CYCL': 1, 'DEL': 0, 'DWEL': 0.1, 'MOD': 1, 'SPE': 10.0,
+                               'STAR': 1500.0, 'STOP': 1600.0, 'STEP': 0.1}
+        self.last_sweep = None
+
+    def idn(self):
+        return 'SANTEC,TSL-550,SIM00000,0001.0000'
+
+    def rst(self):
+        self.set_diode_state(0)
+        self.bench.stop_sweep()
+
+    def update_laser(self):
+        self.bench.laser_on = self.diode_on and not self.shutter
+
+    def set_input_trigger(self, state):
+        pass  # The sweeps are always started with SOUR:WAV:SWE:STAT 1
+
+    def set_output_trigger(self, mode):
+        self.output_trigger = int(mode)
+
+    def set_trigger_step(self, arg):
+        self.trigger_step = number(arg)
+
+    def set_diode_state(self, state):
+        self.diode_on = bool(int(state))
+        self.update_laser()
+
+    def diode_state(self):
+        return '%d' % int(self.diode_on)
+
+    def set_shutter(self, state):
+        self.shutter = bool(int(state))
+        self.update_laser()
+
+    def set_power_unit(self, unit):
+        self.power_unit = int(unit)
+
+    def set_power(self, arg):
+        if self.power_unit == 0:
+            self.bench.laser_power = np.power(10, number(arg) / 10)
+        else:
+            self.bench.laser_power = number(arg)
+
+    def set_wavelength(self, arg):
+        self.bench.set_wavelength(wavelength_nm(arg))
+
+    def set_sweep_setting(self, setting, arg):
+        self.sweep_settings[setting.upper()] = number(arg)
+
+    def set_sweep_state(self, state):
+        if not int(state):
+            self.bench.stop_sweep()
+            return
+
+        s = self.sweep_settings
+        if int(s['MOD']) in [0, 2]:
+            # Stepped sweep: the same wavelengths in the same time, without the steps
+            speed = s['STEP'] / max(s['DWEL'], 1e-3)
+        else:
+            speed = s['SPE']
+
+        step = self.trigger_step if self.output_trigger == 3 else None
+        self.last_sweep = self.bench.start_sweep(s['STAR'], s['STOP'], speed, step=step,
+                                                 t=self.bench.now() + self.SWEEP_SETUP_TIME)
+
+    def sweep_state(self):
+        sweeping = self.last_sweep is not None and self.bench.sweep is self.last_sweep and \
+                   self.bench.now() < self.last_sweep['t_end']
+        return '%d' % int(sweeping)
+
+    def repeat_sweep(self):
+        self.set_sweep_state(1)
+
+
+class SimSantecMPM200(SimSession):
+
+    LATENCY = LatencyModel(command_latency=5e-3, read_latency=2e-3, bandwidth=200e3)
+
+    COMMANDS = [
+        (r'\*IDN\?', 'idn'),
+        (r'ERR\?', 'next_error'),
+        (r'STAT\?', 'status'),
+        (r'WMOD (\w+)', 'set_mode'),
+        (r'UNIT (\d)', 'set_unit'),
+        (r'TRIG (\d)', 'set_trigger'),
+        (r'LOGN (\d+)', 'set_num_samples'),
+        (r'WSET (\S+) (\S+) (\S+)', 'set_sweep_wavelengths'),
+        (r'SPE (.+)', 'set_sweep_speed'),
+        (r'FGSAVG (.+)', 'set_fgs_average_time'),
+        (r'WAV (.+)', 'set_wavelength'),
+        (r'AVG (.+)', 'set_average_time'),
+        (r'LEV (\d)(?:,.*)?', 'set_level'),
+        (r'LEV\?', 'level'),
+        (r'MEAS', 'start_measurement'),
+        (r'STOP', 'stop_measurement'),
+        (r'CWAVPO\? (\d+),(\d+),(\d+)', 'calibrated_offset'),
+        (r'LOGG\? (\d+),(\d+)', 'logged_data'),
+        (r'READ\? (\d+)', 'read_powers'),
+    ]
+
+    def __init__(self, address, bench, rec_port=1, tap_port=2, **kwargs):
+        """
+        :param rec_port: port that measures the through power
+        :param tap_port: port that measures the tap power
+        """
+        super().__init__(address, bench, **kwargs)
+
+        self.ports = {rec_port: 'through', tap_port: 'tap'}
+        self.mode = 'CONST1'
+        self.unit = 0  # 0: dBm, 1: mW
+        self.external_trigger = False
+        self.num_samples = 1
+        self.sweep_wavelengths = (1500.0, 1600.0, 1.0)
+        self.sweep_speed = 1.0
+        self.wavelength = 1550.0
+        self.average_time = 1e-3  # s
+        self.gain_level = 1
+        self.armed_at = None  # Time MEAS was received
+
+    def idn(self):
+        return 'santec,MPM-210,SIM00000,Ver1.00'
+
+    def set_mode(self, mode):
+        self.mode = mode.upper()
+
+    def set_unit(self, unit):
+        self.unit = int(unit)
+
+    def set_trigger(self, external):
+        self.external_trigger = bool(int(external))
+
+    def set_num_samples(self, samples):
+        self.num_samples = int(samples)
+
+    def set_sweep_wavelengths(self, start, stop, step):
+        self.sweep_wavelengths = (number(start), number(stop), number(step))
+
+    def set_sweep_speed(self, arg):
+        self.sweep_speed = number(arg)
+
+    def set_fgs_average_time(self, arg):
+        pass  # Auto gain does not change the simulated readings
+
+    def set_wavelength(self, arg):
+        self.wavelength = wavelength_nm(arg)
+
+    def set_average_time(self, arg):
+        self.average_time = number(arg) * 1e-3
+
+    def set_level(self, level):
+        self.gain_level = int(level)
+
+    def level(self):
+        return '%d' % self.gain_level
+
+    def start_measurement(self):
+        self.armed_at = self.bench.now()
+
+    def stop_measurement(self):
+        pass  # The simulated log is kept until the next MEAS
+
+    def calibrated_offset(self, module, port, index):
+        return '%.3f' % power_offset(1270 + 20 * (int(index) - 1))
+
+    def sample_times(self):
+        """
+        :return: array with the (mid) times of all the samples of the current measurement,
+                None if it has not been triggered yet
+        """
+        if self.armed_at is None:
+            return None
+
+        if self.external_trigger:
+            # Triggered by the laser at the start of its sweep
+            sweep = self.bench.sweep
+            if sweep is None or sweep['t_start'] < self.armed_at:
+                return None
+            t_start = sweep['t_start']
+        else:
+            t_start = self.armed_at
+
+        if self.mode.startswith('SWEEP'):
+            start, stop, step = self.sweep_wavelengths
+            wavs = np.arange(start, stop + step / 2, step)
+            return t_start + np.abs(wavs - start) / self.sweep_speed
+
+        return t_start + (np.arange(self.num_samples) + 0.5) * self.average_time
+
+    def status(self):
+        times = self.sample_times()
+        if times is None:
+            return '0,0'
+
+        done = int(np.sum(times + self.average_time / 2 <= self.bench.now()))
+        return '%d,%d' % (int(done == len(times)), done)
+
+    def port_power(self, port, wavelengths):
+        """
+        :return: raw reading of the port (dBm or mW) at the given wavelengths
+        """
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        if port in self.ports:
+            if self.ports[port] == 'tap':
+                power = self.bench.tap_power(wavelengths)
+            else:
+                power = self.bench.through_power(wavelengths)
+            power_dbm = 10 * np.log10(power + 1e-11)
+        else:
+            power_dbm = np.full(wavelengths.shape, NOISE_FLOOR)
+
+        # The sensors are calibrated at the set wavelength
+        power_dbm = power_dbm - (power_offset(wavelengths) - power_offset(self.wavelength))
+
+        return power_dbm if self.unit == 0 else np.power(10, power_dbm / 10)
+
+    def logged_data(self, module, port):
+        times = self.sample_times()
+        if times is None:
+            self.errors.append('-200,"Execution error: no logged data"')
+            return definite_block(b'')
+
+        powers = self.port_power(int(port), self.bench.wavelength_at(times))
+        return definite_block(powers.astype('<f4').tobytes()), times[-1] + self.average_time / 2
+
+    def read_powers(self, module):
+        t = self.bench.now()
+        powers = [float(self.port_power(port, self.bench.wavelength_at(t))) for port in range(1, 5)]
+        return ','.join('%.3f' % p for p in powers), t + self.average_time
@@ -0,0 +1,164 @@
+import numpy as np
+from instruments.Simulated.session import SimSession, LatencyModel, number
+
+# Simulated HP 8722D vector network analyzer and HP 11713A attenuator driver,
+# with the (HP-IB, not SCPI) commands used by HP8722D and HP11713A. The VNA
+# measures the electro-optic response of the device of the bench.
+
+TRACE_FORMATS = {'FORM3': ('>f8', 'big'), 'FORM5': ('<f4', 'little')}
+
+
+class SimHP8722D(SimSession):
+
+    LATENCY = LatencyModel(command_latency=5e-3, read_latency=2e-3, bandwidth=100e3)
+
+    # Duration of a sweep: fixed retrace time plus a time per point (s)
+    SWEEP_OVERHEAD = 0.1
+    SWEEP_TIME_PER_POINT = 1e-3
+
+    COMMANDS = [
+        (r'OPC\?', 'opc'),
+        (r'LINFREQ', 'set_linear'),
+        (r'LINFREQ\?', 'linear'),
+        (r'STAR (\S+)', 'set_start'),
+        (r'STOP (\S+)', 'set_stop'),
+        (r'POIN (\S+)', 'set_points'),
+        (r'STAR\?', 'start'),
+        (r'SPAN\?', 'span'),
+        (r'POIN\?', 'points'),
+        (r'(FORM[1-5])', 'set_format'),
+        (r'OUTPFORM', 'output_trace'),
+        (r'OUTPLIML', 'output_limits'),
+        (r'SING', 'single_sweep'),
+        (r'NUMG ?(\d+)', 'group_sweeps'),
+        (r'AVEROON', 'averaging_on'),
+        (r'AVERFACT ?(\d+)', 'set_averaging_factor'),
+        (r'AVERREST', 'restart_averaging'),
+    ]
+
+    def __init__(self, address, bench, **kwargs):
+        super().__init__(address, bench, **kwargs)
+
+        self.freq_start = 130e6
+        self.freq_stop = 20e9
+        self.num_points = 201
+        self.data_format = 'FORM4'
+        self.averaging = 1
+        self.busy_until = 0.0  # End of the sweeps in progress
+
+    def split_message(self, message):
+        # OPC? applies to the command that follows it, and is answered when it finishes
+        commands = super().split_message(message)
+        for i in range(len(commands) - 1):
+            if commands[i].upper() == 'OPC?':
+                commands[i], commands[i + 1] = commands[i + 1], commands[i]
+        return commands
+
+    def freqs(self):
+        return np.linspace(self.freq_start, self.freq_stop, self.num_points)
+
+    def sweep_time(self):
+        return self.SWEEP_OVERHEAD + self.num_points * self.SWEEP_TIME_PER_POINT
+
+    def run_sweeps(self, num_sweeps):
+        self.busy_until = max(self.bench.now(), self.busy_until) + num_sweeps * self.sweep_time()
+
+    def opc(self):
+        return '1', self.busy_until
+
+    def set_linear(self):
+        pass  # The simulated sweeps are always linear
+
+    def linear(self):
+        return '1'
+
+    def set_start(self, arg):
+        self.freq_start = number(arg)
+
+    def set_stop(self, arg):
+        self.freq_stop = number(arg)
+
+    def set_points(self, arg):
+        self.num_points = int(number(arg))
+
+    def start(self):
+        return '%.6E' % self.freq_start
+
+    def span(self):
+        return '%.6E' % (self.freq_stop - self.freq_start)
+
+    def points(self):
+        return '%d' % self.num_points
+
+    def set_format(self, data_format):
+        self.data_format = data_format.upper()
+
+    def trace(self):
+        """
+        :return: the log magnitude trace (dB) of the device response, with noise
+        """
+        response = 20 * np.log10(np.abs(self.bench.dut.s21(self.freqs())))
+        noise = 0.05 / np.sqrt(self.averaging) * self.bench.rng.standard_normal(self.num_points)
+        return response + noise
+
+    def output_trace(self):
+        values = np.zeros((self.num_points, 2))
+        values[:, 0] = self.trace()
+
+        if self.data_format in TRACE_FORMATS:
+            dtype, byteorder = TRACE_FORMATS[self.data_format]
+            payload = values.astype(dtype).tobytes()
+            response = b'#A' + len(payload).to_bytes(2, byteorder) + payload
+        else:
+            response = '\n'.join('%+.12E,%+.12E' % tuple(v) for v in values)
+
+        return response, self.busy_until
+
+    def output_limits(self):
+        # Frequency, test result, upper and lower limits of each point
+        return '\n'.join('%+.12E,0,0,0' % f for f in self.freqs()), self.busy_until
+
+    def single_sweep(self):
+        self.run_sweeps(1)
+
+    def group_sweeps(self, num_sweeps):
+        self.run_sweeps(int(num_sweeps))
+
+    def averaging_on(self):
+        pass
+
+    def set_averaging_factor(self, factor):
+        self.averaging = int(factor)
+
+    def restart_averaging(self):
+        pass
+
+
+class SimHP11713A(SimSession):
+
+    LATENCY = LatencyModel(command_latency=5e-3, read_latency=2e-3, bandwidth=50e3)
+
+    COMMANDS = [
+        (r'((?:[AB]\d+)+)', 'set_switches'),
+    ]
+
+    def __init__(self, address, bench, **kwargs):
+        super().__init__(address, bench, **kwargs)
+        self.switches = {str(i): False for i in range(1, 10)}  # Attenuation sections switched in
+
+    def set_switches(self, data):
+        # A<sections> switches sections in, B<sections> switches them out
+        state = None
+        for char in data.upper():
+            if char in 'AB':
+                state = char == 'A'
+            else:
+                self.switches[char] = state
+
+    def attenuation(self):
+        """
+        :return: total attenuation (dB) of the sections switched in. X sections 1-4 are
+                1, 2, 4 and 4 dB; Y sections 5-7 are 10, 20 and 40 dB.
+        """
+        values = {'1': 1, '2': 2, '3': 4, '4': 4, '5': 10, '6': 20, '7': 40}
+        return sum(v for s, v in values.items() if self.switches[s])
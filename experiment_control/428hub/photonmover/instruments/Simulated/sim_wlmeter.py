@@ -0,0 +1,33 @@
+from Interfaces.WlMeter import WlMeter
+from Interfaces.Instrument import Instrument
+
+# Simulated wavelength meter, measuring the laser of the bench
+
+
+class SimWlMeter(Instrument, WlMeter):
+
+    def __init__(self, bench, measurement_time=0.1, accuracy=1e-4):
+        """
+        :param bench: SimBench with the state of the simulated setup
+        :param measurement_time: time each reading takes (s)
+        :param accuracy: standard deviation of the readings (nm)
+        """
+        super().__init__()
+        self.bench = bench
+        self.measurement_time = measurement_time
+        self.accuracy = accuracy
+
+    def initialize(self):
+        pass
+
+    def close(self):
+        pass
+
+    def get_wavelength(self):
+        """
+        Returns the wavelength in nm
+        :return:
+        """
+        t = self.bench.now()
+        self.bench.sleep(self.measurement_time)
+        return float(self.bench.wavelength_at(t)) + self.accuracy * self.bench.rng.standard_normal()
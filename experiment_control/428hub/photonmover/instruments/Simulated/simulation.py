@@ -0,0 +1,78 @@
+from instruments import visa_pool
+from instruments.Simulated.bench import SimBench
+from instruments.Simulated.sim_lightwave import SimHPLightWave
+from instruments.Simulated.sim_santec import SimSantecTSL550, SimSantecMPM200
+from instruments.Simulated.sim_keithley import SimKeithley2635A, SimKeithley2400
+from instruments.Simulated.sim_vna import SimHP8722D, SimHP11713A
+from instruments.Light_sources.HPLightWave import HP_ADDR
+from instruments.Light_sources.SantecTSL550 import SANTEC_TSL550_GPIB_ADDRESS
+from instruments.Power_meters.SantecMPM200 import SANTEC_MPM200_GPIB_ADDRESS
+from instruments.Source_meters.Keithley2635A import GPIB_ADDR as KEITHLEY_ADDR
+from instruments.Vector_network_analyzers.HP8722D import GPIB_ADDRESS as HP8722D_ADDR
+from instruments.Electrical_attenuators.HP11713A import GPIB_ADDR as HP11713A_ADDR
+
+# Switches the VISA drivers to simulated instruments. After enable_simulation(),
+# the drivers open simulated sessions at their usual addresses, so the same
+# code (e.g. the perform_* routines of new_GPIB_manager) runs without any
+# hardware, taking as long as it would take with the real instruments:
+#
+#   bench = enable_simulation()
+#   laser = HPLightWave(tap_channel=1, rec_channel=3)
+#   laser.initialize()
+#   data = laser.take_sweep(1540, 1560, 2001)
+#
+# Non-VISA instruments have their own simulated classes (SimNiDAQ, SimWlMeter)
+# that take the bench directly.
+
+# The Keithley 2400 and 2635A drivers use the same address
+KEITHLEY_MODELS = {'2635A': SimKeithley2635A, '2400': SimKeithley2400}
+
+
+def simulated_sessions(keithley='2635A'):
+    """
+    :param keithley: model of the Keithley source meter at its shared address, '2635A' or '2400'
+    :return: dictionary VISA address -> simulated session class
+    """
+    return {HP_ADDR: SimHPLightWave,
+            "GPIB1::%d" % SANTEC_TSL550_GPIB_ADDRESS: SimSantecTSL550,
+            "GPIB1::%d" % SANTEC_MPM200_GPIB_ADDRESS: SimSantecMPM200,
+            KEITHLEY_ADDR: KEITHLEY_MODELS[keithley],
+            HP8722D_ADDR: SimHP8722D,
+            HP11713A_ADDR: SimHP11713A}
+
+
+def enable_simulation(bench=None, latency=None, keithley='2635A', options=None):
+    """
+    Registers simulated sessions at the addresses of all the simulated instruments
+    :param bench: SimBench shared by the instruments. A new one if None.
+    :param latency: LatencyModel for all the instruments. If None, each uses its own default.
+    :param keithley: model of the Keithley source meter, '2635A' or '2400'
+    :param options: dictionary session class -> dictionary of extra arguments for it,
+            e.g. {SimHPLightWave: {'tap_channel': 2}}
+    :return: the bench
+    """
+    if bench is None:
+        bench = SimBench()
+    options = options or {}
+
+    for address, session_class in simulated_sessions(keithley).items():
+        visa_pool.register_simulated(address, _factory(session_class, bench, latency,
+                                                       options.get(session_class, {})))
+
+    return bench
+
+
+def disable_simulation():
+    """
+    Goes back to opening the real instruments. Sessions that are already open are not affected.
+    :return:
+    """
+    visa_pool.clear_simulated()
+
+
+def _factory(session_class, bench, latency, extra_args):
+
+    def open_session(address, timeout=2000, **kwargs):
+        return session_class(address, bench, latency=latency, timeout=timeout, **extra_args)
+
+    return open_session
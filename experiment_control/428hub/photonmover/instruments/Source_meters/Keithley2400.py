@@ -1,14 +1,15 @@
 import sys
 sys.path.insert(0, '../..')
 import numpy as np
-import visa
+from instruments.visa_pool import open_resource, close_resource
 import time
 from Interfaces.SourceMeter import SourceMeter
-from Interfaces.Instrument import Instrument
+from Interfaces.Instrument import Instrument, cached_setting
 
 GPIB_ADDR = "GPIB1::26::INSTR"  # GPIB adress
 DEFAULT_CURRENT_COMPLIANCE = 0.005  # Default current compliance in A
 DEFAULT_VOLTAGE_COMPLIANCE = 5  # Default current compliance in V
+MAX_SWEEP_POINTS = 2500  # Size of the sweep/trigger buffer
 
 
 class Keithley2400(Instrument, SourceMeter):
@@ -16,6 +17,9 @@ class Keithley2400(Instrument, SourceMeter):
     Code for controlling Keysight B2902A through GPIB
     """
 
+    # Source, sense, trigger and data format settings can be sent together
+    BATCH_SAFE = ('SOUR', 'SENS', 'TRIG', 'FORM')
+
     def __init__(self, current_compliance=DEFAULT_CURRENT_COMPLIANCE, voltage_compliance=DEFAULT_VOLTAGE_COMPLIANCE):
         super().__init__()
 
@@ -33,9 +37,8 @@ class Keithley2400(Instrument, SourceMeter):
         """
         print('Opening connnection to Keithley source meter')
 
-        rm = visa.ResourceManager()
         try:
-            self.gpib = rm.open_resource(GPIB_ADDR, timeout=5000)
+            self.gpib = open_resource(GPIB_ADDR, timeout=5000)
         except:
             raise ValueError('Cannot connect to the Keysight Source meter')
 
@@ -44,23 +47,25 @@ class Keithley2400(Instrument, SourceMeter):
     def close(self):
         print('Disconnecting Keithley source meter')
         self.turn_off()
-        self.gpib.close()
+        close_resource(self.gpib)
 
+    @cached_setting()
     def set_voltage_range(self, v_range):
         # Current in V, or 'AUTO'
         if v_range == 'AUTO':
-            self.gpib.write(':SENS:VOLT:RANG:AUTO ON')
+            self.write(':SENS:VOLT:RANG:AUTO ON')
         else:
-            self.gpib.write(':SENS:VOLT:RANG:AUTO OFF')
-            self.gpib.write(':SENS:VOLT:RANG %.4E' % v_range)
+            self.write(':SENS:VOLT:RANG:AUTO OFF')
+            self.write(':SENS:VOLT:RANG %.4E' % v_range)
 
+    @cached_setting()
     def set_current_range(self, i_range):
         # Current in Amps, or 'AUTO'
         if i_range == 'AUTO':
-            self.gpib.write(':SENS:CURR:RANG:AUTO ON')
+            self.write(':SENS:CURR:RANG:AUTO ON')
         else:
-            self.gpib.write(':SENS:CURR:RANG:AUTO OFF')
-            self.gpib.write(':SENS:CURR:RANG %.4E' % i_range)
+            self.write(':SENS:CURR:RANG:AUTO OFF')
+            self.write(':SENS:CURR:RANG %.4E' % i_range)
 
     def turn_on(self):
         """
@@ -78,16 +83,21 @@ class Keithley2400(Instrument, SourceMeter):
         self.gpib.write(":OUTP OFF")
         self.is_on = 0
 
+    @cached_setting()
     def set_voltage_compliance(self, v_comp):
-        self.set_voltage_range(v_comp)
-        self.gpib.write(':SENS:VOLT:PROT %.4E' % v_comp)
+        with self.batch():
+            self.set_voltage_range(v_comp)
+            self.write(':SENS:VOLT:PROT %.4E' % v_comp)
         self.volt_compliance = v_comp
 
+    @cached_setting()
     def set_current_compliance(self, i_comp):
-        self.set_current_range(i_comp)
-        self.gpib.write(':SENS:CURR:PROT %.4E' % i_comp)
+        with self.batch():
+            self.set_current_range(i_comp)
+            self.write(':SENS:CURR:PROT %.4E' % i_comp)
         self.cur_compliance = i_comp
 
+    @cached_setting()
     def set_integration_time(self, time):
         # Sets the integration time (given in seconds)
         # We need to convert from seconds to number of power line cycles
@@ -123,6 +133,58 @@ class Keithley2400(Instrument, SourceMeter):
 
         return measurements
 
+    def hardware_sweep(self, start, stop, n, nplc=1, delay=0):
+        """
+        Takes an IV curve with a linear voltage sweep run by the instrument, reading
+        all the (voltage, current) pairs back in a single transfer
+        :param start: start voltage (V)
+        :param stop: stop voltage (V)
+        :param n: number of points (up to 2500)
+        :param nplc: integration time of each measurement, in power line cycles
+        :param delay: time between setting each voltage and measuring (s)
+        :return: A two column matrix, where the first column is voltage
+        and the second is current
+        """
+        if n > MAX_SWEEP_POINTS:
+            raise ValueError('The Keithley 2400 can sweep up to %d points' % MAX_SWEEP_POINTS)
+
+        if not (self.mode == 'VOLT'):
+            self.turn_off()
+            self.set_func('VOLT')
+
+        self.invalidate_cache('set_integration_time')  # The sweep sets its own NPLC
+        prev_elements = self.gpib.query(':FORM:ELEM?').strip()
+        prev_delay = self.gpib.query(':SOUR:DEL?').strip()
+
+        with self.batch():
+            self.write(':SOUR:VOLT:MODE SWE')
+            self.write(':SOUR:SWE:SPAC LIN')
+            self.write(':SOUR:VOLT:STAR %.4E' % start)
+            self.write(':SOUR:VOLT:STOP %.4E' % stop)
+            self.write(':SOUR:SWE:POIN %d' % n)
+            self.write(':SOUR:DEL %.4E' % delay)
+            self.write(':SENS:FUNC "CURR"')
+            self.write(':SENS:CURR:NPLC %.4E' % nplc)
+            self.write(':FORM:ELEM VOLT,CURR')
+            self.write(':TRIG:COUN %d' % n)
+
+        if not self.is_on:
+            self.turn_on()
+
+        # READ? returns once the whole sweep is done
+        prev_timeout = self.gpib.timeout
+        self.gpib.timeout = prev_timeout + 2000 * self.sweep_duration(n, nplc, delay)
+        try:
+            data = np.array(self.gpib.query_ascii_values(':READ?'))
+        finally:
+            self.gpib.timeout = prev_timeout
+            self.gpib.write(':TRIG:COUN 1')
+            self.gpib.write(':SOUR:VOLT:MODE FIXE')
+            self.gpib.write(':FORM:ELEM %s' % prev_elements)
+            self.gpib.write(':SOUR:DEL %s' % prev_delay)
+
+        return data.reshape((n, 2))
+
     def set_func(self, mode):
         """
         :param mode: Either VOLT or CURR
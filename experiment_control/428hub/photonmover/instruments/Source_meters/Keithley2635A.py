@@ -1,15 +1,113 @@
 import sys
 sys.path.insert(0, '../..')
+import numbers
 import numpy as np
-import visa
+from instruments.visa_pool import open_resource, close_resource
 import time
 from Interfaces.SourceMeter import SourceMeter
-from Interfaces.Instrument import Instrument
+from Interfaces.Instrument import Instrument, cached_setting
+from instruments.binblock import query_visa_block
 
 GPIB_ADDR = "GPIB1::26::INSTR"  # GPIB adress
 DEFAULT_CURRENT_COMPLIANCE = 0.005  # Default current compliance in A
 DEFAULT_VOLTAGE_COMPLIANCE = 5  # Default current compliance in V
 
+# SMU used as gate in transistor output curves. The 2635A has a single SMU, so by
+# default it is the SMU of a second 2600 connected through TSP-Link (in a 2636A it would be 'smub')
+GATE_SMU = 'node[2].smua'
+
+# TSP (Lua) scripts that run measurements on the instrument, so that their timing does not
+# depend on GPIB latency. Each one defines a function with the same name as the script, which
+# leaves its results in smua.nvbuffer1 (with source values or timestamps).
+TSP_SCRIPTS = {
+    'pulsed_iv': """
+function pulsed_iv(vbias, vstart, vstop, n, width, period, nplc, ilimit)
+    smua.source.func = smua.OUTPUT_DCVOLTS
+    smua.source.levelv = vbias
+    smua.source.limiti = ilimit
+    smua.measure.nplc = nplc
+    smua.measure.delay = 0
+    smua.measure.autozero = smua.AUTOZERO_ONCE
+    smua.nvbuffer1.clear()
+    smua.nvbuffer1.appendmode = 0
+    smua.nvbuffer1.collectsourcevalues = 1
+    trigger.timer[1].delay = period
+    trigger.timer[1].count = math.max(n - 1, 1)
+    trigger.timer[1].passthrough = true
+    trigger.timer[1].stimulus = smua.trigger.ARMED_EVENT_ID
+    trigger.timer[2].delay = width
+    trigger.timer[2].count = 1
+    trigger.timer[2].passthrough = false
+    trigger.timer[2].stimulus = smua.trigger.SOURCE_COMPLETE_EVENT_ID
+    smua.trigger.source.linearv(vstart, vstop, n)
+    smua.trigger.source.limiti = ilimit
+    smua.trigger.source.action = smua.ENABLE
+    smua.trigger.source.stimulus = trigger.timer[1].EVENT_ID
+    smua.trigger.measure.i(smua.nvbuffer1)
+    smua.trigger.measure.action = smua.ENABLE
+    smua.trigger.measure.stimulus = 0
+    smua.trigger.endpulse.action = smua.SOURCE_IDLE
+    smua.trigger.endpulse.stimulus = trigger.timer[2].EVENT_ID
+    smua.trigger.endsweep.action = smua.SOURCE_IDLE
+    smua.trigger.count = n
+    smua.trigger.arm.count = 1
+    smua.source.output = smua.OUTPUT_ON
+    smua.trigger.initiate()
+    waitcomplete()
+    smua.trigger.source.stimulus = 0
+    smua.trigger.endpulse.stimulus = 0
+end
+""",
+    'output_curve': """
+function output_curve(gate, vgs_start, vgs_stop, n_vgs, vds_start, vds_stop, n_vds, nplc, ilimit_d, ilimit_g)
+    gate.source.func = gate.OUTPUT_DCVOLTS
+    gate.source.limiti = ilimit_g
+    gate.source.levelv = vgs_start
+    gate.source.output = gate.OUTPUT_ON
+    smua.source.func = smua.OUTPUT_DCVOLTS
+    smua.source.limiti = ilimit_d
+    smua.measure.nplc = nplc
+    smua.nvbuffer1.clear()
+    smua.nvbuffer1.appendmode = 1
+    smua.nvbuffer1.collectsourcevalues = 1
+    smua.trigger.source.linearv(vds_start, vds_stop, n_vds)
+    smua.trigger.source.limiti = ilimit_d
+    smua.trigger.source.action = smua.ENABLE
+    smua.trigger.source.stimulus = 0
+    smua.trigger.measure.i(smua.nvbuffer1)
+    smua.trigger.measure.action = smua.ENABLE
+    smua.trigger.measure.stimulus = 0
+    smua.trigger.endpulse.action = smua.SOURCE_HOLD
+    smua.trigger.endpulse.stimulus = 0
+    smua.trigger.endsweep.action = smua.SOURCE_HOLD
+    smua.trigger.count = n_vds
+    smua.trigger.arm.count = 1
+    smua.source.output = smua.OUTPUT_ON
+    for k = 0, n_vgs - 1 do
+        if n_vgs > 1 then
+            gate.source.levelv = vgs_start + k * (vgs_stop - vgs_start) / (n_vgs - 1)
+        end
+        smua.trigger.initiate()
+        waitcomplete()
+    end
+    smua.nvbuffer1.appendmode = 0
+end
+""",
+    'current_logger': """
+function current_logger(n, interval, nplc)
+    smua.measure.nplc = nplc
+    smua.measure.interval = interval
+    smua.measure.count = n
+    smua.nvbuffer1.clear()
+    smua.nvbuffer1.appendmode = 0
+    smua.nvbuffer1.collecttimestamps = 1
+    smua.measure.i(smua.nvbuffer1)
+    waitcomplete()
+    smua.measure.count = 1
+end
+""",
+}
+
 
 class Keithley2635A(Instrument, SourceMeter):
     """
@@ -25,6 +123,7 @@ class Keithley2635A(Instrument, SourceMeter):
         self.volt_compliance = voltage_compliance
         self.is_on = 0
         self.mode = 'VOLTS'  # 'VOLTS' or 'AMPS'
+        self.loaded_scripts = set()  # TSP scripts uploaded in this session
 
     def initialize(self):
         """
@@ -33,18 +132,18 @@ class Keithley2635A(Instrument, SourceMeter):
         """
         print('Opening connnection to Keithley source meter')
 
-        rm = visa.ResourceManager()
         try:
-            self.gpib = rm.open_resource(GPIB_ADDR, timeout=5000)
+            self.gpib = open_resource(GPIB_ADDR, timeout=5000)
         except:
             raise ValueError('Cannot connect to the Keysight Source meter')
 
+        self.loaded_scripts = set()
         self.init_function()
 
     def close(self):
         print('Disconnecting Keithley source meter')
         self.turn_off()
-        self.gpib.close()
+        close_resource(self.gpib)
 
     def turn_on(self):
         """
@@ -74,11 +173,13 @@ class Keithley2635A(Instrument, SourceMeter):
         self.gpib.write('smua.source.func = smua.OUTPUT_DC%s' % mode)  # set voltage
         self.mode = mode
 
+    @cached_setting()
     def set_voltage_compliance(self, v_comp):
         self.gpib.write('smua.source.limitv = %.4E' % v_comp)
         self.gpib.write('smua.measure.rangev = %.4E' % v_comp)
         self.volt_compliance = v_comp
 
+    @cached_setting()
     def set_current_compliance(self, i_comp):
 
         self.gpib.write('smua.source.limiti = %.4E' % i_comp)
@@ -170,17 +271,202 @@ class Keithley2635A(Instrument, SourceMeter):
 
         return measurements
 
+    def hardware_sweep(self, start, stop, n, nplc=1, delay=0):
+        """
+        Takes an IV curve with a linear voltage sweep run by the instrument's trigger model,
+        storing the source values and currents in nvbuffer1 and reading them back in a
+        single transfer
+        :param start: start voltage (V)
+        :param stop: stop voltage (V)
+        :param n: number of points
+        :param nplc: integration time of each measurement, in power line cycles
+        :param delay: time between setting each voltage and measuring (s)
+        :return: A two column matrix, where the first column is voltage
+        and the second is current
+        """
+        if not (self.mode == 'VOLTS'):
+            self.turn_off()
+            self.set_func('VOLTS')
+
+        prev_level = float(self.gpib.query_ascii_values('print(smua.source.levelv)')[0])
+
+        self.gpib.write('smua.measure.nplc = %.4E' % nplc)
+        self.set_measurement_delay(delay)
+        self.gpib.write('smua.nvbuffer1.clear()')
+        self.gpib.write('smua.nvbuffer1.collectsourcevalues = 1')
+        self.gpib.write('smua.trigger.source.linearv(%.4E, %.4E, %d)' % (start, stop, n))
+        self.gpib.write('smua.trigger.source.limiti = %.4E' % self.cur_compliance)
+        self.gpib.write('smua.trigger.source.action = smua.ENABLE')
+        self.gpib.write('smua.trigger.measure.i(smua.nvbuffer1)')
+        self.gpib.write('smua.trigger.measure.action = smua.ENABLE')
+        self.gpib.write('smua.trigger.endpulse.action = smua.SOURCE_HOLD')
+        self.gpib.write('smua.trigger.endsweep.action = smua.SOURCE_HOLD')
+        self.gpib.write('smua.trigger.count = %d' % n)
+
+        if not self.is_on:
+            self.turn_on()
+
+        # printbuffer interleaves the source values and the readings: v1, i1, v2, i2...
+        prev_timeout = self.gpib.timeout
+        self.gpib.timeout = prev_timeout + 2000 * self.sweep_duration(n, nplc, delay)
+        try:
+            self.gpib.write('smua.trigger.initiate()')
+            self.gpib.write('waitcomplete()')
+            data = np.array(self.gpib.query_ascii_values('printbuffer(1, %d, smua.nvbuffer1.sourcevalues, '
+                                                         'smua.nvbuffer1.readings)' % n))
+        finally:
+            self.gpib.timeout = prev_timeout
+            # Leave the trigger model as it was and go back to the previous voltage
+            self.gpib.write('smua.trigger.source.action = smua.DISABLE')
+            self.gpib.write('smua.trigger.measure.action = smua.DISABLE')
+            self.gpib.write('smua.trigger.endpulse.action = smua.SOURCE_IDLE')
+            self.gpib.write('smua.trigger.endsweep.action = smua.SOURCE_IDLE')
+            self.gpib.write('smua.trigger.count = 1')
+            self.gpib.write('smua.source.levelv = %.4E' % prev_level)
+
+        return data.reshape((n, 2))
+
+    def load_script(self, name, source=None):
+        """
+        Uploads a TSP script to the instrument and runs it, which defines its function.
+        Scripts are only uploaded once per session.
+        :param name: name of the script. If source is None, one of TSP_SCRIPTS.
+        :param source: Lua source of the script
+        :return:
+        """
+        if source is None:
+            if name in self.loaded_scripts:
+                return
+            source = TSP_SCRIPTS[name]
+
+        self.gpib.write('loadscript %s_script' % name)
+        for line in source.strip().splitlines():
+            self.gpib.write(line)
+        self.gpib.write('endscript')
+        self.gpib.write('%s_script.run()' % name)
+
+        self.loaded_scripts.add(name)
+
+    def run_script(self, name, *args):
+        """
+        Calls the function defined by a TSP script, uploading the script first if needed.
+        This returns right away; queries sent afterwards are answered once it finishes.
+        :param name: name of the script
+        :param args: arguments of the function. Numbers are formatted, strings are passed as
+                Lua expressions (e.g. 'node[2].smua')
+        :return:
+        """
+        self.load_script(name)
+        lua_args = [a if isinstance(a, str) else '%d' % a if isinstance(a, numbers.Integral) else '%.9E' % a
+                    for a in args]
+        self.gpib.write('%s(%s)' % (name, ', '.join(lua_args)))
+        self.invalidate_cache()  # The scripts change limits, ranges and delays
+
+    def read_buffer(self, n, fields, duration=0):
+        """
+        Reads fields of smua.nvbuffer1 in binary (64 bit floats, so that long timestamps keep their resolution)
+        :param n: number of points to read
+        :param fields: list of buffer fields, e.g. ['sourcevalues', 'readings']
+        :param duration: estimated time (s) until the data is available, if a
+                measurement is still running, to extend the timeout
+        :return: (n, len(fields)) numpy array
+        """
+        buffers = ', '.join('smua.nvbuffer1.%s' % f for f in fields)
+
+        self.gpib.write('format.data = format.REAL64')
+        self.gpib.write('format.byteorder = format.LITTLEENDIAN')
+        prev_timeout = self.gpib.timeout
+        self.gpib.timeout = prev_timeout + 2000 * duration
+        try:
+            data = query_visa_block(self.gpib, 'printbuffer(1, %d, %s)' % (n, buffers), dtype='<f8')
+        finally:
+            self.gpib.timeout = prev_timeout
+            self.gpib.write('format.data = format.ASCII')
+
+        return data.reshape((n, len(fields)))
+
+    def pulsed_iv(self, start, stop, n, width, period, bias=0, nplc=0.001):
+        """
+        Takes an IV curve with voltage pulses, timed by the instrument
+        :param start: voltage of the first pulse (V)
+        :param stop: voltage of the last pulse (V)
+        :param n: number of pulses
+        :param width: pulse width (s). Has to be longer than the measurement (nplc)
+        :param period: pulse period (s)
+        :param bias: voltage between pulses (V)
+        :param nplc: integration time of the measurement in each pulse, in power line cycles
+        :return: A two column matrix, where the first column is voltage
+        and the second is current
+        """
+        if not (self.mode == 'VOLTS'):
+            self.set_func('VOLTS')
+
+        self.run_script('pulsed_iv', bias, start, stop, n, width, period, nplc, self.cur_compliance)
+        self.is_on = 1
+
+        return self.read_buffer(n, ['sourcevalues', 'readings'], duration=n * period)
+
+    def output_curve(self, vgs_start, vgs_stop, n_vgs, vds_start, vds_stop, n_vds, nplc=1,
+                     gate_compliance=None, gate_smu=GATE_SMU):
+        """
+        Takes the output characteristics of a transistor (Ids vs Vds for several Vgs) in a single
+        script, with this SMU on the drain and gate_smu on the gate
+        :param vgs_start: first gate voltage (V)
+        :param vgs_stop: last gate voltage (V)
+        :param n_vgs: number of gate voltages
+        :param vds_start: first drain voltage (V)
+        :param vds_stop: last drain voltage (V)
+        :param n_vds: number of drain voltages
+        :param nplc: integration time of each measurement, in power line cycles
+        :param gate_compliance: current compliance of the gate SMU (A). Same as the drain if None.
+        :param gate_smu: Lua expression of the gate SMU
+        :return: [vgs, ids], where vgs has the n_vgs gate voltages and ids is a
+                (n_vgs, n_vds, 2) array with (Vds, Ids) for each gate voltage
+        """
+        if gate_compliance is None:
+            gate_compliance = self.cur_compliance
+
+        if not (self.mode == 'VOLTS'):
+            self.set_func('VOLTS')
+
+        self.run_script('output_curve', gate_smu, vgs_start, vgs_stop, n_vgs, vds_start, vds_stop, n_vds,
+                        nplc, self.cur_compliance, gate_compliance)
+        self.is_on = 1
+
+        data = self.read_buffer(n_vgs * n_vds, ['sourcevalues', 'readings'],
+                                duration=self.sweep_duration(n_vgs * n_vds, nplc))
+
+        return [np.linspace(vgs_start, vgs_stop, n_vgs), data.reshape((n_vgs, n_vds, 2))]
+
+    def log_current(self, n, interval, nplc=1):
+        """
+        Measures the current n times, at intervals timed by the instrument
+        :param n: number of measurements
+        :param interval: time between measurements (s)
+        :param nplc: integration time of each measurement, in power line cycles
+        :return: A two column matrix, where the first column is the time (s)
+        and the second is current
+        """
+        self.run_script('current_logger', n, interval, nplc)
+
+        return self.read_buffer(n, ['timestamps', 'readings'],
+                                duration=n * max(interval, self.sweep_duration(1, nplc)))
+
+    @cached_setting()
     def set_voltage_range(self, v_range):
         # Current in V
         self.gpib.write('smua.source.rangev= %.4E' % v_range)
 
+    @cached_setting()
     def set_current_range(self, i_range):
         # Current in Amps
         self.gpib.write('smua.source.rangei= %.4E' % i_range)
 
+    @cached_setting()
     def set_measurement_delay(self, time):
         self.gpib.write("smua.measure.delay = %.4E" % time)
 
+    @cached_setting()
     def set_measurement_interval(self, time):
         # Sets the measurement interval (in seconds)
         self.gpib.write('smua.measure.interval=%.4E' % time)
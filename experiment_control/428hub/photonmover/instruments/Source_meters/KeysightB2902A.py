@@ -1,10 +1,10 @@
 import sys
 sys.path.insert(0,'../..')
 import numpy as np
-import visa
+from instruments.visa_pool import open_resource, close_resource
 import time
 from Interfaces.SourceMeter import SourceMeter
-from Interfaces.Instrument import Instrument
+from Interfaces.Instrument import Instrument, cached_setting
 
 GPIB_ADDR = "GPIB1::23::INSTR"  # GPIB adress
 DEFAULT_CURRENT_COMPLIANCE = 0.002  # Default current compliance in A
@@ -15,6 +15,9 @@ class KeysightB2902A(Instrument, SourceMeter):
     Code for controlling Keysight B2902A through GPIB
     """
 
+    # Source, sense and trigger settings can be sent together
+    BATCH_SAFE = ('SOUR', 'SENS', 'TRIG')
+
     def __init__(self, current_compliance=DEFAULT_CURRENT_COMPLIANCE):
         super().__init__()
 
@@ -32,16 +35,15 @@ class KeysightB2902A(Instrument, SourceMeter):
         """
         print('Opening connnection to keysight source meter')
 
-        rm = visa.ResourceManager()
         try:
-            self.gpib = rm.open_resource(GPIB_ADDR, timeout=5000)
+            self.gpib = open_resource(GPIB_ADDR, timeout=5000)
         except:
             raise ValueError('Cannot connect to the Keysight Source meter')
 
         self.init_function()  # Set to voltage source with compliance
 
     def close(self):
-        self.gpib.close()
+        close_resource(self.gpib)
 
     def turn_on(self):
         """
@@ -72,11 +74,13 @@ class KeysightB2902A(Instrument, SourceMeter):
         self.gpib.write((":SOUR:FUNC:MODE %s" % mode))
         self.mode = mode
 
+    @cached_setting()
     def set_voltage_compliance(self, v_comp):
         self.gpib.write((":SENS:VOLT:PROT %.4E" % v_comp))
         self.gpib.write(":OUTP:PROT ON")
         self.v_compliance = v_comp
 
+    @cached_setting()
     def set_current_compliance(self, i_comp):
         self.gpib.write((":SENS:CURR:PROT %.4E" % i_comp))
         self.gpib.write(":OUTP:PROT ON")
@@ -119,7 +123,7 @@ class KeysightB2902A(Instrument, SourceMeter):
         Initializes the source meter as a voltage source
         with the specified compliance
         """
-        self.gpib.write("*RST")
+        self.write("*RST")
         self.set_func('VOLT')
         self.set_current_compliance(self.cur_compliance)
         self.gpib.write(":SOUR:VOLT:RANG:AUTO ON")  # Auto voltage range
@@ -154,6 +158,39 @@ class KeysightB2902A(Instrument, SourceMeter):
 
         return [[np.linspace(start_v, stop_v, num_v)], [currents]]
 
+    def hardware_sweep(self, start, stop, n, nplc=1, delay=0):
+        """
+        Takes an IV curve with a voltage sweep run by the instrument, reading
+        the voltages and currents back once it is done
+        :param start: start voltage (V)
+        :param stop: stop voltage (V)
+        :param n: number of points
+        :param nplc: integration time of each measurement, in power line cycles
+        :param delay: time between setting each voltage and measuring (s)
+        :return: A two column matrix, where the first column is voltage
+        and the second is current
+        """
+        with self.batch():
+            self.config_volt_sweep(start, stop, n)
+            self.write(":sens:curr:nplc %.4E" % nplc)
+            self.write(":trig:acq:del %.4E" % delay)
+
+        if not self.is_on:
+            self.turn_on()
+
+        prev_timeout = self.gpib.timeout
+        self.gpib.timeout = prev_timeout + 2000 * self.sweep_duration(n, nplc, delay)
+        try:
+            self.gpib.write(":init (@1)")
+            self.gpib.query("*OPC?")
+            volts = self.gpib.query_ascii_values(":fetc:arr:volt? (@1)")
+            currents = self.gpib.query_ascii_values(":fetc:arr:curr? (@1)")
+        finally:
+            self.gpib.timeout = prev_timeout
+            self.gpib.write(":sour:volt:mode fix")
+
+        return np.column_stack((volts, currents))
+
     def config_volt_sweep(self, start_v, stop_v, num_v):
         """
         Sets the instrument to perform a voltage sweep with the
@@ -166,15 +203,16 @@ class KeysightB2902A(Instrument, SourceMeter):
 
         self.set_func('VOLT')
 
-        self.gpib.write(":sour:volt:mode swe")
-        self.gpib.write(":sour:volt:star %.4E" % start_v)
-        self.gpib.write(":sour:volt:stop %.4E" % stop_v)
-        self.gpib.write(":sour:volt:poin %d" % num_v)
+        with self.batch():
+            self.write(":sour:volt:mode swe")
+            self.write(":sour:volt:star %.4E" % start_v)
+            self.write(":sour:volt:stop %.4E" % stop_v)
+            self.write(":sour:volt:poin %d" % num_v)
 
-        # Set auto range current measurement
-        self.gpib.write(":sens:func curr")
-        self.gpib.write(":sens:curr:nplc 0.1")
+            # Set auto range current measurement
+            self.write(":sens:func curr")
+            self.write(":sens:curr:nplc 0.1")
 
-        # Generate num_V triggers by automatic internal algorithm
-        self.gpib.write(":trig:sour aint")
-        self.gpib.write(":trig:coun %d" % num_v)
+            # Generate num_V triggers by automatic internal algorithm
+            self.write(":trig:sour aint")
+            self.write(":trig:coun %d" % num_v)
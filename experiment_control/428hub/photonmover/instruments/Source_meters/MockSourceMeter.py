@@ -1,5 +1,6 @@
 import sys
 sys.path.insert(0,'../..')
+import time
 import numpy as np
 from Interfaces.SourceMeter import SourceMeter
 from Interfaces.Instrument import Instrument
@@ -74,3 +75,17 @@ class MockSourceMeter(Instrument, SourceMeter):
         iv = np.zeros((num_v, 2), float)
 
         return iv
+
+    def hardware_sweep(self, start, stop, n, nplc=1, delay=0):
+        """
+        Takes an IV curve, taking as long as an instrument-sequenced sweep would
+        :return: A two column matrix, where the first column is voltage
+        and the second is current
+        """
+        print('Performing hardware IV sweep')
+        time.sleep(self.sweep_duration(n, nplc, delay))
+
+        iv = np.zeros((n, 2), float)
+        iv[:, 0] = np.linspace(start, stop, n)
+
+        return iv
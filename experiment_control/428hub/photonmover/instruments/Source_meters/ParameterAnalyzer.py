@@ -1,7 +1,7 @@
 import sys
 sys.path.insert(0,'../..')
 import numpy as np
-import visa
+from instruments.visa_pool import open_resource, close_resource
 import time
 from Interfaces.SourceMeter import SourceMeter
 from Interfaces.Instrument import Instrument
@@ -29,9 +29,8 @@ class ParameterAnalyzer(Instrument, SourceMeter):
         :return:
         """
         print('Opening connnection to HP parameter analyzer')
-        rm = visa.ResourceManager()
         try:
-            self.sparam = rm.open_resource(PARAM_ANALYZER_ADDR, timeout=10000)
+            self.sparam = open_resource(PARAM_ANALYZER_ADDR, timeout=10000)
         except:
             raise ValueError('Cannot connect to the Parameter Analyzer')
 
@@ -46,7 +45,7 @@ class ParameterAnalyzer(Instrument, SourceMeter):
         print('Closing connnection to Parameter Analyzer')
         self.sparam.write("CL")
         self.sparam.write(":PAGE")
-        self.sparam.close()
+        close_resource(self.sparam)
 
     def set_voltage(self, voltage):
         """
@@ -111,6 +110,50 @@ class ParameterAnalyzer(Instrument, SourceMeter):
 
         return iv
 
+    def hardware_sweep(self, start, stop, n, nplc=1, delay=0):
+        """
+        Takes an IV curve with a staircase sweep run by the parameter analyzer,
+        reading all the currents back in a single transfer
+        :param start: start voltage (V)
+        :param stop: stop voltage (V)
+        :param n: number of points (up to 1001)
+        :param nplc: integration time, in power line cycles. The analyzer only has
+                'short' (< 1 PLC), 'med' (1 PLC) and 'long' (> 1 PLC) settings.
+        :param delay: time between setting each voltage and measuring (s)
+        :return: A two column matrix, where the first column is voltage
+        and the second is current
+        """
+        print('Performing hardware IV sweep with parameter analyzer')
+
+        if nplc < 1:
+            self.set_integration_time('short')
+        elif nplc == 1:
+            self.set_integration_time('med')
+        else:
+            self.set_integration_time('long')
+
+        self.sparam.write("MM 2,%d" % self.channel)  # Staircase sweep measured on the active channel
+        self.sparam.write("WV %d,1,0,%.5E,%.5E,%d,%.4f" % (self.channel, start, stop, n, self.cur_compliance))
+        self.sparam.write("WT 0,%.4E" % delay)  # Hold time, delay time
+        self.sparam.write("BC")  # Clear the output buffer
+
+        prev_timeout = self.sparam.timeout
+        self.sparam.timeout = prev_timeout + 2000 * self.sweep_duration(n, nplc, delay)
+        try:
+            self.sparam.write("XE")
+            self.sparam.query("*OPC?")
+            currents = np.array(self.sparam.query_ascii_values("RMD? 0"))
+        finally:
+            self.sparam.timeout = prev_timeout
+            self.sparam.write("MM 1,%d" % self.channel)  # Back to spot measurements
+            self.set_integration_time('short')
+
+        iv = np.zeros((n, 2), float)
+        iv[:, 0] = np.linspace(start, stop, n)
+        iv[:, 1] = currents[-n:]
+
+        return iv
+
     def initialize_channel(self, channel):
         """
         Initializes the current channel
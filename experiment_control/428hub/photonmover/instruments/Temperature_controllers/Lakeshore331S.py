@@ -1,7 +1,7 @@
 import sys
 sys.path.insert(0, '../..')
 import numpy as np
-import visa
+from instruments.visa_pool import open_resource, close_resource
 import time
 from Interfaces.TempController import TempController
 from Interfaces.Instrument import Instrument
@@ -27,9 +27,8 @@ class Lakeshore331S(Instrument):
         """
         print('Opening connnection to Lakeshore Temp controller')
 
-        rm = visa.ResourceManager()
         try:
-            self.gpib = rm.open_resource(GPIB_ADDR, timeout=5000)
+            self.gpib = open_resource(GPIB_ADDR, timeout=5000)
         except:
             raise ValueError('Cannot connect to Newport Temp controller')
 
@@ -38,7 +37,7 @@ class Lakeshore331S(Instrument):
     def close(self):
         print('Disconnecting Newport Temp controller')
         # self.turn_off()
-        self.gpib.close()
+        close_resource(self.gpib)
 
     def init_funtion(self):
         # Clear status
@@ -1,7 +1,7 @@
 import sys
 sys.path.insert(0, '../..')
 import numpy as np
-import visa
+from instruments.visa_pool import open_resource, close_resource
 import time
 from Interfaces.TempController import TempController
 from Interfaces.Instrument import Instrument
@@ -31,9 +31,8 @@ class Newport3040(Instrument, TempController):
         """
         print('Opening connnection to Newport Temp controller')
 
-        rm = visa.ResourceManager()
         try:
-            self.gpib = rm.open_resource(GPIB_ADDR, timeout=5000)
+            self.gpib = open_resource(GPIB_ADDR, timeout=5000)
         except:
             raise ValueError('Cannot connect to Newport Temp controller')
 
@@ -48,7 +47,7 @@ class Newport3040(Instrument, TempController):
     def close(self):
         print('Disconnecting Newport Temp controller')
         # self.turn_off()
-        self.gpib.close()
+        close_resource(self.gpib)
 
     def set_channel(self, channel):
         self.gpib.write('TEC:CHAN %d,' % channel)
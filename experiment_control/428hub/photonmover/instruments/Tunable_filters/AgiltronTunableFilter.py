@@ -3,6 +3,7 @@ sys.path.insert(0, '../..')
 from Interfaces.TunableFilter import TunableFilter
 from Interfaces.Instrument import Instrument
 import serial
+from instruments.command_trace import traced
 import time
 
 COM_ADDRESS = 'COM4'
@@ -19,7 +20,7 @@ class AgiltronTunableFilter(TunableFilter, Instrument):
         :return:
         """
         print("Initializing connection to Tunable Filter")
-        self.ser = serial.Serial(COM_ADDRESS, timeout=3)
+        self.ser = traced(serial.Serial(COM_ADDRESS, timeout=3), COM_ADDRESS)
 
     def close(self):
         """
@@ -3,15 +3,21 @@ sys.path.insert(0,'../..')
 from Interfaces.VNA import VNA
 from Interfaces.Instrument import Instrument
 
-import visa
+from instruments.visa_pool import open_resource, close_resource
 import time
 import numpy as np
 import matplotlib.pyplot as plt
 import csv
+from instruments.binblock import query_visa_block
 
 
 GPIB_ADDRESS = "GPIB1::24::INSTR"
 
+# Binary trace transfer formats: numpy dtype of the values and byte order of the
+# 2 byte length in the '#A' header. FORM3 is 64 bit IEEE floating point, FORM5 is
+# 32 bit floating point with the bytes reversed (PC format), header included.
+TRACE_FORMATS = {'FORM3': ('>f8', 'big'), 'FORM5': ('<f4', 'little')}
+
 
 class HP8722D(VNA, Instrument):
     """
@@ -20,121 +26,137 @@ class HP8722D(VNA, Instrument):
     extend it to actually control the VNA from the computer.
     """
 
-    def __init__(self):
+    def __init__(self, data_format='FORM5'):
+        """
+        :param data_format: binary format used to transfer traces, 'FORM5' (32 bit) or 'FORM3' (64 bit)
+        """
         super().__init__()
         self.gpib = None
 
+        if data_format not in TRACE_FORMATS:
+            raise ValueError('Trace format has to be one of %s' % list(TRACE_FORMATS))
+        self.data_format = data_format
+
+        # Frequency axis of the current sweep, and the sweep settings it was built for
+        self.freqs = None
+        self.sweep_settings = None
+
     def initialize(self):
         print('Opening connnection to HP VNA')
 
-        rm = visa.ResourceManager()
         try:
-            self.gpib = rm.open_resource(GPIB_ADDRESS, timeout=5000)
+            self.gpib = open_resource(GPIB_ADDRESS, timeout=5000)
         except:
             raise ValueError('Cannot connect to the HP VNA')
 
+        self.clear_freq_cache()
+
     def close(self):
         print('Disconnecting HP VNA')
-        self.gpib.close()
+        close_resource(self.gpib)
 
-    def read_data_lin_sweep(self, file=None, plot_data=True):
+    def clear_freq_cache(self):
         """
-        Reads the data from a linear sweep, by asking for initial frequency, end frequency and
-        number of points to construct the frequencies.
+        Forgets the cached frequency axis, so that it is built again with the next trace
+        """
+        self.freqs = None
+        self.sweep_settings = None
 
-        If file is specified, it creates a csv with the specified path and filename
+    def get_sweep_settings(self):
+        """
+        Gets the settings that determine the frequency axis
+        :return: tuple (linear sweep, number of points, start frequency in Hz, span in Hz)
         """
+        return (int(self.gpib.query_ascii_values('LINFREQ?;')[0]) == 1,
+                int(self.gpib.query_ascii_values('POIN?;')[0]),
+                float(self.gpib.query_ascii_values('STAR?;')[0]),
+                float(self.gpib.query_ascii_values('SPAN?;')[0]))
 
-        # We assume that the measurement has been taken, we just want to retrieve the data
-        #print('a')
-        #sys.stdout.flush() 
-        #res = self.gpib.query_ascii_values('OPC?;')
-        #print(res)
-        #sys.stdout.flush()        
-        #while int(res[0]) != 1:
-        #    time.sleep(1)
-        #    res = self.gpib.query_ascii_values('OPC?;')
-        #    print(res)
-        #    sys.stdout.flush()
-
-        # Set correct data transfer mode
-        self.gpib.write('FORM4;')
-        self.gpib.write('OUTPFORM;')
-
-        # Get the data and convert it to a list
-        data = self.gpib.read_raw().decode('ascii')
-        data = data.replace('\n', ',')
-        data = data.replace(' ', '')
-        data = data.split(",")
-        data = data[0:-2]
-        data = [float(i) for i in data[0::2]]
-
-        # Now get initial frequency, end frequency and number of points
-        num_f = float(self.gpib.query_ascii_values('POIN?;')[0])
-        init_f = float(self.gpib.query_ascii_values('STAR?;')[0])
-        span_f = float(self.gpib.query_ascii_values('SPAN?;')[0])
-        f = np.linspace(init_f, init_f+span_f, num_f)
+    def set_frequency_range(self, start_freq, stop_freq, num_points):
+        """
+        Sets a linear frequency sweep
+        :param start_freq: start frequency in Hz
+        :param stop_freq: stop frequency in Hz
+        :param num_points: number of points (3, 11, 21, 51, 101, 201, 401, 801 or 1601)
+        """
+        self.gpib.write('LINFREQ; STAR %.6e; STOP %.6e; POIN %d;' % (start_freq, stop_freq, num_points))
+        self.clear_freq_cache()
 
-        if plot_data:
-            plt.plot(f, data)
-            plt.show()
+    def get_frequencies(self):
+        """
+        Gets the frequencies of the points of the current sweep. The sweep settings are
+        checked every time (so changes made from the front panel are picked up), and the
+        frequency axis is only built again when they change.
+        :return: numpy array with the frequencies in Hz
+        """
+        settings = self.get_sweep_settings()
+        if self.freqs is None or settings != self.sweep_settings:
+            linear, num_f, init_f, span_f = settings
+            if linear:
+                # Linear sweep: construct the frequencies from the start, span and number of points
+                self.freqs = np.linspace(init_f, init_f + span_f, num_f)
+            else:
+                # Any other sweep: get them from the limit test output (4 values per point)
+                self.gpib.write('OUTPLIML;')
+                fr = self.gpib.read_raw().decode('ascii')
+                fr = fr.replace('\n', ',').replace(' ', '').split(',')
+                self.freqs = np.array(fr[0:-4][0::4], dtype=float)
+            self.sweep_settings = settings
+
+        return self.freqs
+
+    def read_trace(self):
+        """
+        Reads the formatted trace (as displayed) with a binary transfer
+        :return: complex numpy array with one value per point. For formats with a single
+                value per point (e.g. log mag) it is in the real part.
+        """
+        dtype, length_byteorder = TRACE_FORMATS[self.data_format]
+        self.gpib.write('%s;' % self.data_format)
+        values = query_visa_block(self.gpib, 'OUTPFORM;', dtype=dtype, length_byteorder=length_byteorder)
 
-        if file is not None:
-            with open(file, 'w+') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(f)
-                writer.writerow(data)
+        # Each point is a (real, imaginary) pair, which is the memory layout of a complex number
+        return values.view(values.dtype.str[0] + 'c%d' % (2 * values.dtype.itemsize))
 
-        return [f, data]
+    def read_data_lin_sweep(self, file=None, plot_data=True, complex_data=False):
+        """
+        Reads the data from a linear sweep, by asking for initial frequency, end frequency and
+        number of points to construct the frequencies.
 
-    def read_data(self, file=None, plot_data=True):
+        If file is specified, it creates a csv with the specified path and filename
         """
-        Reads the data from any sweep. The data transfer is more complicated here.
+        return self.read_data(file=file, plot_data=plot_data, complex_data=complex_data)
+
+    def read_data(self, file=None, plot_data=True, complex_data=False):
+        """
+        Reads the data from any sweep.
+
+        If file is specified, it creates a csv with the specified path and filename
+        If complex_data is True, the complex trace is returned instead of its real part
         """
 
         # Assume that the data has been taken, just retrieving from the VNA
-        # res = self.gpib.query_ascii_values('OPC?;')
-        # print(res)
-        # sys.stdout.flush()
-        # while int(res) != 1:
-        #     time.sleep(1)
-        #     res = self.gpib.query_ascii_values('OPC?;')
-        #     print(res)
-        #     sys.stdout.flush()
-
-        # Set correct data transfer mode
-        self.gpib.write('FORM4;')
-        self.gpib.write('OUTPFORM;')
-
-        # Get the data and convert it to a list
-        data = self.gpib.read_raw().decode('ascii')
-        data = data.replace('\n', ',')
-        data = data.replace(' ', '')
-        data = data.split(",")
-        data = data[0:-2]
-        data = [float(i) for i in data[0::2]]
-
-        # Get frequency
-        self.gpib.write('OUTPLIML;')
-        fr = self.gpib.read_raw().decode('ascii')
-        fr = fr.replace('\n', ',')
-        fr = fr.replace(' ', '')
-        fr = fr.split(",")
-        fr = fr[0:-4]
-        fr = [float(i) for i in fr[0::4]]
+        trace = self.read_trace()
+        data = trace if complex_data else trace.real
+        f = self.get_frequencies()
+        if len(f) != len(trace):
+            # e.g. a list sweep edited from the front panel: build the axis again
+            self.clear_freq_cache()
+            f = self.get_frequencies()
+            if len(f) != len(trace):
+                raise ValueError('The trace has %d points but the sweep has %d frequencies' % (len(trace), len(f)))
 
         if plot_data:
-            plt.plot(fr, data)
+            plt.plot(f, trace.real)
             plt.show()
 
         if file is not None:
             with open(file, 'w+') as csvfile:
                 writer = csv.writer(csvfile)
-                writer.writerow(fr)
+                writer.writerow(f)
                 writer.writerow(data)
 
-        return [fr, data]
-
+        return [f, data]
 
     def take_data(self, num_sweeps):
         """
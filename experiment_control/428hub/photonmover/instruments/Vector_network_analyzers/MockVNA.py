@@ -17,7 +17,7 @@ class MockVNA(VNA, Instrument):
     def close(self):
         print('Disconnecting VNA')
 
-    def read_data_lin_sweep(self, file=None, plot_data=True):
+    def read_data_lin_sweep(self, file=None, plot_data=True, complex_data=False):
         print("Reading VNA trace")
         f = np.linspace(50e6, 40e9, 201)
         data = f
@@ -26,7 +26,7 @@ class MockVNA(VNA, Instrument):
     def take_data(self, num_averages):
         print("Taking VNA trace with %d averages" % num_averages)
 
-    def read_data(self, file=None, plot_data=True):
+    def read_data(self, file=None, plot_data=True, complex_data=False):
         print("Reading VNA trace")
         f = np.linspace(50e6, 40e9, 201)
         data = f
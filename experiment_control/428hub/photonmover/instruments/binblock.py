@@ -0,0 +1,172 @@
+import numpy as np
+
+# Reading of IEEE 488.2 definite-length arbitrary block responses, which is what
+# instruments send for binary queries (traces, logged data, waveforms):
+#
+#   #<n><length><payload>[terminator]
+#
+# where <n> is a single digit giving the number of digits of <length>, and
+# <length> is the size of the payload in bytes. Older HP instruments use
+#
+#   #A<length><payload>
+#
+# instead, where <length> is a 2 byte binary integer, and some (e.g. Keithley
+# 2600 printbuffer in binary formats) send indefinite-length blocks, '#0' followed
+# by the payload up to the end of the message. The payload is read in large
+# chunks into a preallocated buffer and returned as a numpy array viewing that
+# buffer, so no per-point parsing happens in python.
+
+# Default size of the chunks in which the payload is requested
+CHUNK_SIZE = 1024 * 1024
+
+# VI_SUCCESS_MAX_CNT: the read stopped because the requested count was reached,
+# so the instrument still has bytes (the terminator) in its output queue
+_VI_SUCCESS_MAX_CNT = 0x3FFF0006
+
+
+def read_exact(read, num_bytes):
+    """
+    Reads exactly num_bytes using a read function that may return fewer bytes
+    than requested.
+    :param read: function taking a maximum number of bytes and returning a bytes object
+    :param num_bytes: number of bytes to read
+    :return: bytes object of length num_bytes
+    """
+    data = read(num_bytes)
+    while len(data) < num_bytes:
+        chunk = read(num_bytes - len(data))
+        if not chunk:
+            raise IOError("Connection closed after %d of %d bytes" % (len(data), num_bytes))
+        data += chunk
+    return data
+
+
+def read_block_header(read, length_byteorder='big', max_skip=0):
+    """
+    Reads the '#<n><length>' (or HP '#A<length>') header of a definite-length
+    block. The response has to start with the '#', unless max_skip is given.
+    :param read: function taking a maximum number of bytes and returning a bytes object
+    :param length_byteorder: 'big' or 'little', byte order of the 2 byte length of '#A' headers
+    :param max_skip: number of bytes before the '#' (e.g. a leading status or whitespace) that
+                     are skipped, with a warning, before the response is considered invalid
+    :return: the length of the payload in bytes, or None for an indefinite-length ('#0') block
+    """
+    start = read_exact(read, 1)
+    skipped = b''
+    while start != b'#':
+        skipped += start
+        if len(skipped) > max_skip:
+            raise ValueError("Invalid binary block: the response starts with %r instead of '#'" % skipped[:16])
+        start = read_exact(read, 1)
+    if skipped:
+        print("Warning: skipped %d bytes (%r) before the binary block header" % (len(skipped), skipped[:16]))
+
+    num_digits = read_exact(read, 1)
+    if num_digits == b'A':
+        return int.from_bytes(read_exact(read, 2), length_byteorder)
+    if not num_digits.isdigit():
+        raise ValueError("Invalid binary block header: #%s" % num_digits.decode(errors='replace'))
+    num_digits = int(num_digits)
+    if num_digits == 0:
+        return None
+
+    length = read_exact(read, num_digits)
+    if not length.isdigit():
+        raise ValueError("Invalid binary block length: %s" % length.decode(errors='replace'))
+    return int(length)
+
+
+def read_payload(read, num_bytes, dtype='<f4', chunk_size=CHUNK_SIZE):
+    """
+    Reads the payload of a block whose header has already been read
+    :param read: function taking a maximum number of bytes and returning a bytes object
+    :param num_bytes: length of the payload in bytes
+    :param dtype: numpy dtype of the payload, including its byte order (e.g. '<f4', '>i2', 'u1')
+    :param chunk_size: maximum number of bytes requested per read
+    :return: 1D numpy array viewing the received buffer
+    """
+    dtype = np.dtype(dtype)
+    if num_bytes % dtype.itemsize:
+        raise ValueError("Block of %d bytes is not a whole number of %s values" % (num_bytes, dtype))
+
+    buf = bytearray(num_bytes)
+    view = memoryview(buf)
+    pos = 0
+    while pos < num_bytes:
+        chunk = read(min(chunk_size, num_bytes - pos))
+        if not chunk:
+            raise IOError("Connection closed after %d of %d bytes" % (pos, num_bytes))
+        view[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+
+    return np.frombuffer(buf, dtype=dtype)
+
+
+def read_block(read, dtype='<f4', chunk_size=CHUNK_SIZE, length_byteorder='big', max_skip=0):
+    """
+    Reads a definite-length block and returns its payload as a numpy array.
+    The terminator after the payload (if any) is not read.
+    :param read: function taking a maximum number of bytes and returning a bytes object
+    :param dtype: numpy dtype of the payload, including its byte order (e.g. '<f4', '>i2', 'u1')
+    :param chunk_size: maximum number of bytes requested per read
+    :param length_byteorder: 'big' or 'little', byte order of the 2 byte length of '#A' headers
+    :param max_skip: number of bytes before the '#' that are skipped (see read_block_header)
+    :return: 1D numpy array viewing the received buffer
+    """
+    num_bytes = read_block_header(read, length_byteorder, max_skip)
+    if num_bytes is None:
+        raise ValueError("Indefinite-length (#0) blocks can only be read from a VISA resource")
+    return read_payload(read, num_bytes, dtype=dtype, chunk_size=chunk_size)
+
+
+def read_visa_block(resource, dtype='<f4', chunk_size=CHUNK_SIZE, length_byteorder='big', max_skip=0):
+    """
+    Reads a binary block from a pyvisa resource, after the query has been
+    written, and discards the terminator that follows it.
+    :param resource: open pyvisa resource
+    :param dtype: numpy dtype of the payload, including its byte order (e.g. '<f4', '>i2', 'u1')
+    :param chunk_size: maximum number of bytes requested per read
+    :param length_byteorder: 'big' or 'little', byte order of the 2 byte length of '#A' headers
+    :param max_skip: number of bytes before the '#' that are skipped (see read_block_header)
+    :return: 1D numpy array with the payload
+    """
+    last_status = [None]
+
+    def read(num_bytes):
+        data, last_status[0] = resource.visalib.read(resource.session, num_bytes)
+        return data
+
+    num_bytes = read_block_header(read, length_byteorder, max_skip)
+
+    if num_bytes is None:
+        # Indefinite-length block: everything up to the end of the message, which
+        # is followed by a terminator that is not part of the data
+        data = bytearray()
+        while last_status[0] == _VI_SUCCESS_MAX_CNT:
+            data += read(chunk_size)
+        return np.frombuffer(data, dtype=dtype, count=len(data) // np.dtype(dtype).itemsize)
+
+    values = read_payload(read, num_bytes, dtype=dtype, chunk_size=chunk_size)
+
+    # If the message did not end with the payload, flush the rest of it so
+    # that it does not show up in the response to the next query
+    if last_status[0] == _VI_SUCCESS_MAX_CNT:
+        resource.read_raw()
+
+    return values
+
+
+def query_visa_block(resource, command, dtype='<f4', chunk_size=CHUNK_SIZE, length_byteorder='big', max_skip=0):
+    """
+    Writes a query to a pyvisa resource and reads its binary block response.
+    :param resource: open pyvisa resource
+    :param command: query to send
+    :param dtype: numpy dtype of the payload, including its byte order (e.g. '<f4', '>i2', 'u1')
+    :param chunk_size: maximum number of bytes requested per read
+    :param length_byteorder: 'big' or 'little', byte order of the 2 byte length of '#A' headers
+    :param max_skip: number of bytes before the '#' that are skipped (see read_block_header)
+    :return: 1D numpy array with the payload
+    """
+    resource.write(command)
+    return read_visa_block(resource, dtype=dtype, chunk_size=chunk_size, length_byteorder=length_byteorder,
+                           max_skip=max_skip)
@@ -0,0 +1,339 @@
+import re
+import json
+import time
+import threading
+from collections import deque, namedtuple
+import numpy as np
+
+# Opt-in record of the traffic with the instruments, to find the commands that
+# dominate a measurement. Resources (pyvisa resources, serial ports, the
+# simulated sessions) are wrapped in a TracedResource, which forwards everything
+# to the resource and records each write/query/read in a CommandTrace: when it
+# started, the resource, the command, the bytes transferred and how long it took.
+#
+# The trace is a fixed size ring buffer in memory (old records are dropped), so
+# it can be left on for a whole session. From it you can get per-command latency
+# histograms and a timeline that can be opened in chrome://tracing or Perfetto.
+#
+#   trace = start_tracing()
+#   ...  # Resources opened through visa_pool from now on are traced
+#   trace.print_summary()
+#   trace.save_chrome_trace('trace.json')
+#
+# Only resources opened while tracing is on are traced. Other resources (e.g. a
+# serial port or an instrumental driver) can be wrapped with traced() and
+# trace_instrument().
+
+DEFAULT_CAPACITY = 100000  # Records kept in the ring buffer
+MAX_COMMAND_LENGTH = 80  # Characters of each command that are kept
+
+# Latency histogram bin edges (s): 4 per decade from 10 us to 100 s
+HISTOGRAM_EDGES = np.power(10, np.arange(-5, 2.01, 0.25))
+
+Record = namedtuple('Record', ['start', 'duration', 'resource', 'op', 'command', 'nbytes', 'thread'])
+
+_NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+_active = None
+
+
+class CommandTrace:
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        """
+        :param capacity: number of records kept. When it is full the oldest ones are dropped.
+        """
+        self.capacity = capacity
+        self._records = deque(maxlen=capacity)
+        self.t0 = time.perf_counter()
+        self.dropped = 0
+
+    def record(self, resource, op, command, nbytes, t_start, t_end):
+        """
+        Adds a record. Called by TracedResource.
+        :param resource: name of the resource (e.g. its address)
+        :param op: 'write', 'query' or 'read'
+        :param command: the command sent, or for reads the last command sent to the resource
+        :param nbytes: bytes transferred (None if unknown)
+        :param t_start: time.perf_counter() when the operation started
+        :param t_end: time.perf_counter() when it finished
+        :return:
+        """
+        if len(self._records) == self.capacity:
+            self.dropped += 1
+        if command is not None:
+            command = command[:MAX_COMMAND_LENGTH]
+        self._records.append((t_start, t_end - t_start, resource, op, command, nbytes, threading.get_ident()))
+
+    def clear(self):
+        self._records.clear()
+        self.dropped = 0
+        self.t0 = time.perf_counter()
+
+    def __len__(self):
+        return len(self._records)
+
+    def records(self):
+        """
+        :return: list of Records, oldest first, with the start time in s since the trace started
+        """
+        return [Record(start - self.t0, duration, resource, op, _text(command), nbytes, thread)
+                for (start, duration, resource, op, command, nbytes, thread) in list(self._records)]
+
+    def histograms(self):
+        """
+        Latency statistics of each command. Commands are grouped by operation, resource
+        and command header, with the numbers replaced by '#' (e.g. 'write SOUR:WAV #').
+        :return: dictionary (op, resource, command) -> dictionary with count, total, mean,
+                median, p95 and max (s), bytes, and counts (the histogram over HISTOGRAM_EDGES)
+        """
+        groups = dict()
+        for r in self.records():
+            key = (r.op, r.resource, command_key(r.command))
+            durations, nbytes = groups.setdefault(key, ([], [0]))
+            durations.append(r.duration)
+            nbytes[0] += r.nbytes or 0
+
+        stats = dict()
+        for key, (durations, nbytes) in groups.items():
+            durations = np.array(durations)
+            stats[key] = {'count': len(durations),
+                          'total': float(np.sum(durations)),
+                          'mean': float(np.mean(durations)),
+                          'median': float(np.median(durations)),
+                          'p95': float(np.percentile(durations, 95)),
+                          'max': float(np.max(durations)),
+                          'bytes': nbytes[0],
+                          'counts': np.histogram(np.clip(durations, HISTOGRAM_EDGES[0], HISTOGRAM_EDGES[-1]),
+                                                 HISTOGRAM_EDGES)[0].tolist()}
+        return stats
+
+    def summary(self, top=20):
+        """
+        :param top: number of commands to show
+        :return: a table with the commands that took the most total time
+        """
+        stats = sorted(self.histograms().items(), key=lambda item: item[1]['total'], reverse=True)
+
+        lines = ['%-6s %-24s %-30s %7s %9s %9s %9s %9s' % ('op', 'resource', 'command', 'count',
+                                                         'total s', 'mean ms', 'p95 ms', 'max ms')]
+        for (op, resource, command), s in stats[:top]:
+            lines.append('%-6s %-24s %-30s %7d %9.3f %9.3f %9.3f %9.3f' % (op, resource[:24], command[:30], s['count'],
+                                                                        s['total'], s['mean'] * 1e3,
+                                                                        s['p95'] * 1e3, s['max'] * 1e3))
+        if self.dropped:
+            lines.append('(%d older records were dropped, the trace holds %d)' % (self.dropped, self.capacity))
+        return '\n'.join(lines)
+
+    def print_summary(self, top=20):
+        print(self.summary(top))
+
+    def save_histograms(self, file):
+        """
+        Saves the per-command statistics as JSON
+        :param file: path of the file
+        :return:
+        """
+        stats = [dict(op=op, resource=resource, command=command, **s)
+                 for (op, resource, command), s in self.histograms().items()]
+        with open(file, 'w') as f:
+            json.dump({'edges': HISTOGRAM_EDGES.tolist(), 'commands': stats}, f, indent=1)
+
+    def chrome_trace(self):
+        """
+        :return: the records in the Trace Event Format of chrome://tracing, with one row per resource
+        """
+        records = self.records()
+        rows = dict()
+        for r in records:
+            rows.setdefault(r.resource, len(rows))
+
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': resource}}
+                  for resource, tid in rows.items()]
+        for r in records:
+            events.append({'name': r.command or r.op, 'cat': r.op, 'ph': 'X', 'pid': 0, 'tid': rows[r.resource],
+                           'ts': r.start * 1e6, 'dur': r.duration * 1e6,
+                           'args': {'op': r.op, 'bytes': r.nbytes, 'thread': r.thread}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_chrome_trace(self, file):
+        """
+        Saves the timeline, to be opened with chrome://tracing or https://ui.perfetto.dev
+        :param file: path of the .json file
+        :return:
+        """
+        with open(file, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+class _TracedVisaLib:
+    """
+    The visalib of a traced pyvisa resource, used by the binary block reader
+    """
+
+    def __init__(self, traced_resource):
+        self._traced = traced_resource
+
+    def read(self, session, count):
+        traced = self._traced
+        t_start = time.perf_counter()
+        data, status = traced._resource.visalib.read(session, count)
+        traced._trace.record(traced._name, 'read', traced._last_command, len(data), t_start, time.perf_counter())
+        return data, status
+
+    def __getattr__(self, name):
+        return getattr(self._traced._resource.visalib, name)
+
+
+class TracedResource:
+    """
+    Wraps a resource and records its writes, queries and reads in a CommandTrace.
+    All the other attributes are those of the resource.
+    """
+
+    def __init__(self, resource, name, trace):
+        """
+        :param resource: pyvisa resource, serial port, or anything with write/read methods
+        :param name: name of the resource in the trace (e.g. its address)
+        :param trace: the CommandTrace
+        """
+        self.__dict__.update(_resource=resource, _name=name, _trace=trace, _last_command=None)
+
+    def __getattr__(self, name):
+        return getattr(self._resource, name)
+
+    def __setattr__(self, name, value):
+        # e.g. resource.timeout = 5000
+        setattr(self._resource, name, value)
+
+    @property
+    def visalib(self):
+        return _TracedVisaLib(self)
+
+    def _write(self, method, message, *args, **kwargs):
+        self.__dict__['_last_command'] = message
+        t_start = time.perf_counter()
+        result = method(message, *args, **kwargs)
+        self._trace.record(self._name, 'write', message, _size(message), t_start, time.perf_counter())
+        return result
+
+    def _read(self, method, *args, **kwargs):
+        t_start = time.perf_counter()
+        result = method(*args, **kwargs)
+        self._trace.record(self._name, 'read', self._last_command, _size(result), t_start, time.perf_counter())
+        return result
+
+    def _query(self, method, message, *args, **kwargs):
+        self.__dict__['_last_command'] = message
+        t_start = time.perf_counter()
+        result = method(message, *args, **kwargs)
+        nbytes = _size(message) + (_size(result) if isinstance(result, (str, bytes)) else 0)
+        self._trace.record(self._name, 'query', message, nbytes, t_start, time.perf_counter())
+        return result
+
+    def write(self, message, *args, **kwargs):
+        return self._write(self._resource.write, message, *args, **kwargs)
+
+    def write_raw(self, message, *args, **kwargs):
+        return self._write(self._resource.write_raw, message, *args, **kwargs)
+
+    def read(self, *args, **kwargs):
+        return self._read(self._resource.read, *args, **kwargs)
+
+    def read_raw(self, *args, **kwargs):
+        return self._read(self._resource.read_raw, *args, **kwargs)
+
+    def read_bytes(self, *args, **kwargs):
+        return self._read(self._resource.read_bytes, *args, **kwargs)
+
+    def readline(self, *args, **kwargs):
+        return self._read(self._resource.readline, *args, **kwargs)
+
+    def query(self, message, *args, **kwargs):
+        return self._query(self._resource.query, message, *args, **kwargs)
+
+    def query_ascii_values(self, message, *args, **kwargs):
+        return self._query(self._resource.query_ascii_values, message, *args, **kwargs)
+
+    def query_binary_values(self, message, *args, **kwargs):
+        return self._query(self._resource.query_binary_values, message, *args, **kwargs)
+
+
+def start_tracing(capacity=DEFAULT_CAPACITY):
+    """
+    Starts recording the traffic of the resources opened through visa_pool (and
+    those wrapped with traced()) from now on
+    :param capacity: records kept in the ring buffer
+    :return: the CommandTrace
+    """
+    global _active
+    _active = CommandTrace(capacity)
+    return _active
+
+
+def stop_tracing():
+    """
+    Stops tracing. Resources that are already traced keep recording into the returned trace.
+    :return: the CommandTrace, None if tracing was not on
+    """
+    global _active
+    trace = _active
+    _active = None
+    return trace
+
+
+def active_trace():
+    """
+    :return: the current CommandTrace, None if tracing is off
+    """
+    return _active
+
+
+def traced(resource, name=None):
+    """
+    Wraps a resource to trace it, if tracing is on
+    :param resource: pyvisa resource, serial port...
+    :param name: name in the trace. If None, the resource_name or port of the resource.
+    :return: a TracedResource, or the same resource if tracing is off
+    """
+    if _active is None or isinstance(resource, TracedResource):
+        return resource
+    if name is None:
+        name = getattr(resource, 'resource_name', None) or getattr(resource, 'port', None) or repr(resource)
+    return TracedResource(resource, name, _active)
+
+
+def trace_instrument(instrument, name=None):
+    """
+    Traces the resource of an instrumental (VisaMixin) driver, if tracing is on
+    :param instrument: the driver
+    :param name: name in the trace. If None, the address of the resource.
+    :return: the same driver
+    """
+    if not hasattr(instrument, '_rsrc'):
+        print('%s does not have a VISA resource. Not tracing it.' % type(instrument).__name__)
+        return instrument
+
+    instrument._rsrc = traced(instrument._rsrc, name)
+    return instrument
+
+
+def command_key(command):
+    """
+    :param command: a command string
+    :return: its header (first word), with the numbers replaced by '#'
+    """
+    words = command.strip().split(None, 1)
+    return _NUMBER.sub('#', words[0]) if words else ''
+
+
+def _size(data):
+    return len(data) if isinstance(data, (str, bytes, bytearray)) else None
+
+
+def _text(command):
+    if command is None:
+        return ''
+    if isinstance(command, (bytes, bytearray)):
+        command = command.decode('ascii', errors='replace')
+    return command[:MAX_COMMAND_LENGTH].strip()
@@ -0,0 +1,172 @@
+import threading
+from instruments import command_trace
+
+# Process-wide registry of VISA sessions. All the drivers get their resources
+# from here instead of creating their own ResourceManager, so that
+#
+#   - there is a single ResourceManager (opening one is slow, and each one
+#     loads the VISA library again),
+#   - instruments used by several components (e.g. the HP lightwave, which is
+#     both the laser and the power meter, or a source meter shared by two
+#     measurement managers) are opened once and reused, and the session is only
+#     closed when the last user releases it,
+#   - every session has a lock that components can hold while they talk to the
+#     instrument, so that commands from different threads do not interleave.
+#
+# Sessions are keyed by their address. The keyword arguments to open_resource
+# (e.g. timeout) are only used when the session is actually opened.
+#
+# Addresses can also be registered as simulated (see instruments.Simulated), in
+# which case open_resource returns an in-process simulated session and the VISA
+# library is not needed.
+#
+# While command tracing is on (instruments.command_trace.start_tracing), the
+# sessions that are opened are wrapped so that their traffic is recorded.
+
+_registry_lock = threading.RLock()
+_resource_manager = None
+_sessions = {}  # address -> _Session
+_simulated = {}  # address -> factory of simulated sessions
+
+
+class _Session:
+
+    def __init__(self, address, resource):
+        self.address = address
+        self.resource = resource
+        self.refcount = 0
+        self.lock = threading.RLock()
+
+
+def get_resource_manager():
+    """
+    Returns the shared ResourceManager, creating it the first time
+    :return: the pyvisa ResourceManager
+    """
+    global _resource_manager
+
+    with _registry_lock:
+        if _resource_manager is None:
+            import visa
+            _resource_manager = visa.ResourceManager()
+        return _resource_manager
+
+
+def open_resource(address, **kwargs):
+    """
+    Returns the session for the given address, opening it if nobody has it open,
+    and increases its reference count. Every call has to be matched by a call to
+    close_resource.
+    :param address: VISA address of the instrument
+    :param kwargs: arguments for ResourceManager.open_resource (only used when the session is opened)
+    :return: the pyvisa resource
+    """
+    with _registry_lock:
+        session = _sessions.get(address)
+        if session is None:
+            if address in _simulated:
+                resource = _simulated[address](address, **kwargs)
+            else:
+                resource = get_resource_manager().open_resource(address, **kwargs)
+            session = _Session(address, command_trace.traced(resource, address))
+            _sessions[address] = session
+
+        session.refcount += 1
+        return session.resource
+
+
+def close_resource(resource):
+    """
+    Releases a session obtained with open_resource. The session is closed when
+    its reference count drops to zero.
+    :param resource: the pyvisa resource or its address
+    :return:
+    """
+    with _registry_lock:
+        session = _find_session(resource)
+        if session is None:
+            # Not pooled, close it directly
+            if not isinstance(resource, str):
+                resource.close()
+            return
+
+        session.refcount -= 1
+        if session.refcount <= 0:
+            with session.lock:
+                session.resource.close()
+            del _sessions[session.address]
+
+
+def register_simulated(address, factory):
+    """
+    Makes open_resource return a simulated session for the address instead of
+    opening the instrument. Sessions that are already open are not affected.
+    :param address: VISA address of the instrument
+    :param factory: function taking the address and the open_resource keyword arguments
+            and returning an object with the pyvisa resource methods
+    :return:
+    """
+    with _registry_lock:
+        _simulated[address] = factory
+
+
+def clear_simulated():
+    """
+    Removes all the simulated addresses, so that open_resource opens the real instruments again
+    :return:
+    """
+    with _registry_lock:
+        _simulated.clear()
+
+
+def session_lock(resource):
+    """
+    Returns the lock of a pooled session. Hold it (with session_lock(res): ...)
+    around sequences of commands that must not be interleaved with other users
+    of the same instrument.
+    :param resource: the pyvisa resource or its address
+    :return: a reentrant lock
+    """
+    with _registry_lock:
+        session = _find_session(resource)
+        if session is None:
+            raise ValueError('%s is not an open pooled session' % resource)
+        return session.lock
+
+
+def open_sessions():
+    """
+    Returns the pooled sessions that are currently open
+    :return: a dictionary address -> reference count
+    """
+    with _registry_lock:
+        return {address: session.refcount for address, session in _sessions.items()}
+
+
+def close_all():
+    """
+    Closes all the pooled sessions regardless of their reference count, and the
+    ResourceManager
+    :return:
+    """
+    global _resource_manager
+
+    with _registry_lock:
+        for session in list(_sessions.values()):
+            with session.lock:
+                session.resource.close()
+        _sessions.clear()
+
+        if _resource_manager is not None:
+            _resource_manager.close()
+            _resource_manager = None
+
+
+def _find_session(resource):
+    if isinstance(resource, str):
+        return _sessions.get(resource)
+
+    for session in _sessions.values():
+        if session.resource is resource:
+            return session
+    return None
@@ -43,11 +43,14 @@ import pickle
 import time
 import sys
 import threading
+import queue
+import itertools
 import numpy as np
 import scipy.io as io
 import winsound
 import matplotlib.pyplot as plt
 import csv
+from Interfaces.Instrument import Instrument
 
 # Instrument handlers
 from instruments.Light_sources.MockLaser import MockLaser
@@ -68,6 +71,10 @@ from instruments.Electrical_attenuators.MockElAtt import MockElAtt
 from instruments.Tunable_filters.MockTunableFilter import MockTunableFilter
 from instruments.Tunable_filters.AgiltronTunableFilter import AgiltronTunableFilter
 from instruments.DAQ.NI_DAQ import NiDAQ
+from instruments.Simulated.simulation import enable_simulation
+from instruments.Simulated.sim_daq import SimNiDAQ
+from instruments.command_trace import start_tracing
+from calibration import Calibration
 
 
 EVT_MEASURED_POWERS = 123456789  # Some random ID for the event indicating that
@@ -76,6 +83,14 @@ EVT_DONE = 123456788  # Some random ID for the event indicating that
 # the window has to be closed
 NUM_AVS = 4  # Number of averages for the VNA
 
+# COMMAND PRIORITIES (commands with a lower number are executed first)
+PRIORITY_STOP = 0  # Close the thread
+PRIORITY_COMMAND = 1  # Settings and measurements, executed in the order they were requested
+
+# IV SWEEPS
+IV_SWEEP_NPLC = 1  # Integration time of each point of an IV curve, in power line cycles
+IV_SWEEP_DELAY = 0  # Delay between setting the voltage and measuring, in s
+
 # POWER METER CHANNELS
 TAP_CHANNEL = 1  # Power meter channel connected to the tap
 REC_CHANNEL = 3  # Power meter channel connected to the transmitted power
@@ -90,6 +105,26 @@ PFI_CLK = "/Dev1/pfi0"  # Trigger coming from the laser
 
 PM_AUTO_RANGE = 1000  # A number for when the power meter range is AUTO
 
+# Skip resending settings (wavelength, range, compliance...) the instruments already have.
+# Off by default: only turn it on if the instruments are not changed from the front panel
+# while the GUI runs, since a setting changed there would not be sent again.
+USE_STATE_CACHE = False
+
+# Connect the drivers to the simulated instruments of instruments.Simulated instead of the
+# real ones, to run (and time) the measurement routines without any hardware.
+SIMULATE_INSTRUMENTS = False
+
+# Record every command sent to the instruments (see instruments.command_trace). When the
+# GUI closes, the slowest commands are printed and TRACE_FILE.json (timeline, for
+# chrome://tracing) and TRACE_FILE_histograms.json (latency of each command) are saved.
+TRACE_COMMANDS = False
+TRACE_FILE = 'command_trace'
+
+# Interpolation of the tap calibration between the calibrated wavelengths: 'nearest' (the
+# closest calibrated wavelength, as the measurements have always been calibrated), 'linear'
+# or 'spline' (needs scipy)
+CALIBRATION_INTERPOLATION = 'nearest'
+
 
 # Helper class to handle the update of power values in the GUI
 class LWMainEvent(wx.PyEvent):
@@ -122,6 +157,22 @@ class DoneEvent(wx.PyEvent):
 
         self.done = done
 
+
+class MeasurementCancelled(Exception):
+    """
+    Raised by GPIBManager.check_cancelled when the user cancels the running measurement
+    """
+    pass
+
+
+def dbm_to_w(power_dbm):
+    """
+    :param power_dbm: power or array of powers in dBm
+    :return: the power(s) in W
+    """
+    return np.power(10, np.asarray(power_dbm) / 10) * 1e-3
+
+
 ############################################################################
 ############################################################################
 ######                                                                ######
@@ -159,35 +210,25 @@ class GPIBManager(threading.Thread):
         self.new_tf_wavelength = -10.0
         self.new_power = -10.0
         self.new_pm_range = -10.0
+        self.new_laser_state = False  # True to turn the laser on, False to turn it off
         self.active_module = -1
 
-        # Control loop state variables. When any of this is 1, it means that
-        # the specific operation has to be performed. It is done this way so as
-        # to avoid threads clashing with each other.
-        self.set_new_wav = 0
-        self.set_new_tf_wav = 0
-        self.set_new_power = 0
-        self.set_el_att = 0
-        self.turn_on_laser = 0
-        self.turn_off_laser = 0
-        self.set_bias = 0
-        self.set_bias_2 = 0
-        self.tx_scan = 0
-        self.tx_bias_scan = 0
-        self.tx_power_scan = 0
-        self.tx_time_scan = 0
-        self.take_IV = 0
-        self.take_RLV = 0
-        self.take_RLP = 0
-        self.take_bw_vs_v = 0
-        self.take_vna_trace = 0
-        self.start_vna_trace = 0
-        self.take_trans_output_curve = 0
-        self.take_pv_mod_outp = 0
-        self.calibration = 0
+        # Commands requested by the GUI. Only this thread talks to the instruments, so the
+        # commands are queued and the main loop (run) executes them as soon as they arrive,
+        # in the order they were requested (only closing goes first). Each entry is
+        # (priority, order, method, attributes, measurement), where attributes are set in the
+        # manager (e.g. the file path or the new wavelength) before calling method.
+        self.commands = queue.PriorityQueue()
+        self.command_order = itertools.count()  # Keeps the commands with the same priority in order
+        # Settings in the queue, name -> (order, attributes). A setting requested again before it is
+        # applied (and with no measurement queued in between) is not queued twice: it uses the latest value.
+        self.pending_settings = dict()
+        self.pending_lock = threading.Lock()
+        self.pending_measurements = 0  # Measurements queued or running
+        self.last_measurement_order = -1  # Order of the last queued measurement
+        self.cancel_event = threading.Event()  # Set to cancel the running (or next queued) measurement
+
         self.ds_current = 0
-        self.set_new_pm_range = 0
-        self.no_calibration = 0
         self.user_file_path = None
 
         self.using_HP = False
@@ -195,12 +236,10 @@ class GPIBManager(threading.Thread):
         self.sweep_daq_acq = True  # Use the DAQ board to take wavelength sweeps?
         self.store_current = False  # Measure current when taking wavelength sweeps?
 
-        # How many loops do we wait to ask again for power and photocurrent data?
-        self.power_meter_poll_delay = 1  # Ask for power values every cycle
-        self.sm_poll_delay = 40  # Ask for currents every 5 cycles
-
-        # Control loop delay variable
-        self.loop_delay_time = 100e-4 # 1e-4
+        # How often do we ask for power and photocurrent data (s)? The polling is only done
+        # when there are no commands waiting.
+        self.power_meter_poll_period = 0.01
+        self.sm_poll_period = 0.4
 
         # Connect to the instruments that we care about
         self.source_meter = None
@@ -234,6 +273,14 @@ class GPIBManager(threading.Thread):
         """
 
         print('Starting connection')
+
+        if SIMULATE_INSTRUMENTS:
+            # The drivers below open simulated sessions instead of the instruments
+            self.sim_bench = enable_simulation()
+
+        # The sessions are opened when the instruments are initialized, so they will be traced
+        self.command_trace = start_tracing() if TRACE_COMMANDS else None
+
         # Power meter
         # self.power_meter = HPLightWave(tap_channel=TAP_CHANNEL, rec_channel=REC_CHANNEL)
         self.power_meter = SantecMPM200(rec_port=MPM200_REC_PORT, tap_port=MPM200_TAP_PORT)
@@ -286,13 +333,17 @@ class GPIBManager(threading.Thread):
         self.tunable_filter = MockTunableFilter()
 
         # DAQ
-        self.ni_daq = NiDAQ()
+        if SIMULATE_INSTRUMENTS:
+            self.ni_daq = SimNiDAQ(self.sim_bench)
+        else:
+            self.ni_daq = NiDAQ()
 
     def run(self):
         """
-        This is the main code that gets called in a loop. It checks if there is
-        any operation that needs to be done, and if so it does it. If not,
-        it just gets power information and updates the GUI.
+        This is the main code that gets called in a loop. It waits for the
+        operations requested by the GUI and performs them as soon as they
+        arrive. When there is nothing to do, it gets power information and
+        updates the GUI.
 
         When you call the start method, threading makes
         sure run gets called to start polling
@@ -308,10 +359,9 @@ class GPIBManager(threading.Thread):
             self.initialize_instruments()
 
             # Initialize Loop Variables
-            # Counters for the number of cycles since the last polling of powers
-            # and currents
-            power_meter_wait_counter = 1
-            sm_wait_counter = 10
+            # Time of the next polling of powers and currents
+            next_power_poll = time.perf_counter()
+            next_sm_poll = time.perf_counter()
 
             # Initialize variables
             measured_input_power = 0
@@ -331,162 +381,56 @@ class GPIBManager(threading.Thread):
 
                 try:
 
+                    # Wait for a command until it is time to poll the instruments
                     if self.loopActive:
-                        update = 0
-
-                        # Get power values if it is time for it
-                        if power_meter_wait_counter >= self.power_meter_poll_delay:
-                            update = 1
-                            power_meter_wait_counter = 0
-
-                            through_loss, measured_input_power, measured_received_power, tap_power \
-                                = self.analyze_powers(calibration=True)
-
-                            measured_wavelength = self.wavelength_meter.get_wavelength()
-
-                        # Get current values if it is time for it
-                        if sm_wait_counter >= self.sm_poll_delay:
-                            update = 1
-                            sm_wait_counter = 0
-
-                            photocurrent = self.source_meter.measure_current()
-                            photocurrent_2 = self.source_meter_2.measure_current()
-
-                            responsivity = photocurrent / (measured_input_power + 1.0e-15)
-                            if measured_wavelength != 0:
-                                qe = responsivity * 1.24 / measured_wavelength * 100.0
-                            else:
-                                qe = responsivity * 1.24 / self.new_wavelength * 100.0
-
-                        # If there is sth to be updated, do it
-                        if update:
-
-                            wx.PostEvent(self.through_loss_control,
-                                         LWMainEvent(through_loss,
-                                                     measured_input_power, measured_received_power,
-                                                     tap_power, photocurrent, photocurrent_2, responsivity, qe,
-                                                     measured_wavelength))
-
-                        # Go through each possible operation and perform it if
-                        # user requested so
-
-                        if self.set_new_wav == 1:
-                            print("Setting Wavelength...")
-                            self.set_new_wav = 0
-                            self.light_source.set_wavelength(self.new_wavelength)
-                            self.power_meter.set_wavelength(self.new_wavelength)
-                            # Set unable filter wavelength if necessary
-                            if self.tf_with_laser:
-                                self.tunable_filter.set_wavelength(self.new_wavelength)
-
-                        if self.set_new_pm_range == 1:
-                            print("Setting power Meter Range...")
-                            self.set_new_pm_range = 0
-
-                            if self.new_pm_range == PM_AUTO_RANGE:
-                                self.power_meter.set_range(3, 'AUTO')
-                            else:
-                                self.power_meter.set_range(3, self.new_pm_range)
-
-                        if self.set_new_tf_wav == 1:
-                            print("Setting Tunable Filter Wavelength...")
-                            self.set_new_tf_wav = 0
-                            self.tunable_filter.set_wavelength(self.new_tf_wavelength)
-
-                        if self.set_new_power == 1:
-                            print("Setting Output Power...")
-                            self.set_new_power = 0
-                            self.light_source.set_power(self.new_power)
-
-                        if self.turn_on_laser == 1:
-                            print("Laser Turn On...")
-                            self.turn_on_laser = 0
-                            self.light_source.turn_on()
-
-                        if self.set_bias == 1:
-                            print("Setting Bias...")
-                            self.set_bias = 0
-                            self.source_meter.set_voltage(self.parent.pd_bias)
-                            time.sleep(0.5)
-
-                        if self.set_bias_2 == 1:
-                            print("Setting Bias...")
-                            self.set_bias_2 = 0
-                            self.source_meter_2.set_voltage(self.parent.pd_bias_2)
-                            time.sleep(0.5)
-
-                        if self.turn_off_laser == 1:
-                            print("Laser Turn Off...")
-                            self.turn_off_laser = 0
-                            self.light_source.turn_off()
-
-                        if self.set_el_att == 1:
-                            print("Setting electrical attenuation...")
-                            self.set_el_att = 0
-                            self.el_att.set_attenuation(self.parent.el_att)
-
-                        if self.calibration == 1:
-                            self.calibration = 0
-                            self.perform_calibration()
-
-                        if self.no_calibration == 1:
-                            self.no_calibration = 0
-                            self.perform_no_calibration()
-
-                        if self.tx_scan == 1:
-                            self.tx_scan = 0
-                            self.perform_tx_measurement()
-
-                        if self.tx_bias_scan == 1:
-                            self.tx_bias_scan = 0
-                            self.perform_tx_bias_measurement()
-
-                        if self.tx_power_scan == 1:
-                            self.tx_power_scan = 0
-                            self.perform_tx_power_scan()
-
-                        if self.tx_time_scan == 1:
-                            self.tx_time_scan = 0
-                            self.perform_tx_time_measurement()
-
-                        if self.take_IV == 1:
-                            self.take_IV = 0
-                            self.perform_iv_measurement()
-
-                        if self.take_RLV == 1:
-                            self.take_RLV = 0
-                            self.perform_rlv_measurement()
-
-                        if self.take_RLP == 1:
-                            self.take_RLP = 0
-                            self.perform_rlp_measurement()
-
-                        if self.take_bw_vs_v == 1:
-                            self.take_bw_vs_v = 0
-                            self.perform_bw_vs_v()
-
-                        if self.take_vna_trace == 1:
-                            self.take_vna_trace = 0
-                            self.retrieve_vna_trace()
-
-                        if self.start_vna_trace == 1:
-                            self.start_vna_trace = 0
-                            self.start_vna_trace_trigger()
-
-                        if self.take_trans_output_curve == 1:
-                            self.take_trans_output_curve = 0
-                            self.perform_transistor_output_curve()
-
-                        if self.take_pv_mod_outp == 1:
-                            self.take_pv_mod_outp = 0
-                            self.perform_pv_mod_output_curve()
-
-                    # Increase cycle counter
-                    power_meter_wait_counter = power_meter_wait_counter + 1
-                    sm_wait_counter = sm_wait_counter + 1
-
-                    # Wait time until next cycle
-                    time.sleep(self.loop_delay_time)
+                        timeout = max(0, min(next_power_poll, next_sm_poll) - time.perf_counter())
+                    else:
+                        timeout = None
+
+                    try:
+                        priority, order, method, attributes, measurement = self.commands.get(timeout=timeout)
+                    except queue.Empty:
+                        pass
+                    else:
+                        if method is not None:
+                            self.execute_command(order, method, attributes, measurement)
+                        continue
+
+                    # There are no commands waiting. Get the values that are due.
+                    update = 0
+
+                    # Get power values if it is time for it
+                    if time.perf_counter() >= next_power_poll:
+                        update = 1
+                        next_power_poll = time.perf_counter() + self.power_meter_poll_period
+
+                        through_loss, measured_input_power, measured_received_power, tap_power \
+                            = self.analyze_powers(calibration=True)
+
+                        measured_wavelength = self.wavelength_meter.get_wavelength()
+
+                    # Get current values if it is time for it
+                    if time.perf_counter() >= next_sm_poll:
+                        update = 1
+                        next_sm_poll = time.perf_counter() + self.sm_poll_period
+
+                        photocurrent = self.source_meter.measure_current()
+                        photocurrent_2 = self.source_meter_2.measure_current()
+
+                        responsivity = photocurrent / (measured_input_power + 1.0e-15)
+                        if measured_wavelength != 0:
+                            qe = responsivity * 1.24 / measured_wavelength * 100.0
+                        else:
+                            qe = responsivity * 1.24 / self.new_wavelength * 100.0
+
+                    # If there is sth to be updated, do it
+                    if update:
+
+                        wx.PostEvent(self.through_loss_control,
+                                     LWMainEvent(through_loss,
+                                                 measured_input_power, measured_received_power,
+                                                 tap_power, photocurrent, photocurrent_2, responsivity, qe,
+                                                 measured_wavelength))
 
                 except Exception as ex:
                     print("I had an error: %s" % ex)
@@ -497,6 +441,12 @@ class GPIBManager(threading.Thread):
 
         # Start turn off routine by closing instruments.
         self.close_instruments()
+
+        if self.command_trace is not None:
+            self.command_trace.print_summary()
+            self.command_trace.save_chrome_trace(TRACE_FILE + '.json')
+            self.command_trace.save_histograms(TRACE_FILE + '_histograms.json')
+
         self.done = 1
         # Close window
         wx.PostEvent(self.through_loss_control, DoneEvent(1))
@@ -543,6 +493,12 @@ class GPIBManager(threading.Thread):
             print("Intializing DAQ...")
             self.ni_daq.initialize()
 
+        if USE_STATE_CACHE:
+            for instr in [self.light_source, self.power_meter, self.source_meter, self.source_meter_2,
+                          self.tunable_filter]:
+                if isinstance(instr, Instrument):
+                    instr.enable_state_cache()
+
     def close_instruments(self):
         """
         Closes the connected instruments.
@@ -581,37 +537,215 @@ class GPIBManager(threading.Thread):
             print("Closing DAQ...")
             self.ni_daq.close()
 
+    def execute_command(self, order, method, attributes, measurement):
+        """
+        Performs a command from the queue. Measurements can be cancelled with
+        cancel_measurement, in which case the setup goes back to the state it
+        had before the measurement. The cancellation is cleared once the measurement
+        finishes, so a cancel requested while it was still queued is not lost.
+
+        :param order: position of the command in the queue
+        :param method: the method that performs the operation
+        :param attributes: dictionary with attributes to set before performing it
+        :param measurement: True if the command is a measurement
+        :return: None
+        """
+        with self.pending_lock:
+            pending = self.pending_settings.get(method.__name__)
+            if pending is not None and pending[0] == order:
+                del self.pending_settings[method.__name__]
+            attributes = dict(attributes)
+
+        for name, value in attributes.items():
+            setattr(self, name, value)
+
+        if not measurement:
+            method()
+            return
+
+        state = self.get_state()
+        try:
+            method()
+        except MeasurementCancelled:
+            print("Measurement cancelled")
+            self.restore_state(state)
+        finally:
+            with self.pending_lock:
+                self.pending_measurements -= 1
+                self.cancel_event.clear()
+
+    def check_cancelled(self):
+        """
+        Called by the measurements between steps. Stops the measurement if the
+        user cancelled it.
+
+        :return: None
+        """
+        if self.cancel_event.is_set():
+            raise MeasurementCancelled()
+
+    def restore_state(self, state):
+        """
+        Sets the setup back to a state recorded with get_state
+        :param state: list [wl, power, laser_active, source_meter_voltage, source_meter_2_voltage]
+        :return: None
+        """
+        [wl, power, laser_active, voltage, voltage_2] = state
+
+        self.new_wavelength = wl
+        self.light_source.set_wavelength(wl)
+        self.power_meter.set_wavelength(wl)
+        if self.tf_with_laser:
+            self.tunable_filter.set_wavelength(wl)
+
+        if not laser_active:
+            self.light_source.turn_off()
+        else:
+            self.light_source.set_power(power)
+
+        self.source_meter.set_voltage(voltage)
+        self.source_meter_2.set_voltage(voltage_2)
+
     # --------------------------------------------------------------------------
     # --------------------------------------------------------------------------
     # --------------------------------------------------------------------------
-    # These are simple setters for the variables that control which
-    # oepration to perform. These are called from the photonmover_frontend.
+    # Operations performed by the commands that only change a setting.
+
+    def apply_wavelength(self):
+        print("Setting Wavelength...")
+        self.light_source.set_wavelength(self.new_wavelength)
+        self.power_meter.set_wavelength(self.new_wavelength)
+        # Set unable filter wavelength if necessary
+        if self.tf_with_laser:
+            self.tunable_filter.set_wavelength(self.new_wavelength)
+
+    def apply_pm_range(self):
+        print("Setting power Meter Range...")
+        if self.new_pm_range == PM_AUTO_RANGE:
+            self.power_meter.set_range(3, 'AUTO')
+        else:
+            self.power_meter.set_range(3, self.new_pm_range)
+
+    def apply_tf_wavelength(self):
+        print("Setting Tunable Filter Wavelength...")
+        self.tunable_filter.set_wavelength(self.new_tf_wavelength)
+
+    def apply_power(self):
+        print("Setting Output Power...")
+        self.light_source.set_power(self.new_power)
+
+    def apply_laser_state(self):
+        if self.new_laser_state:
+            print("Laser Turn On...")
+            self.light_source.turn_on()
+        else:
+            print("Laser Turn Off...")
+            self.light_source.turn_off()
+
+    def apply_bias(self):
+        print("Setting Bias...")
+        self.source_meter.set_voltage(self.parent.pd_bias)
+        time.sleep(0.5)
+
+    def apply_bias_2(self):
+        print("Setting Bias...")
+        self.source_meter_2.set_voltage(self.parent.pd_bias_2)
+        time.sleep(0.5)
+
+    def apply_el_att(self):
+        print("Setting electrical attenuation...")
+        self.el_att.set_attenuation(self.parent.el_att)
+
+    # --------------------------------------------------------------------------
+    # --------------------------------------------------------------------------
+    # --------------------------------------------------------------------------
+    # These are the methods that queue the operations to perform. These are
+    # called from the photonmover_frontend.
+
+    def queue_command(self, method, measurement=False, **attributes):
+        """
+        Queues an operation for the GPIBManager thread, after the ones already queued
+        :param method: the method that performs the operation
+        :param measurement: True if the operation is a measurement (it can be cancelled)
+        :param attributes: attributes to set before performing it (e.g. user_file_path)
+        :return: None
+        """
+        with self.pending_lock:
+            self._put_command(method, measurement, attributes)
+
+    def _put_command(self, method, measurement, attributes):
+        # Called with pending_lock held
+        order = next(self.command_order)
+        if measurement:
+            self.pending_measurements += 1
+            self.last_measurement_order = order
+        self.commands.put((PRIORITY_COMMAND, order, method, attributes, measurement))
+        return order
+
+    def queue_setting(self, method, **attributes):
+        """
+        Queues a setting. If it is already waiting in the queue and no measurement was queued
+        after it, it is not queued again: the waiting one uses the new attributes.
+        :param method: the method that applies the setting
+        :param attributes: attributes to set before applying it (e.g. new_wavelength)
+        :return: None
+        """
+        with self.pending_lock:
+            pending = self.pending_settings.get(method.__name__)
+            if pending is not None and pending[0] > self.last_measurement_order:
+                pending[1].update(attributes)
+                return
+
+            order = self._put_command(method, False, attributes)
+            self.pending_settings[method.__name__] = (order, attributes)
+
+    def queue_measurement(self, method, user_file_path, **attributes):
+        """
+        Queues a measurement, which saves its data to user_file_path
+        :param method: the method that performs the measurement
+        :param user_file_path: path given by the user for the data files
+        :param attributes: other attributes to set before performing it (e.g. power_range)
+        :return: None
+        """
+        self.queue_command(method, measurement=True, user_file_path=user_file_path, **attributes)
+
+    def cancel_measurement(self):
+        """
+        Cancels the running measurement, or the next queued one if none is running yet.
+        Stepped measurements stop at the end of the current step. Sweeps run by the
+        instruments themselves (MPM200, DAQ and HP lightwave sweeps, IV hardware sweeps)
+        are not interrupted.
+        Nothing happens if there is no measurement running or queued.
+        """
+        with self.pending_lock:
+            if self.pending_measurements > 0:
+                self.cancel_event.set()
 
     def close(self):
         self.running = 0
+        self.cancel_event.set()
+        self.commands.put((PRIORITY_STOP, next(self.command_order), None, {}, False))
 
     def turn_on_laser_f(self):
-        self.turn_on_laser = 1
+        self.queue_setting(self.apply_laser_state, new_laser_state=True)
 
     def turn_off_laser_f(self):
-        self.turn_off_laser = 1
+        self.queue_setting(self.apply_laser_state, new_laser_state=False)
 
     def set_bias_f(self):
-        self.set_bias = 1
+        self.queue_setting(self.apply_bias)
 
     def set_bias_2_f(self):
-        self.set_bias_2 = 1
+        self.queue_setting(self.apply_bias_2)
 
     def set_electrical_att(self):
-        self.set_el_att = 1
+        self.queue_setting(self.apply_el_att)
 
     def set_wavelength(self, wavelength):
-        self.new_wavelength = wavelength
-        self.set_new_wav = 1
+        self.queue_setting(self.apply_wavelength, new_wavelength=wavelength)
 
     def set_tf_wavelength(self, tf_wavelength):
-        self.new_tf_wavelength = tf_wavelength
-        self.set_new_tf_wav = 1
+        self.queue_setting(self.apply_tf_wavelength, new_tf_wavelength=tf_wavelength)
 
     def set_tf_w_laser(self, tf_w_laser):
         self.tf_with_laser = tf_w_laser
@@ -623,71 +757,52 @@ class GPIBManager(threading.Thread):
         self.store_current = store_current
 
     def set_power(self, power):
-        self.new_power = power
-        self.set_new_power = 1
+        self.queue_setting(self.apply_power, new_power=power)
 
     def set_pm_range(self, range):
-        self.new_pm_range = range
-        self.set_new_pm_range = 1
+        self.queue_setting(self.apply_pm_range, new_pm_range=range)
 
     def calibration_f(self):
-        self.calibration = 1
+        self.queue_command(self.perform_calibration, measurement=True)
 
     def no_calibration_f(self):
-        self.no_calibration = 1
+        self.queue_command(self.perform_no_calibration)
 
     def tx_scan_f(self, user_file_path, power_range):
-        self.user_file_path = user_file_path
-        self.tx_scan = 1
-        self.power_range = power_range
+        self.queue_measurement(self.perform_tx_measurement, user_file_path, power_range=power_range)
 
     def tx_bias_scan_f(self, user_file_path, power_range):
-        self.user_file_path = user_file_path
-        self.tx_bias_scan = 1
-        self.power_range = power_range
+        self.queue_measurement(self.perform_tx_bias_measurement, user_file_path, power_range=power_range)
 
     def tx_power_scan_f(self, user_file_path, power_range):
-        self.user_file_path = user_file_path
-        self.tx_power_scan = 1
-        self.power_range = power_range
+        self.queue_measurement(self.perform_tx_power_scan, user_file_path, power_range=power_range)
 
     def tx_time_scan_f(self, user_file_path, power_range):
-        self.user_file_path = user_file_path
-        self.tx_time_scan = 1
-        self.power_range = power_range
+        self.queue_measurement(self.perform_tx_time_measurement, user_file_path, power_range=power_range)
 
     def take_IV_f(self, user_file_path):
-        self.user_file_path = user_file_path
-        self.take_IV = 1
+        self.queue_measurement(self.perform_iv_measurement, user_file_path)
 
     def take_RLV_f(self, user_file_path):
-        self.user_file_path = user_file_path
-        self.take_RLV = 1
+        self.queue_measurement(self.perform_rlv_measurement, user_file_path)
 
     def take_RLP_f(self, user_file_path):
-        self.user_file_path = user_file_path
-        self.take_RLP = 1
+        self.queue_measurement(self.perform_rlp_measurement, user_file_path)
 
     def get_VNA_trace(self, user_file_path):
-        self.user_file_path = user_file_path
-        self.take_vna_trace = 1
+        self.queue_measurement(self.retrieve_vna_trace, user_file_path)
 
     def trigger_VNA_trace(self, user_file_path):
-        self.user_file_path = user_file_path
-        self.start_vna_trace = 1
+        self.queue_measurement(self.start_vna_trace_trigger, user_file_path)
 
     def take_output_curve(self, user_file_path):
-        self.user_file_path = user_file_path
-        self.take_trans_output_curve = 1
+        self.queue_measurement(self.perform_transistor_output_curve, user_file_path)
 
     def meas_pv_mod_outp(self, i_ds, user_file_path):
-        self.ds_current = i_ds
-        self.user_file_path = user_file_path
-        self.take_pv_mod_outp = 1
+        self.queue_measurement(self.perform_pv_mod_output_curve, user_file_path, ds_current=i_ds)
 
     def VNA_bias_wl_scan(self, user_file_path):
-        self.user_file_path = user_file_path
-        self.take_bw_vs_v = 1
+        self.queue_measurement(self.perform_bw_vs_v, user_file_path)
 
     # --------------------------------------------------------------------------
     # --------------------------------------------------------------------------
@@ -696,9 +811,9 @@ class GPIBManager(threading.Thread):
     def get_state(self):
         """
         Records the current state of the setup (wavelength, power, laser on,
-        source meter voltage)
+        source meter voltages)
         :return: A list with the different parameters:
-            [prev_wl, prev_power, laser_active, source_meter_voltage]
+            [prev_wl, prev_power, laser_active, source_meter_voltage, source_meter_2_voltage]
         """
         if self.new_wavelength > 0:
             wl = self.new_wavelength
@@ -716,15 +831,16 @@ class GPIBManager(threading.Thread):
             laser_active = False
 
         voltage = self.parent.pd_bias
+        voltage_2 = self.parent.pd_bias_2
 
-        return [wl, power, laser_active, voltage]
+        return [wl, power, laser_active, voltage, voltage_2]
 
     def perform_calibration(self):
 
         new_calibration = list()
 
         # SAve current state so that we can get back to it after the calibration
-        [prev_wl, prev_power, laser_active, spam] = self.get_state()
+        [prev_wl, prev_power, laser_active, spam, spam_2] = self.get_state()
 
         laser_power = 1.00  # mW (switchable)
         measurement_count = 10 # NUmber of times the same measurement is repeated
@@ -737,6 +853,8 @@ class GPIBManager(threading.Thread):
 
         for self.new_wavelength in np.linspace(self.start_cal_wav, self.stop_cal_wav, self.num_cal_wavs):
 
+            self.check_cancelled()
+
             self.light_source.set_wavelength(self.new_wavelength)
             self.power_meter.set_wavelength(self.new_wavelength)
 
@@ -754,13 +872,17 @@ class GPIBManager(threading.Thread):
 
             print("Mean ratio for %.2fnm = %.2f" % (self.new_wavelength, ave_ratio))
 
-        self.parent.optical_calibration = new_calibration
-        self.parent.cal_set == "PATH_CALIBRATION"
+        calibration_wavs = np.linspace(self.start_cal_wav, self.stop_cal_wav, self.num_cal_wavs)
+        self.parent.optical_calibration = Calibration(calibration_wavs, new_calibration,
+                                                      kind=CALIBRATION_INTERPOLATION,
+                                                      metadata={'file': self.parent.optical_calibration_file})
+        self.parent.cal_set = "PATH_CALIBRATION"
 
         # Save the calibration into the pickle file
         pickle_file_object = open(self.parent.optical_calibration_file, 'wb')
-        pickle.dump(self.parent.optical_calibration, pickle_file_object)
+        pickle.dump(new_calibration, pickle_file_object)
         pickle_file_object.close()
+        self.parent.calibrations.put(self.parent.optical_calibration_file, self.parent.optical_calibration)
 
         # Go back to previous state
         self.light_source.set_wavelength(prev_wl)
@@ -771,25 +893,17 @@ class GPIBManager(threading.Thread):
 
         # Plot the data
         # plt.ion()
-        plt.plot(np.linspace(self.start_cal_wav, self.stop_cal_wav, self.num_cal_wavs),
-                 new_calibration)
+        plt.plot(calibration_wavs, new_calibration)
         plt.show()
         # plt.draw()
         # plt.pause(0.001)
 
     def perform_no_calibration(self):
 
-        new_calibration = list()
-
-        for self.new_wavelength in np.linspace(self.start_cal_wav, self.stop_cal_wav, self.num_cal_wavs):
-            new_calibration.append(1)
-
-        self.parent.optical_calibration = new_calibration
-
-        pickle_file_object = open(self.parent.optical_calibration_file_None, 'wb')
-        pickle.dump(self.parent.optical_calibration, pickle_file_object)
-        pickle_file_object.close()
-        self.parent.cal_set == "NONE"
+        # The measured calibrations are kept in the parent's cache, so going back
+        # to one of them does not need to read the file again
+        self.parent.cal_set = "NONE"
+        self.parent.load_calibration()
 
     def retrieve_vna_trace(self, save_data=True, plot=False):
         """
@@ -861,7 +975,7 @@ class GPIBManager(threading.Thread):
         """
 
         # Save current state so that we can get back to it after the measurement
-        [prev_wl, prev_power, laser_active, prev_bias] = self.get_state()
+        [prev_wl, prev_power, laser_active, prev_bias, spam] = self.get_state()
 
         # Turn laser on if necessary
         if not laser_active:
@@ -878,6 +992,8 @@ class GPIBManager(threading.Thread):
 
             for self.new_wavelength in np.linspace(self.parent.start_meas_wl, self.parent.stop_meas_wl,
                                                   self.parent.num_meas_wl):
+                self.check_cancelled()
+
                 # Set the wavelength
                 self.light_source.set_wavelength(self.new_wavelength)
                 if self.tf_with_laser:
@@ -952,7 +1068,7 @@ class GPIBManager(threading.Thread):
         :return:
         """
 
-        [prev_wl, prev_power, laser_active, spam] = self.get_state()
+        [prev_wl, prev_power, laser_active, spam, spam_2] = self.get_state()
 
         init_wav = self.parent.start_meas_wl
         end_wav = self.parent.stop_meas_wl
@@ -993,47 +1109,20 @@ class GPIBManager(threading.Thread):
         # In the continuous sweep it is necessary to calibrate the power data
         po = self.power_meter.get_power_offsets(port=MPM200_REC_PORT,
                                                 wavelengths=np.linspace(init_wav, end_wav, num_wav), wave_ref=init_wav)
-        rec_cal_powers = list(map(lambda x, y: x + y, rec_powers, po))
+        rec_cal_powers = rec_powers + po
 
         if MPM200_TAP_PORT is not None:
             ref_powers = self.power_meter.get_logged_data(port=MPM200_TAP_PORT)
             po = self.power_meter.get_power_offsets(port=MPM200_REC_PORT,
                                                     wavelengths=np.linspace(init_wav, end_wav, num_wav),
                                                     wave_ref=init_wav)
-            ref_cal_powers = list(map(lambda x, y: x + y, ref_powers, po))
+            tap_powers = dbm_to_w(ref_powers + po)
         else:
-            ref_cal_powers = None
+            tap_powers = None
 
         # Now we have the data. Save it.
-
-        # Matrix to save the data
-        measurements = np.zeros((self.parent.num_meas_wl + 1, 7), float)
-
         wavs = np.linspace(init_wav, end_wav, num_wav)
-
-        for i in range(len(wavs)):
-
-            through_cal_factor = self.get_calibration_factor(wavs[i])
-
-            rec_power = np.power(10, rec_cal_powers[i]/10)*1e-3
-            tap_power = 0
-            if MPM200_TAP_PORT is not None:
-                tap_power = np.power(10, ref_cal_powers[i]/10)*1e-3
-
-                through_loss = 10 * np.log10((rec_power + 1.0e-15) /
-                                             (tap_power / through_cal_factor + 1.0e-15))
-                measured_input_power = tap_power / through_cal_factor + 1.0e-15
-            else:
-                through_loss = 0
-                measured_input_power = 0
-
-            measurements[i, 0] = 1550.0  # We don't measure the wavelength
-            measurements[i, 1] = through_loss
-            measurements[i, 2] = measured_input_power
-            measurements[i, 3] = wavs[i]
-            measurements[i, 4] = rec_power
-            measurements[i, 5] = tap_power
-            measurements[i, 6] = 0  # We don't measure the current
+        measurements = self.tx_measurements(wavs, dbm_to_w(rec_cal_powers), tap_powers)
 
         if save_data:
             save_directory = os.path.dirname(self.user_file_path)
@@ -1087,7 +1176,7 @@ class GPIBManager(threading.Thread):
         :return:
         """
 
-        [prev_wl, prev_power, laser_active, spam] = self.get_state()
+        [prev_wl, prev_power, laser_active, spam, spam_2] = self.get_state()
 
         # Turn laser on if necessary
         if not laser_active:
@@ -1105,32 +1194,14 @@ class GPIBManager(threading.Thread):
         self.light_source.start_sweep()
         self.ni_daq.wait_task()
         daq_data = self.ni_daq.read_data(self.parent.num_meas_wl+1)
-        print(daq_data[0])
-        print(daq_data[1])
-        # Matrix to save the data
-        measurements = np.zeros((self.parent.num_meas_wl+1, 7), float)
+        print("Read %d samples per channel" % len(daq_data[0]))
 
+        # Convert the voltages to powers (W), based on the range
         wavs = np.linspace(self.parent.start_meas_wl, self.parent.stop_meas_wl, self.parent.num_meas_wl+1)
+        measured_received_power = np.asarray(daq_data[0]) * np.power(10, (self.power_range/10)) * 1e-3
+        tap_power = np.asarray(daq_data[1]) * np.power(10, (0/10)) * 1e-3  # The tap channel is in the 0 dBm range
 
-        for i in range(len(wavs)):
-
-            # Need to convert voltage to power, based on the range
-
-            measured_received_power = daq_data[0][i]*np.power(10, (self.power_range/10))*1e-3  # power in W
-            tap_power = daq_data[1][i]*np.power(10, (0/10))*1e-3
-
-            through_cal_factor = self.get_calibration_factor(wavs[i])
-            through_loss = 10 * np.log10((measured_received_power + 1.0e-15) /
-                                         (tap_power / through_cal_factor + 1.0e-15))
-            measured_input_power = tap_power / through_cal_factor + 1.0e-15
-
-            measurements[i, 0] = 1550.0   # We don't measure the wavelength
-            measurements[i, 1] = through_loss
-            measurements[i, 2] = measured_input_power
-            measurements[i, 3] = wavs[i]
-            measurements[i, 4] = measured_received_power
-            measurements[i, 5] = tap_power
-            measurements[i, 6] = 0  # We don't measure the current
+        measurements = self.tx_measurements(wavs, measured_received_power, tap_power)
 
         if save_data:
             save_directory = os.path.dirname(self.user_file_path)
@@ -1210,7 +1281,7 @@ class GPIBManager(threading.Thread):
             print("Saving data to ", out_file_path)
 
         # Save current state so that we can get back to it after the measurement
-        [prev_wl, prev_power, laser_active, spam] = self.get_state()
+        [prev_wl, prev_power, laser_active, spam, spam_2] = self.get_state()
 
         # Turn laser on if necessary
         if not laser_active:
@@ -1218,8 +1289,18 @@ class GPIBManager(threading.Thread):
 
         row = 0
 
-        for self.new_wavelength in np.linspace(self.parent.start_meas_wl, self.parent.stop_meas_wl,
-                                              self.parent.num_meas_wl):
+        if self.using_HP:
+            # The HP lightwave can take the whole sweep itself, logging the wavelengths and powers.
+            # The wavelength meter cannot follow it, so the logged wavelengths replace its readings.
+            measurements = self.take_mainframe_sweep()
+            wavelengths = []
+        else:
+            wavelengths = np.linspace(self.parent.start_meas_wl, self.parent.stop_meas_wl,
+                                      self.parent.num_meas_wl)
+
+        for self.new_wavelength in wavelengths:
+
+            self.check_cancelled()
 
             self.light_source.set_wavelength(self.new_wavelength)
             self.power_meter.set_wavelength(self.new_wavelength)
@@ -1274,6 +1355,29 @@ class GPIBManager(threading.Thread):
 
         return measurements
 
+    def take_mainframe_sweep(self):
+        """
+        Takes a continuous lambda-logged sweep with the HP lightwave and builds
+        the same measurement matrix as the stepped sweep in perform_tx_measurement_mainframe.
+        The wavelength meter is not read, the logged wavelengths are used instead.
+        The current can't be measured at each wavelength either, so if store_current
+        is set the current column is NaN.
+        :return: A matrix with one row per logged wavelength
+        """
+
+        sweep = self.light_source.take_sweep(self.parent.start_meas_wl, self.parent.stop_meas_wl,
+                                             self.parent.num_meas_wl)
+        if sweep is None:
+            return np.zeros((0, 7), float)
+
+        if self.store_current:
+            current = np.nan
+        else:
+            current = 0
+
+        return self.tx_measurements(sweep['wavelength'], sweep['rec_power'], sweep['tap_power'],
+                                    meas_wavelengths=sweep['wavelength'], current=current)
+
     def perform_tx_bias_measurement(self, save_data=True, plot=False):
         """
         Get transmission vs wavelength at the different bias voltages specified
@@ -1284,7 +1388,7 @@ class GPIBManager(threading.Thread):
         """
 
         # Save current state so that we can get back to it after the measurement
-        [prev_wl, prev_power, laser_active, prev_bias] = self.get_state()
+        [prev_wl, prev_power, laser_active, prev_bias, spam] = self.get_state()
 
         # Turn laser on if necessary
         if not laser_active:
@@ -1300,6 +1404,8 @@ class GPIBManager(threading.Thread):
 
         for v_set in np.linspace(start_voltage, end_voltage, num_voltage):
 
+            self.check_cancelled()
+
             # We just have to set the voltage and do a TxMeasurement.
             self.source_meter.set_voltage(v_set)
             measurement = self.perform_tx_measurement(save_data=False, plot=False)
@@ -1351,7 +1457,7 @@ class GPIBManager(threading.Thread):
         """
 
         # Save current state so that we can get back to it after the measurement
-        [prev_wl, prev_power, laser_active, prev_bias] = self.get_state()
+        [prev_wl, prev_power, laser_active, prev_bias, spam] = self.get_state()
 
         # Turn laser on if necessary
         if not laser_active:
@@ -1367,6 +1473,8 @@ class GPIBManager(threading.Thread):
 
         for power in np.linspace(start_power, end_power, num_power):
 
+            self.check_cancelled()
+
             # We just have to set the voltage and do a TxMeasurement.
             self.light_source.set_power(power)
 
@@ -1423,9 +1531,16 @@ class GPIBManager(threading.Thread):
         num_bias = self.parent.num_meas_v
 
         # Save current state so that we can get back to it after the measurement
-        [prev_wl, prev_power, laser_active, prev_bias] = self.get_state()
+        [prev_wl, prev_power, laser_active, prev_bias, spam] = self.get_state()
 
-        iv_data = self.source_meter.take_IV(start_bias, stop_bias, num_bias)
+        # Let the instrument sequence the sweep and read all the data back at the end. If it
+        # cannot (no native sweep, or more points than its buffer), step the voltage from here.
+        try:
+            iv_data = self.source_meter.hardware_sweep(start_bias, stop_bias, num_bias,
+                                                       nplc=IV_SWEEP_NPLC, delay=IV_SWEEP_DELAY)
+        except (NotImplementedError, ValueError) as e:
+            print('Hardware sweep not available (%s). Taking the IV point by point.' % e)
+            iv_data = self.source_meter.take_IV(start_bias, stop_bias, num_bias)
 
         if save_data:
             save_directory = os.path.dirname(self.user_file_path)
@@ -1480,6 +1595,8 @@ class GPIBManager(threading.Thread):
         # Force a Vgs, take IV curve of the DS.
         for gate_v in np.linspace(start_gate_bias, stop_gate_bias, num_gate_bias):
 
+            self.check_cancelled()
+
             self.source_meter_2.set_voltage(gate_v)
             iv_data = self.perform_iv_measurement(save_data=False, plot=False)
 
@@ -1529,6 +1646,8 @@ class GPIBManager(threading.Thread):
 
         # Force a Vgs, measure Vds.
         for i, gate_v in enumerate(np.linspace(start_gate_bias, stop_gate_bias, num_gate_bias)):
+            self.check_cancelled()
+
             self.source_meter_2.set_voltage(gate_v)
             vds = self.source_meter.measure_voltage()
 
@@ -1582,42 +1701,75 @@ class GPIBManager(threading.Thread):
 
         tap_power, measured_received_power = self.power_meter.get_powers()
 
-        if calibration:
+        through_loss, measured_input_power = self.through_loss(self.new_wavelength, measured_received_power,
+                                                               tap_power, calibration)
 
-            through_cal_factor = self.get_calibration_factor(self.new_wavelength)
-            through_loss = 10 * np.log10((measured_received_power + 1.0e-15) /
-                                         (tap_power / through_cal_factor + 1.0e-15))
+        return through_loss, measured_input_power, measured_received_power, tap_power
 
-            measured_input_power = tap_power / through_cal_factor + 1.0e-15
+    def through_loss(self, wavelengths, rec_power, tap_power, calibration=True):
+        """
+        Calculates the transmission from the received and tap powers. Works
+        on single values or on whole sweeps at once.
+        :param wavelengths: wavelength or array of wavelengths (nm), for the calibration
+        :param rec_power: received power(s) (W)
+        :param tap_power: tap power(s) (W)
+        :param calibration: Boolean indicating if the tap calibration has to be applied
+        :return: through_loss (dB) and measured_input_power (W), with the shape of the powers
+        """
+        if calibration:
+            through_cal_factor = self.get_calibration_factor(wavelengths)
         else:
-            through_loss = 10 * np.log10((measured_received_power + 1.0e-15)
-                                         / (tap_power + 1.0e-15))
-            measured_input_power = tap_power + 1.0e-15
+            through_cal_factor = 1
 
-        return through_loss, measured_input_power, measured_received_power, tap_power
+        measured_input_power = np.asarray(tap_power) / through_cal_factor + 1.0e-15
+        through_loss = 10 * np.log10((np.asarray(rec_power) + 1.0e-15) / measured_input_power)
+
+        return through_loss, measured_input_power
+
+    def tx_measurements(self, wavelengths, rec_power, tap_power, meas_wavelengths=1550.0, current=0):
+        """
+        Builds the matrix saved by the transmission measurements from the powers of a whole sweep
+        :param wavelengths: array with the set wavelengths (nm)
+        :param rec_power: array with the received powers (W)
+        :param tap_power: array with the tap powers (W). None if there is no tap, in which case
+                the through loss, input power and tap power are 0.
+        :param meas_wavelengths: measured wavelength(s). 1550 if they are not measured.
+        :param current: measured current(s)
+        :return: A matrix with one row per wavelength and columns: measured wavelength, through loss,
+                input power, set wavelength, received power, tap power, current
+        """
+        measurements = np.zeros((len(wavelengths), 7), float)
+
+        if tap_power is not None:
+            measurements[:, 1], measurements[:, 2] = self.through_loss(wavelengths, rec_power, tap_power)
+            measurements[:, 5] = tap_power
+
+        measurements[:, 0] = meas_wavelengths
+        measurements[:, 3] = wavelengths
+        measurements[:, 4] = rec_power
+        measurements[:, 6] = current
+
+        return measurements
 
     def get_calibration_factor(self, wav):
         """
         Returns the calibration factor for the current wavelength based on the
-        pickle calibration file. This calibration factor is the real splitting
-        in the splitter used for the tap.
+        loaded calibration (interpolated with CALIBRATION_INTERPOLATION). This
+        calibration factor is the real splitting in the splitter used for the tap.
+        Outside of the calibrated range, the factor of the closest end is used.
 
-        :return: The calibration factor
+        :param wav: wavelength, or array of wavelengths (nm)
+        :return: The calibration factor, or an array with the factor of each wavelength
         """
 
-        if self.parent.cal_set == "NONE":
+        if self.parent.cal_set == "NONE" or self.parent.optical_calibration is None:
             return 1
 
-        # Find the measured calibration wavelength that is closer to the
-        # current wavelength and return this number.
-        wave_delta = wav - self.start_cal_wav
-        wave_index = int(
-            round(wave_delta / (self.stop_cal_wav - self.start_cal_wav) * (self.num_cal_wavs - 1)))
-
-        if wave_index > self.num_cal_wavs - 1:
-            wave_index = self.num_cal_wavs - 1
-        elif wave_index < 0:
-            wave_index = 0
-        # print(wave_index)
-        # print(self.parent.optical_calibration)
-        return self.parent.optical_calibration[wave_index]
+        calibration = self.parent.optical_calibration
+        if not isinstance(calibration, Calibration):
+            # List of factors over the calibration wavelengths
+            calibration = Calibration(np.linspace(self.start_cal_wav, self.stop_cal_wav, len(calibration)),
+                                      calibration)
+            self.parent.optical_calibration = calibration
+
+        return calibration(wav, kind=CALIBRATION_INTERPOLATION)
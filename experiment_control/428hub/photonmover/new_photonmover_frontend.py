@@ -32,6 +32,7 @@
 import wx
 import pickle
 from new_GPIB_manager import *
+from calibration import CalibrationCache
 import time
 import numpy as np
 
@@ -147,7 +148,7 @@ class ControllerFrame(wx.Frame):
                                                  defaults_menu_infos, defaults_menu_methods)
 
         # Set up an Experiments Menu
-        exp_menu_ids = [100, 101, 102, 103, 104, 105, 106, 107, 108, 109, 110, 111, 112]
+        exp_menu_ids = [100, 101, 102, 103, 104, 105, 106, 107, 108, 109, 110, 111, 112, 113]
         exp_menu_captions = ["Transmission",
                              "Transmission vs. bias",
                              "Transmission vs. power",
@@ -160,7 +161,8 @@ class ControllerFrame(wx.Frame):
                              "Bandwidth vs bias vs wl measurement",
                              "Measure and get bandwidth data",
                              "Measure transistor output curve",
-                             "Measure pv mod output curve"]
+                             "Measure pv mod output curve",
+                             "Cancel measurement"]
         exp_menu_infos = [" Measure transmission over preset wavelength set, constant bias",
                           " Measure transmission over preset wavelength set and bias, constant power",
                           " Perform wavelength sweeps at different power levels",
@@ -173,12 +175,14 @@ class ControllerFrame(wx.Frame):
                           " Gets bandwidth data at different bias voltages and wavelengths using the vNA",
                           " Triggers a VNA measurement and saves the data",
                           " Measure Ids vs Vds for varying Vgs",
-                          " Meaure Vds vs Vgs for a fixed Ids"
+                          " Meaure Vds vs Vgs for a fixed Ids",
+                          " Stops the running (or next queued) measurement at its next step and goes back to"
+                          " the previous state. Sweeps run by the instruments can't be interrupted"
                           ]
         exp_menu_methods = [self.on_tx, self.on_tx_vs_V, self.on_tx_vs_P, self.on_IV,
                             self.on_RLV, self.on_tx_vs_time, self.on_RLP, self.on_calibration,
                             self.on_BW, self.on_BW_vs_V, self.on_BW_trigger, self.on_trans_output_curve,
-                            self.on_pv_mod_outp]
+                            self.on_pv_mod_outp, self.on_cancel]
         experiments_menu = self.__create_dropdown__(exp_menu_ids, exp_menu_captions,
                                                     exp_menu_infos, exp_menu_methods)
         # Create the Menubar
@@ -1017,6 +1021,10 @@ class ControllerFrame(wx.Frame):
 
         dialog.Destroy()
 
+    def on_cancel(self, e):
+        print('Cancelling the measurement')
+        self.parent.gpib_manager.cancel_measurement()
+
     def on_done(self, event):
         # When a subthread finishes, it creates a done event. If the
         # program is ready to be closed, the program will quit.
@@ -1100,9 +1108,11 @@ class ControllerApp(wx.App):
         # Program state indicator
         self.done = 0
 
-        # Persistent calibration pickle
-        self.optical_calibration = list()
+        # Persistent calibration pickle. The loaded calibrations are cached, so
+        # switching between them does not read the files again.
+        self.optical_calibration = None
         self.optical_calibration_file = path_loss_cal_file
+        self.calibrations = CalibrationCache(kind=CALIBRATION_INTERPOLATION)
 
         # Create an instance of our customized Frame class
         self.app_frame = ControllerFrame(self, -1, "PhotonMover Fiber Control Front-End")
@@ -1141,9 +1151,7 @@ class ControllerApp(wx.App):
     def load_calibration(self):
 
         if self.cal_set == "PATH_CALIBRATION":
-            pickle_file_object = open(self.optical_calibration_file, 'rb')
-            self.optical_calibration = pickle.load(pickle_file_object)
-            pickle_file_object.close()
+            self.optical_calibration = self.calibrations.get(self.optical_calibration_file)
 
         elif self.cal_set == "NONE":
             self.optical_calibration = None
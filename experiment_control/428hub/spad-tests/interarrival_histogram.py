@@ -39,10 +39,10 @@ def open_FreqCounter():
 
 	return COUNTER
 
-COUNTER = open_FreqCounter()
+COUNTER = traced_instrument(open_FreqCounter())
 
 try:
-	SOURCEMETER = Keithley_2400(visa_address='GPIB0::15::INSTR')
+	SOURCEMETER = traced_instrument(Keithley_2400(visa_address='GPIB0::15::INSTR'))
 except:
 	SOURCEMETER = None
 else:
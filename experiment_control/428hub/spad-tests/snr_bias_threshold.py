@@ -82,8 +82,8 @@ def scan_threshold(COUNTER, SOURCEMETER, Vbias):
 
 
 rm = pyvisa.ResourceManager()
-COUNTER = open_FreqCounter()
-SOURCEMETER = Keithley_2400(visa_address='GPIB0::15::INSTR')
+COUNTER = traced_instrument(open_FreqCounter())
+SOURCEMETER = traced_instrument(Keithley_2400(visa_address='GPIB0::15::INSTR'))
 SOURCEMETER.set_current_compliance(Q_(100e-6, 'A'))
 bring_to_breakdown(SOURCEMETER, Vbd)
 
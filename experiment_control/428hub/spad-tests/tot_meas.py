@@ -131,7 +131,7 @@ def sweep_threshold(COUNTER, SOURCEMETER, Vbias):
 
 # Open the instruments
 rm = pyvisa.ResourceManager()
-COUNTER = open_FreqCounter()
+COUNTER = traced_instrument(open_FreqCounter())
 try:
 	from instrumental.drivers.sourcemeasureunit.hp import HP_4156C
 
@@ -149,6 +149,7 @@ else:
 	print('HP opened')
 	SOURCEMETER.set_channel(channel=2)
 
+SOURCEMETER = traced_instrument(SOURCEMETER)
 
 SOURCEMETER.set_current_compliance(Q_(100e-6, 'A'))
 bring_to_breakdown(SOURCEMETER, Vbd)
@@ -1,5 +1,19 @@
 from pint import Quantity as Q_
 import time
+import os
+import sys
+import atexit
+
+__all__ = ['Q_', 'time', 'bring_to_breakdown', 'bring_down_from_breakdown', 'enable_tracing',
+           'traced_instrument']
+
+# File name (e.g. 'command_trace') to record every command sent to the instruments
+# passed through traced_instrument(). When the script ends, the slowest commands are
+# printed, and a timeline (TRACE_FILE.json, for chrome://tracing) and the latency of
+# each command (TRACE_FILE_histograms.json) are saved. Set it with the SPAD_TRACE_FILE
+# environment variable, or by calling enable_tracing() before opening the instruments.
+# See photonmover/instruments/command_trace.py
+TRACE_FILE = os.environ.get('SPAD_TRACE_FILE') or None
 
 # Bring the SPAD from 0V to Vbias at Vbias V/step
 def bring_to_breakdown(SOURCEMETER, Vbd):
@@ -31,3 +45,34 @@ def bring_down_from_breakdown(SOURCEMETER, Vbd):
 
     SOURCEMETER.set_voltage(Q_(0, 'V'))
     print('Sourcemeter at 0V')
+
+# Turn on tracing for the instruments opened from now on, saving the trace to trace_file
+def enable_tracing(trace_file='command_trace'):
+    global TRACE_FILE
+    TRACE_FILE = trace_file
+
+# Trace the commands sent to an instrument (pyvisa resource or instrumental driver) if TRACE_FILE is set.
+# Returns the instrument to use from then on.
+def traced_instrument(instrument):
+    if TRACE_FILE is None:
+        return instrument
+
+    command_trace = _command_trace()
+    if hasattr(instrument, '_rsrc'):
+        return command_trace.trace_instrument(instrument)
+    return command_trace.traced(instrument)
+
+# Start tracing the first time, and save the trace at exit
+def _command_trace():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'photonmover'))
+    from instruments import command_trace
+
+    if command_trace.active_trace() is None:
+        trace = command_trace.start_tracing()
+        atexit.register(_save_trace, trace, TRACE_FILE)
+    return command_trace
+
+def _save_trace(trace, trace_file):
+    trace.print_summary()
+    trace.save_chrome_trace(trace_file + '.json')
+    trace.save_histograms(trace_file + '_histograms.json')
@@ -2,11 +2,44 @@ from datetime import datetime
 from ctypes import cdll,c_long, c_ulong, c_uint32,byref,create_string_buffer,c_bool,c_char_p,c_int,c_int16,c_double, sizeof, c_voidp
 from .TLPM import TLPM, TLPM_ATTR_SET_VAL
 import time
-from instrumental import u
+import threading
+import atexit
+from contextlib import contextmanager
+from ..util.units import u
 
 pm_def = b"USB0::0x1313::0x8079::P1001951::INSTR"
 # pm_def = b"USB0::0x1313::0x8079::::INSTR"
 
+# Open TLPM sessions by resource name, each with a lock. Opening the power
+# meter takes longer than a reading, so sessions are kept open between calls
+# and closed with close_pm (or at exit).
+_pm_sessions = {}
+_pm_sessions_lock = threading.Lock()
+
+@contextmanager
+def pm_session(pm=pm_def):
+    with _pm_sessions_lock:
+        if pm not in _pm_sessions:
+            tlPM = TLPM()
+            resourceName = create_string_buffer(pm)
+            tlPM.open(resourceName, c_bool(True), c_bool(True))
+            _pm_sessions[pm] = (tlPM, threading.RLock())
+        tlPM, lock = _pm_sessions[pm]
+    with lock:
+        yield tlPM
+
+def close_pm(pm=None):
+    # close one session, or all of them if pm is None
+    with _pm_sessions_lock:
+        pms = list(_pm_sessions) if pm is None else [pm]
+        for name in pms:
+            if name in _pm_sessions:
+                tlPM, lock = _pm_sessions.pop(name)
+                with lock:
+                    tlPM.close()
+
+atexit.register(close_pm)
+
 def list_pms():
     tlPM = TLPM()
     deviceCount = c_uint32()
@@ -21,37 +54,25 @@ def list_pms():
     return pms
 
 def get_power(pm=pm_def):
-    tlPM = TLPM()
-    resourceName = create_string_buffer(pm)
-    tlPM.open(resourceName, c_bool(True), c_bool(True))
     power =  c_double()
-    tlPM.measPower(byref(power))
-    tlPM.close()
+    with pm_session(pm) as tlPM:
+        tlPM.measPower(byref(power))
     return power.value * u.watt
 
 def set_wavelength(λ,pm=pm_def):
-    tlPM = TLPM()
-    resourceName = create_string_buffer(pm)
-    tlPM.open(resourceName, c_bool(True), c_bool(True))
-    tlPM.setWavelength(c_double(λ.to(u.nm).m))
-    tlPM.close()
+    with pm_session(pm) as tlPM:
+        tlPM.setWavelength(c_double(λ.to(u.nm).m))
     return
 
 def get_wavelength(pm=pm_def):
-    tlPM = TLPM()
-    resourceName = create_string_buffer(pm)
-    tlPM.open(resourceName, c_bool(True), c_bool(True))
     λ_nm =  c_double()
-    tlPM.getWavelength(TLPM_ATTR_SET_VAL,byref(λ_nm))
-    tlPM.close()
+    with pm_session(pm) as tlPM:
+        tlPM.getWavelength(TLPM_ATTR_SET_VAL,byref(λ_nm))
     return λ_nm.value * u.nm
 
 def get_calibration_msg(pm=pm_def):
-    tlPM = TLPM()
-    resourceName = create_string_buffer(pm)
-    tlPM.open(resourceName, c_bool(True), c_bool(True))
     message = create_string_buffer(1024)
-    tlPM.getCalibrationMsg(message)
+    with pm_session(pm) as tlPM:
+        tlPM.getCalibrationMsg(message)
     cal_msg = c_char_p(message.raw).value.decode('utf-8')
-    tlPM.close()
     return cal_msg
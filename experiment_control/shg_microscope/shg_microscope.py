@@ -5,8 +5,6 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import cm
 from matplotlib.colors import ListedColormap
-from scipy.interpolate import griddata
-from scipy.optimize import curve_fit
 
 # import stuff from instrumental
 from instrumental import instrument
@@ -29,6 +27,7 @@ pow_hwp = instrument('KDC101')
 
 # data_dir = os.path.join(home_dir,"data","shg_microscope")
 data_dir = os.path.join(home_dir,"Dropbox (MIT)","data","shg_microscope")
+saver = AsyncSaver()    # writes scan data in the background while the galvos scan
 
 # Configure DAQ output channels for differential (0V-centered) control of x and y galvo mirrors
 ch_Vx_p, ch_Vx_p_str = daq.ao0, 'Dev1/ao0'
@@ -364,6 +363,7 @@ def pol_dep(x,a,x0):
      return a * np.cos(2*np.deg2rad(x + x0))**4
 
 def find_sample_axes(sample_dir=None,n_angles=100,n_samples=50,time_constant=3*u.ms,wait=100*u.ms):
+    from scipy.optimize import curve_fit
     θ_meas, Pshg_meas = collect_polarization_scan(sample_dir=sample_dir,n_angles=n_angles,n_samples=n_samples,time_constant=time_constant,wait=wait)
     popt,pcov = curve_fit(pol_dep,θ_meas.m,Pshg_meas.m,p0=[Pshg_meas.m.max(),180.0])
     Pshg_fit = Q_(popt[0],Pshg_meas.units)
@@ -449,6 +449,7 @@ def process_scan(read_data,nx,ny,ΔVx,ΔVy,Vx0=Vx0,Vy0=Vy0):
     Vy_meas = read_data[ch_Vy_meas_str]
     # Vx_scan = write_data[ch_Vx_p_str] - write_data[ch_Vx_n_str]
     # Vy_scan = write_data[ch_Vy_p_str] - write_data[ch_Vy_n_str]
+    from scipy.interpolate import griddata
     Vx,Vy = scan_vals(nx,ny,ΔVx,ΔVy,Vx0,Vy0)
     Vx_g, Vy_g = np.meshgrid(Vx.m,Vy.m)
     Vshg_x_g = griddata((Vx_meas.m,Vy_meas.m),Vshg_x.m,(Vx_g,Vy_g))*u.volt
@@ -558,6 +559,7 @@ def gaussian(x,w,x0,A):
 
 def plot_spotzoom(ds,Dxy=10*u.um,figsize=(4.5,4.5),laser_cmap=cm.winter,
     x_wtext=-3,y_wtext=-3,rc_params=shg_rc_params):
+    from scipy.optimize import curve_fit
     laser_cmap = transparent_cmap(laser_cmap)
     ix_min_sz, ix_max_sz, iy_min_sz, iy_max_sz = spotzoom_inds(ds,Dxy=Dxy)
     ix0 = int(np.round((ix_min_sz + ix_max_sz)/2.)) - ix_min_sz
@@ -670,7 +672,7 @@ def collect_scan(nx,ny,ΔVx,ΔVy,Vx0,Vy0,fsamp,name=None,sample_dir=None,wf_expo
     P_ex        = get_excitation_power()
     wf_img, laser_spot_img = wf_and_laser_spot_images(exposure_time=wf_exposure_time)
     x_img,y_img = img_spatial_axes(laser_spot_img)
-    dump_hdf5(
+    saver.dump_hdf5(
         {   'wf_img': wf_img.astype("int"),
             'laser_spot_img': laser_spot_img.astype("int"),
             'dx_dpix': dx_dpix,
@@ -690,13 +692,14 @@ def collect_scan(nx,ny,ΔVx,ΔVy,Vx0,Vy0,fsamp,name=None,sample_dir=None,wf_expo
         open_mode='x',
     )
     scan_task, write_data = configure_scan(nx,ny,ΔVx,ΔVy,Vx0,Vy0,fsamp)
-    dump_hdf5(write_data,fpath)
+    saver.dump_hdf5(write_data,fpath)
     read_data = scan_task.run(write_data)
-    dump_hdf5(read_data,fpath)
+    saver.dump_hdf5(read_data,fpath)
     scan_task.unreserve()
     center_spot(Vx0,Vy0)
     proc_data = process_scan(read_data,nx,ny,ΔVx,ΔVy)
-    dump_hdf5(proc_data,fpath)
+    saver.dump_hdf5(proc_data,fpath)
+    saver.flush()
     ds = load_hdf5(fpath=fpath)
 
     save_scan_images(ds,name,fpath=sample_dir,wf_cmap=cm.binary_r,laser_cmap=cm.winter,shg_cmap=cm.inferno,rc_params=shg_rc_params,format='png')
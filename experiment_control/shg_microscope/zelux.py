@@ -7,7 +7,7 @@ Copied/modified from python code Thorlabs' Scientific Camera Interfaces kit:
 import os
 import sys
 import  numpy as np
-from instrumental import u
+from ..util.units import u
 
 """
 Add Zelux camera DLLs to Windows path for Python/ctypes access
@@ -25,13 +25,12 @@ try:
 except AttributeError:
     pass
 
-from thorlabs_tsi_sdk.tl_camera import TLCameraSDK, OPERATION_MODE
-from thorlabs_tsi_sdk.tl_camera_enums import SENSOR_TYPE
-
 """
 Grab image from camera
 """
 def grab_image(exposure_time=10*u.ms,cam_id=None,image_poll_timeout=2*u.second):
+    # imported on first use since loading the SDK and its DLLs is slow
+    from thorlabs_tsi_sdk.tl_camera import TLCameraSDK
     with TLCameraSDK() as sdk:
         if cam_id is None:
             cameras = sdk.discover_available_cameras()
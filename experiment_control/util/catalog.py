@@ -0,0 +1,373 @@
+"""
+Persistent SQLite index of the files and directories in a data directory tree,
+used by `newest_subdir`, `newest_file` (and so `resolve_sample_dir` and
+`resolve_fpath`) in `experiment_control.util.io` instead of globbing and
+stat-ing every entry of the data directory on every call.
+
+A catalog lives in a file named `catalog_fname` at the root of the data tree.
+Lookups anywhere below that root use it; trees without a catalog keep the old
+glob-based behavior. Create or rebuild a catalog for an existing tree with
+
+    $ python -m experiment_control.util.catalog rebuild ~/data/shg_microscope
+
+or `DataCatalog(data_dir).rebuild()`. Paths returned by `new_path` below the
+root are registered as they are handed out, with `ds_type`, `name` and
+timestamp taken from `new_path`'s arguments. Each directory's modification
+time is also recorded when it is indexed, so files created some other way
+(images saved by matplotlib, files copied onto the share) are picked up by
+re-listing only the directories that have changed since, before a lookup.
+
+Paths are stored relative to the catalog root with '/' separators, so the same
+catalog works wherever the share is mounted.
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import fnmatch
+import argparse
+import threading
+from datetime import datetime
+from .io import timestamp_format
+
+catalog_fname = '.data_catalog.sqlite'
+_racy_dt = 2.0      # directories modified this recently (s) are re-listed on the next lookup
+_registered_dt = 24*3600.0  # paths registered by `new_path` but not created within this time (s) are dropped
+_no_catalog_dt = 30.0       # a directory found to have no catalog is searched again after this time (s)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS entries (
+    path        TEXT PRIMARY KEY,
+    dir         TEXT NOT NULL,
+    fname       TEXT NOT NULL,
+    ds_type     TEXT,
+    name        TEXT,
+    timestamp   REAL,
+    ctime       REAL,
+    is_dir      INTEGER,
+    size        INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_dir_ctime ON entries (dir, ctime);
+CREATE INDEX IF NOT EXISTS entries_ds_type_timestamp ON entries (ds_type, timestamp);
+CREATE TABLE IF NOT EXISTS dirs (
+    dir         TEXT PRIMARY KEY,
+    mtime_ns    INTEGER
+);
+"""
+
+_catalogs = {}      # cache of `find_catalog` results, keyed by directory
+_no_catalog = {}    # directories found to have no catalog, and when
+
+def find_catalog(data_dir):
+    """
+    Return the `DataCatalog` for the tree containing `data_dir`, searching
+    `data_dir` and its parents for a catalog file, or None if there is none.
+    A catalog created later (e.g. by another process) is found within
+    `_no_catalog_dt` seconds.
+    """
+    if not data_dir:
+        return None
+    data_dir = os.path.abspath(data_dir)
+    if data_dir in _catalogs:
+        return _catalogs[data_dir]
+    if time.time() - _no_catalog.get(data_dir,-_no_catalog_dt) < _no_catalog_dt:
+        return None
+    d = data_dir
+    catalog = None
+    while True:
+        if d in _catalogs:
+            catalog = _catalogs[d]
+            break
+        if os.path.isfile(os.path.join(d,catalog_fname)):
+            catalog = DataCatalog(d)
+            break
+        parent = os.path.dirname(d)
+        if parent==d:
+            break
+        d = parent
+    if catalog is None:
+        _no_catalog[data_dir] = time.time()
+    else:
+        _catalogs[data_dir] = catalog
+    return catalog
+
+def parse_fname(fname):
+    """
+    Split a file name made by `new_path` ('<ds_type>_<name>_<timestamp><ext>')
+    into (ds_type, name, timestamp). Parts that can't be identified are None;
+    the timestamp is returned as a POSIX time.
+    """
+    stem = os.path.splitext(fname)[0]
+    parts = stem.split('_')
+    timestamp = None
+    if len(parts)>1:
+        try:
+            timestamp = datetime.strptime(parts[-1],timestamp_format).timestamp()
+            parts = parts[:-1]
+        except ValueError:
+            pass
+    if len(parts)>1:
+        return parts[0], '_'.join(parts[1:]), timestamp
+    elif timestamp is not None:
+        return parts[0], None, timestamp
+    else:
+        return None, stem, None
+
+def _posix_time(t):
+    if t is None or isinstance(t,(int,float)):
+        return t
+    if isinstance(t,str):
+        t = datetime.strptime(t,timestamp_format)
+    return t.timestamp()
+
+def _glob_match(fname,pattern):
+    # match like `glob.glob`: case-insensitive on Windows, and names starting
+    # with '.' only match patterns that start with '.'
+    if fname.startswith('.') and not pattern.startswith('.'):
+        return False
+    return fnmatch.fnmatch(fname,pattern)
+
+class DataCatalog(object):
+
+    def __init__(self,root):
+        self.root = os.path.abspath(root)
+        self.fpath = os.path.join(self.root,catalog_fname)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.fpath,timeout=30,check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(_schema)
+        # replace cached "no catalog" results for directories in this tree
+        for k in [k for k in _no_catalog if k==self.root or k.startswith(self.root+os.sep)]:
+            del _no_catalog[k]
+        _catalogs[self.root] = self
+
+    def __repr__(self):
+        return "DataCatalog({!r})".format(self.root)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+        for k in [k for k,v in _catalogs.items() if v is self]:
+            del _catalogs[k]
+
+    ## path helpers ##
+
+    def _rel(self,path):
+        rel = os.path.relpath(os.path.abspath(path),self.root).replace(os.sep,'/')
+        return '' if rel=='.' else rel
+
+    def _abs(self,rel):
+        return os.path.normpath(os.path.join(self.root,*rel.split('/')))
+
+    def _split(self,rel):
+        d, _, fname = rel.rpartition('/')
+        return d, fname
+
+    ## updating ##
+
+    def register(self,path,ds_type=None,name=None,timestamp=None):
+        """
+        Record a path handed out by `new_path` before it is created. The entry
+        is completed with its type and creation time once it shows up in a
+        directory listing.
+        """
+        rel = self._rel(path)
+        d, fname = self._split(rel)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO entries (path,dir,fname,ds_type,name,timestamp,ctime) VALUES (?,?,?,?,?,?,?)",
+                (rel,d,fname,ds_type,name,_posix_time(timestamp),time.time()),
+            )
+
+    def add(self,path):
+        """
+        Add (or update) an existing file or directory.
+        """
+        st = os.stat(path)
+        rel = self._rel(path)
+        d, fname = self._split(rel)
+        with self._lock, self._conn:
+            self._upsert_stat(d,fname,os.path.isdir(path),st)
+
+    def _upsert_stat(self,d,fname,is_dir,st):
+        rel = '/'.join([d,fname]) if d else fname
+        ds_type, name, timestamp = parse_fname(fname)
+        # keep ds_type/name/timestamp recorded by `register`, if any (no UPSERT,
+        # which needs SQLite >= 3.24)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries (path,dir,fname,ds_type,name,timestamp,ctime,is_dir,size) VALUES (?,?,?,"
+            "COALESCE((SELECT ds_type FROM entries WHERE path=?),?),"
+            "COALESCE((SELECT name FROM entries WHERE path=?),?),"
+            "COALESCE((SELECT timestamp FROM entries WHERE path=?),?),?,?,?)",
+            (rel,d,fname,rel,ds_type,rel,name,rel,timestamp,st.st_ctime,int(is_dir),None if is_dir else st.st_size),
+        )
+
+    def refresh_dir(self,data_dir,force=False):
+        """
+        Re-list `data_dir` if it has changed since it was last indexed, adding
+        new entries and dropping deleted ones. Only new entries are stat-ed.
+        Paths registered by `new_path` more than `_registered_dt` ago that were
+        never created are dropped too.
+        """
+        d = self._rel(data_dir)
+        try:
+            mtime_ns = os.stat(data_dir).st_mtime_ns
+        except FileNotFoundError:
+            return
+        with self._lock:
+            row = self._conn.execute("SELECT mtime_ns FROM dirs WHERE dir=?",(d,)).fetchone()
+            if row is not None and row[0]==mtime_ns and not force:
+                return
+            known = {fname:(is_dir,ctime) for fname,is_dir,ctime in
+                self._conn.execute("SELECT fname, is_dir, ctime FROM entries WHERE dir=?",(d,)).fetchall()}
+            listed = set()
+            with self._conn:
+                with os.scandir(data_dir) as it:
+                    for entry in it:
+                        if entry.name.startswith(catalog_fname):     # catalog and its journal
+                            continue
+                        listed.add(entry.name)
+                        if known.get(entry.name,(None,None))[0] is None:
+                            try:
+                                self._upsert_stat(d,entry.name,entry.is_dir(),entry.stat())
+                            except FileNotFoundError:
+                                pass
+                t_registered = time.time() - _registered_dt
+                gone = [(d,fname) for fname,(is_dir,ctime) in known.items() if fname not in listed
+                    and (is_dir is not None or (ctime or 0) < t_registered)]
+                self._conn.executemany("DELETE FROM entries WHERE dir=? AND fname=?",gone)
+                # a directory modified within the filesystem's timestamp resolution
+                # of this listing may change again without its mtime changing
+                racy = (time.time() - mtime_ns*1e-9) < _racy_dt
+                self._conn.execute("INSERT OR REPLACE INTO dirs (dir,mtime_ns) VALUES (?,?)",(d,None if racy else mtime_ns))
+
+    def refresh(self):
+        """
+        Re-list every indexed directory that has changed since it was indexed.
+        """
+        with self._lock:
+            dirs = [dd for (dd,) in self._conn.execute("SELECT dir FROM dirs").fetchall()]
+        for d in dirs:
+            self.refresh_dir(self._abs(d))
+
+    def rebuild(self,verbose=False):
+        """
+        Re-index the whole tree below the catalog root from scratch.
+        """
+        t_start = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM entries WHERE is_dir IS NOT NULL")
+                self._conn.execute("DELETE FROM dirs")
+            for dirpath, dirnames, filenames in os.walk(self.root):
+                self.refresh_dir(dirpath,force=True)
+                if verbose:
+                    print("indexed " + dirpath)
+        if verbose:
+            with self._lock:
+                n = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            print("indexed {} entries in {:.1f} s".format(n,time.time()-t_start))
+
+    ## lookups ##
+
+    def newest(self,data_dir,filter="*",kind=None):
+        """
+        Newest ('kind'='file' or 'dir', or either) entry in `data_dir` whose name
+        matches the glob pattern `filter`, by creation time, as returned by
+        `newest_file`/`newest_subdir`. None if there is none.
+        """
+        self.refresh_dir(data_dir)
+        query = "SELECT fname FROM entries WHERE dir=? AND is_dir IS NOT NULL"
+        args = [self._rel(data_dir)]
+        if kind is not None:
+            query += " AND is_dir=?"
+            args.append(int(kind=='dir'))
+        query += " ORDER BY ctime DESC"
+        with self._lock:
+            rows = self._conn.execute(query,args).fetchall()
+        for (fname,) in rows:
+            if _glob_match(fname,filter):
+                return os.path.join(data_dir,fname)
+        return None
+
+    def query(self,ds_type=None,name=None,sample=None,data_dir=None,filter=None,
+        t_start=None,t_stop=None,kind='file',newest_first=True,limit=None):
+        """
+        Paths of catalogued entries matching all of the given criteria:
+            ds_type:            e.g. 'GalvoScan', 'PolScan'
+            name:               glob pattern for the `name` part of the file name
+            sample:             sample name, matching parent directories 'Sample_<sample>*'
+            data_dir:           parent directory
+            filter:             glob pattern for the whole file name
+            t_start, t_stop:    time range (datetime, timestamp string or POSIX
+                                time), using the file-name timestamp, or the
+                                creation time if there is none
+        Results reflect the catalog as of the last lookup/refresh; call
+        `refresh()` first to pick up files created outside of `new_path`.
+        """
+        query = "SELECT path, name FROM entries WHERE is_dir IS NOT NULL"
+        args = []
+        if kind is not None:
+            query += " AND is_dir=?"
+            args.append(int(kind=='dir'))
+        if ds_type is not None:
+            query += " AND ds_type=?"
+            args.append(ds_type)
+        if data_dir is not None:
+            query += " AND dir=?"
+            args.append(self._rel(data_dir))
+        if t_start is not None:
+            query += " AND COALESCE(timestamp,ctime)>=?"
+            args.append(_posix_time(t_start))
+        if t_stop is not None:
+            query += " AND COALESCE(timestamp,ctime)<=?"
+            args.append(_posix_time(t_stop))
+        query += " ORDER BY COALESCE(timestamp,ctime) " + ("DESC" if newest_first else "ASC")
+        with self._lock:
+            rows = self._conn.execute(query,args).fetchall()
+        # glob patterns are matched here, the same way as `glob.glob`
+        paths = []
+        for rel, row_name in rows:
+            d, fname = self._split(rel)
+            if name is not None and not (row_name is not None and _glob_match(row_name,name)):
+                continue
+            if sample is not None and not any(_glob_match(part,"Sample_" + sample + "*") for part in d.split('/')):
+                continue
+            if filter is not None and not _glob_match(fname,filter):
+                continue
+            paths.append(self._abs(rel))
+            if limit is not None and len(paths)>=limit:
+                break
+        return paths
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query the data directory catalog.")
+    sub = parser.add_subparsers(dest='command')
+    p_rebuild = sub.add_parser('rebuild',help="(re)index a data directory tree, creating the catalog if needed")
+    p_rebuild.add_argument('data_dir')
+    p_query = sub.add_parser('query',help="list catalogued files, newest first")
+    p_query.add_argument('data_dir')
+    p_query.add_argument('--ds_type')
+    p_query.add_argument('--name')
+    p_query.add_argument('--sample')
+    p_query.add_argument('--filter')
+    p_query.add_argument('--t_start',help="timestamp, formatted as " + timestamp_format.replace('%','%%'))
+    p_query.add_argument('--t_stop')
+    p_query.add_argument('--limit',type=int)
+    args = parser.parse_args(argv)
+    if args.command=='rebuild':
+        DataCatalog(args.data_dir).rebuild(verbose=True)
+    elif args.command=='query':
+        catalog = find_catalog(args.data_dir)
+        if catalog is None:
+            sys.exit("no catalog found for " + args.data_dir + ", run 'rebuild' first")
+        catalog.refresh()
+        for path in catalog.query(ds_type=args.ds_type,name=args.name,sample=args.sample,
+            filter=args.filter,t_start=args.t_start,t_stop=args.t_stop,limit=args.limit):
+            print(path)
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,20 @@ Utility functions for saving and loading experiment and simulation data
 
 import os
 import glob
-import h5py
+import fnmatch
+import time
+import queue
+import copy
+import atexit
+import threading
+from itertools import repeat
+from concurrent.futures import Future
 from datetime import datetime
-from numpy import ndarray
 from .units import Q_, u
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+h5py = lazy_import('h5py')
 
 timestamp_format = '%Y-%m-%d-%H-%M-%S'  # used by `datetime.strftime` in `new_timestamp()`
 
@@ -17,7 +27,16 @@ default_data_dir = os.path.join(home_dir,"data")
 def new_timestamp():
     return datetime.strftime(datetime.now(),timestamp_format)
 
+"""
+`newest_subdir` and `newest_file` use the SQLite catalog in
+`experiment_control.util.catalog` when the data directory tree has one (see
+there for how to create it), and fall back to globbing the directory otherwise.
+`new_path` registers the paths it returns with the catalog.
+"""
 def newest_subdir(data_dir,filter="*"):
+    catalog = _find_catalog(data_dir)
+    if catalog:
+        return catalog.newest(data_dir,filter=filter,kind='dir')
     subdirs = [dd for dd in glob.glob(os.path.join(data_dir,filter)) if os.path.isdir(dd)]
     if subdirs:
         return max(subdirs, key=os.path.getctime)
@@ -25,6 +44,9 @@ def newest_subdir(data_dir,filter="*"):
         return None
 
 def newest_file(data_dir,filter="*"):
+    catalog = _find_catalog(data_dir)
+    if catalog:
+        return catalog.newest(data_dir,filter=filter,kind='file')
     files = [ff for ff in glob.glob(os.path.join(data_dir,filter)) if os.path.isfile(ff)]
     if files:
         return max(files, key=os.path.getctime)
@@ -43,8 +65,15 @@ def new_path(name=None,data_dir=None,ds_type=None,extension='',timestamp=True):
     name_parts = [ds_type, name, timestamp_string]
     full_name = '_'.join([part for part in name_parts if part is not None]) + extension
     full_path = os.path.normpath(os.path.join(data_dir,full_name))
+    catalog = _find_catalog(data_dir)
+    if catalog:
+        catalog.register(full_path,ds_type=ds_type,name=name,timestamp=timestamp_string)
     return full_path
 
+def _find_catalog(data_dir):
+    from .catalog import find_catalog  # imported here since `catalog` imports this module
+    return find_catalog(data_dir)
+
 def resolve_sample_dir(sample_dir,data_dir=default_data_dir):
     if sample_dir is None:
         return newest_subdir(data_dir)
@@ -71,7 +100,136 @@ def resolve_fpath(filter,fpath,sample_dir,data_dir=default_data_dir):
 """
 HDF5 utilities for unitful quantities and arrays
 """
-def dump_hdf5(ds,fpath,open_mode='a'):
+
+"""
+Write policies controlling the HDF5 filter pipeline (compression, byte
+shuffling) and chunk shape of datasets created by `dump_hdf5` and
+`HDF5StreamWriter`. gzip is compact but CPU-bound; lzf is several times faster
+at a somewhat worse ratio; 'none' stores uncompressed, contiguous datasets
+(fastest, and memory-mappable by `load_hdf5(...,lazy=True,mmap=True)`).
+Shuffling bytes before compression usually improves the ratio of integer and
+slowly-varying float data (camera frames, DAQ traces) for little cost.
+
+With `chunks='auto'` the chunk shape is chosen by `auto_chunks` from the
+dataset shape, dtype and the expected `access` pattern:
+    'row':  chunks span whole trailing axes and as many leading rows as fit
+            in `chunk_bytes` (time traces, stacks of frames read one at a time)
+    'tile': roughly square tiles over the last two axes (images that are
+            zoomed/cropped more often than read whole)
+
+Named policies are in `hdf5_write_policies`; `benchmarks/hdf5_write_policies.py`
+measures their write/read throughput for typical datasets. `dump_hdf5` accepts a
+policy name, an `HDF5WritePolicy`, or a dict mapping dataset-name patterns
+(fnmatch style, e.g. '*_img' or 'Dev1/*') to policies.
+"""
+class HDF5WritePolicy(object):
+
+    def __init__(self,compression=None,level=None,shuffle=False,chunks='auto',
+        access='row',chunk_bytes=256*1024):
+        if compression not in (None,'gzip','lzf'):
+            raise ValueError("unsupported compression: " + str(compression))
+        if level is not None and compression!='gzip':
+            raise ValueError("compression level is only supported for gzip")
+        if access not in ('row','tile'):
+            raise ValueError("unsupported access pattern: " + str(access))
+        self.compression = compression
+        self.level = level
+        self.shuffle = shuffle
+        self.chunks = chunks
+        self.access = access
+        self.chunk_bytes = chunk_bytes
+
+    def __repr__(self):
+        return "HDF5WritePolicy(compression={!r}, level={!r}, shuffle={!r}, chunks={!r}, access={!r})".format(
+            self.compression,self.level,self.shuffle,self.chunks,self.access)
+
+    @property
+    def filtered(self):
+        return bool(self.compression or self.shuffle)
+
+    def filter_kwargs(self):
+        kwargs = {}
+        if self.compression:
+            kwargs['compression'] = self.compression
+            if self.level is not None:
+                kwargs['compression_opts'] = self.level
+        if self.shuffle:
+            kwargs['shuffle'] = True
+        return kwargs
+
+    def dataset_kwargs(self,shape,dtype):
+        """
+        keyword arguments for `h5py.Group.create_dataset` for a fixed-size
+        dataset with the given shape and dtype
+        """
+        shape = tuple(shape)
+        if len(shape)==0 or 0 in shape:
+            return {}   # HDF5 can't chunk/filter scalar or empty datasets
+        kwargs = self.filter_kwargs()
+        if self.chunks=='auto':
+            if self.filtered:
+                kwargs['chunks'] = auto_chunks(shape,dtype,access=self.access,chunk_bytes=self.chunk_bytes)
+        elif self.chunks is not None:
+            kwargs['chunks'] = self.chunks
+        return kwargs
+
+def auto_chunks(shape,dtype,access='row',chunk_bytes=256*1024):
+    """
+    chunk shape of roughly `chunk_bytes` for a dataset of shape `shape`, laid out
+    for the access pattern `access` (see `HDF5WritePolicy`)
+    """
+    shape = tuple(shape)
+    n_target = max(1,chunk_bytes//dtype_itemsize(dtype))
+    chunks = [1]*len(shape)
+    if access=='tile' and len(shape)>=2:
+        side = max(1,int(n_target**0.5))
+        chunks[-1] = min(shape[-1],side)
+        chunks[-2] = min(shape[-2],max(1,n_target//chunks[-1]))
+    else:
+        for axis in reversed(range(len(shape))):
+            chunks[axis] = min(shape[axis],n_target)
+            n_target = max(1,n_target//chunks[axis])
+            if chunks[axis]<shape[axis]:
+                break
+    return tuple(chunks)
+
+def dtype_itemsize(dtype):
+    return np.dtype(dtype).itemsize
+
+hdf5_write_policies = {
+    'none':             HDF5WritePolicy(),
+    'lzf':              HDF5WritePolicy(compression='lzf'),
+    'lzf-shuffle':      HDF5WritePolicy(compression='lzf',shuffle=True),
+    'gzip1':            HDF5WritePolicy(compression='gzip',level=1),
+    'gzip1-shuffle':    HDF5WritePolicy(compression='gzip',level=1,shuffle=True),
+    'gzip':             HDF5WritePolicy(compression='gzip'),    # h5py default level (4)
+    'gzip-shuffle':     HDF5WritePolicy(compression='gzip',shuffle=True),
+    'gzip9':            HDF5WritePolicy(compression='gzip',level=9),
+}
+default_write_policy = 'gzip'
+
+def resolve_write_policy(policy=None,name=None):
+    """
+    Return the `HDF5WritePolicy` to use for dataset `name` given `policy`,
+    which may be None (use `default_write_policy`), a key of
+    `hdf5_write_policies`, an `HDF5WritePolicy`, or a dict mapping fnmatch
+    patterns of dataset names to either of those.
+    """
+    if policy is None:
+        policy = default_write_policy
+    if isinstance(policy,dict):
+        for pattern,pol in policy.items():
+            if name is not None and fnmatch.fnmatchcase(name,pattern):
+                return resolve_write_policy(pol,name)
+        return resolve_write_policy(policy.get('*'),name)
+    if isinstance(policy,HDF5WritePolicy):
+        return policy
+    try:
+        return hdf5_write_policies[policy]
+    except KeyError:
+        raise ValueError("unknown HDF5 write policy '" + str(policy) + "', options are: " + ", ".join(hdf5_write_policies))
+
+def dump_hdf5(ds,fpath,open_mode='a',policy=None):
     with h5py.File(fpath, open_mode) as f:
         for k,v in ds.items():
             print("dumping item: " + k)
@@ -80,12 +238,12 @@ def dump_hdf5(ds,fpath,open_mode='a'):
                 v = v.m
             except:
                 units = False
-            if type(v) is ndarray:
+            if type(v) is np.ndarray:
                 h5_ds = f.create_dataset(k,
                                         v.shape,
                                         dtype=v.dtype,
                                         data=v,
-                                        compression='gzip',
+                                        **resolve_write_policy(policy,k).dataset_kwargs(v.shape,v.dtype)
                                         )
                 if units:
                     h5_ds.attrs['units'] = str(units)
@@ -110,12 +268,332 @@ def dump_hdf5(ds,fpath,open_mode='a'):
                     f.attrs[k] = v
         f.flush()
 
-def load_hdf5(fpath=None,dir=None,filter=None,sim_index=None):
+"""
+Append-mode HDF5 writer for streaming acquisition data to disk row-by-row (or
+block-by-block) while a scan is running. Datasets are created on first use as
+chunked, resizable arrays along their first axis, tagged with a 'units'
+attribute in the same format used by `dump_hdf5`, so files written with
+`HDF5StreamWriter` can be read back with `load_hdf5`. The file stays open for
+the whole run and is flushed every `flush_rows` appended rows and/or every
+`flush_interval` seconds, whichever comes first. Compression is set by
+`policy`, as in `dump_hdf5`. Datasets created on first use are `dtype`
+(float64 by default, so an integer first row, e.g. a step index, does not
+truncate the float rows after it); pass `dtype=None` to take the dtype of
+the first row/block, or call `create` to pick one per dataset.
+
+example:
+    with HDF5StreamWriter(fpath,open_mode='x') as w:
+        w.write_attrs({'Vx0':Vx0,'Vy0':Vy0})
+        for V in V_bias:
+            w.append('V_bias',V)
+            w.append('I',smu.measure_current())
+            w.extend('Vshg',daq_block)      # (n_samples,...) block
+"""
+class HDF5StreamWriter(object):
+
+    def __init__(self,fpath,open_mode='a',flush_rows=1000,flush_interval=5.0,
+        chunk_rows=None,policy=None,dtype='float64'):
+        self.fpath = fpath
+        self.dtype = dtype
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.chunk_rows = chunk_rows
+        self.policy = policy
+        self.f = h5py.File(fpath, open_mode)
+        self._units = {}
+        self._rows_since_flush = 0
+        self._t_last_flush = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def __contains__(self,name):
+        return name in self.f
+
+    def create(self,name,row_shape=(),dtype='float64',units=None,chunk_rows=None):
+        """
+        Create an empty resizable dataset `name` whose rows have shape
+        `row_shape`. Appending to a dataset that does not exist yet calls this
+        automatically with the shape and units of the first row/block and the
+        writer's `dtype` (the first row/block's dtype if that is None).
+        """
+        row_shape = tuple(row_shape)
+        policy = resolve_write_policy(self.policy,name)
+        if chunk_rows is None:
+            chunk_rows = self.chunk_rows
+        if chunk_rows is None:
+            # resizable datasets are always chunked, even if `policy` is unfiltered
+            chunks = auto_chunks((2**31,)+row_shape,dtype,access=policy.access,chunk_bytes=policy.chunk_bytes)
+        else:
+            chunks = (chunk_rows,)+row_shape
+        h5_ds = self.f.create_dataset(name,
+                                    (0,)+row_shape,
+                                    maxshape=(None,)+row_shape,
+                                    dtype=dtype,
+                                    chunks=chunks,
+                                    **policy.filter_kwargs()
+                                    )
+        if units is not None:
+            h5_ds.attrs['units'] = str(units)
+        self._units[name] = units
+        return h5_ds
+
+    def append(self,name,row):
+        """
+        Append a single row (scalar or array, optionally a pint Quantity) to
+        dataset `name`.
+        """
+        try:
+            units, row = row.units, row.m
+        except AttributeError:
+            units = None
+        row = np.asarray(row)
+        return self._extend(name,row.reshape((1,)+row.shape),units)
+
+    def extend(self,name,block):
+        """
+        Append a block of rows (array with leading row axis, optionally a pint
+        Quantity) to dataset `name`.
+        """
+        try:
+            units, block = block.units, block.m
+        except AttributeError:
+            units = None
+        block = np.asarray(block)
+        if block.ndim==0:
+            block = block.reshape((1,))
+        return self._extend(name,block,units)
+
+    def _extend(self,name,block,units):
+        if name not in self.f:
+            dtype = block.dtype if self.dtype is None else self.dtype
+            self.create(name,row_shape=block.shape[1:],dtype=dtype,units=units)
+        h5_ds = self.f[name]
+        ds_units = self._ds_units(name)
+        if ds_units is not None:
+            if units is None:
+                raise ValueError("unitless data appended to dataset '" + name + "' with units " + str(ds_units))
+            block = Q_(block,units).m_as(ds_units)
+        elif units is not None:
+            raise ValueError("data with units " + str(units) + " appended to unitless dataset '" + name + "'")
+        n_old, n_new = h5_ds.shape[0], block.shape[0]
+        h5_ds.resize(n_old+n_new,axis=0)
+        h5_ds[n_old:] = block
+        self._rows_since_flush += n_new
+        self._maybe_flush()
+        return h5_ds
+
+    def _ds_units(self,name):
+        if name not in self._units:
+            # dataset created before this writer opened the file (append mode)
+            h5_ds = self.f[name]
+            self._units[name] = h5_ds.attrs['units'] if 'units' in h5_ds.attrs else None
+        return self._units[name]
+
+    def write_attrs(self,ds):
+        """
+        Write non-array metadata (scalars, Quantities, strings, lists) as file
+        attributes, using the same conventions as `dump_hdf5`.
+        """
+        for k,v in ds.items():
+            try:
+                self.f.attrs[k] = v.m
+                self.f.attrs["_".join([k,"units"])] = str(v.units)
+            except AttributeError:
+                self.f.attrs[k] = v
+
+    def _maybe_flush(self):
+        if (self.flush_rows and self._rows_since_flush >= self.flush_rows) or \
+            (self.flush_interval is not None and (time.time()-self._t_last_flush) >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        self.f.flush()
+        self._rows_since_flush = 0
+        self._t_last_flush = time.time()
+
+    def close(self):
+        if self.f:
+            self.f.flush()
+            self.f.close()
+
+"""
+Background persistence service, so instruments don't sit idle while data is
+compressed and written to disk. Save jobs (any callable, plus shortcuts for
+`dump_hdf5` and `numpy.savetxt`) are put on bounded queues served by
+`n_workers` worker threads. All jobs for the same file go to the same worker,
+so they run in submission order (e.g. a `dump_hdf5(...,open_mode='x')` that
+creates a file always runs before later dumps appending to it), while
+different files may be written in parallel.
+
+`submit` returns a `concurrent.futures.Future` for the job. `flush()` blocks
+until every job submitted so far has finished and re-raises the first error
+raised by any of them. If a worker's queue is full, `submit` blocks until
+there is room (up to `timeout` seconds) and counts the stall in
+`n_backpressure`; with `block=False` it raises `SaveQueueFull` instead, so the
+caller can decide whether to wait, drop data or slow down acquisition.
+
+`dump_hdf5` and `savetxt` snapshot (deep-copy) their data when they are
+called, so the acquisition can keep appending to the same dicts and lists
+while they are written; pass `copy=False` to skip the copy when the data is
+not touched again. Jobs passed to `submit` hold references to their arguments,
+so don't modify those after submitting them. Pending jobs are flushed at
+interpreter exit.
+
+example:
+    saver = AsyncSaver()
+    saver.dump_hdf5(write_data,fpath)
+    read_data = scan_task.run(write_data)   # runs while write_data is saved
+    saver.dump_hdf5(read_data,fpath)
+    saver.flush()
+    ds = load_hdf5(fpath=fpath)
+"""
+class SaveQueueFull(queue.Full):
+    pass
+
+def _snapshot(data):
+    # copy taken in the submitting thread, so later appends don't reach the writer
+    return copy.deepcopy(data)
+
+class AsyncSaver(object):
+
+    def __init__(self,n_workers=1,maxsize=8,block=True,timeout=None,verbose=True):
+        self.block = block
+        self.timeout = timeout
+        self.verbose = verbose
+        self.n_backpressure = 0
+        self._queues = [queue.Queue(maxsize=maxsize) for ii in range(n_workers)]
+        self._pending = 0
+        self._errors = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._workers = [threading.Thread(target=self._work,args=(q,),daemon=True,
+                            name="AsyncSaver-{}".format(ii)) for ii,q in enumerate(self._queues)]
+        for w in self._workers:
+            w.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def submit(self,fpath,func,*args,**kwargs):
+        """
+        Queue `func(*args,**kwargs)`, which writes to `fpath`, on the worker
+        responsible for `fpath`.
+        """
+        if self._closed:
+            raise RuntimeError("AsyncSaver is closed")
+        job = Future()
+        item = (job,func,args,kwargs)
+        q = self._queues[hash(os.path.abspath(fpath)) % len(self._queues)]
+        with self._cond:
+            self._pending += 1
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            self.n_backpressure += 1
+            if not self.block:
+                self._job_done()
+                raise SaveQueueFull("save queue full ({} jobs) for: {}".format(q.maxsize,fpath))
+            if self.verbose:
+                print("save queue full, waiting to queue save to: " + str(fpath))
+            try:
+                q.put(item,timeout=self.timeout)
+            except queue.Full:
+                self._job_done()
+                raise SaveQueueFull("timed out waiting to queue save to: " + str(fpath))
+        return job
+
+    def dump_hdf5(self,ds,fpath,copy=True,**kwargs):
+        if copy:
+            ds = _snapshot(ds)
+        return self.submit(fpath,dump_hdf5,ds,fpath,**kwargs)
+
+    def savetxt(self,fpath,X,copy=True,**kwargs):
+        from numpy import savetxt
+        if copy:
+            X = _snapshot(X)
+        return self.submit(fpath,savetxt,fpath,X,**kwargs)
+
+    def _work(self,q):
+        while True:
+            item = q.get()
+            if item is None:
+                q.task_done()
+                return
+            job,func,args,kwargs = item
+            if job.set_running_or_notify_cancel():
+                try:
+                    job.set_result(func(*args,**kwargs))
+                except BaseException as e:
+                    if self.verbose:
+                        print("error in background save: " + repr(e))
+                    with self._cond:
+                        self._errors.append(e)
+                    job.set_exception(e)
+            q.task_done()
+            self._job_done()
+
+    def _job_done(self):
+        with self._cond:
+            self._pending -= 1
+            self._cond.notify_all()
+
+    def flush(self,timeout=None):
+        """
+        Wait for all jobs submitted so far to finish. Returns False if
+        `timeout` (seconds) expired first, otherwise True, after re-raising the
+        first error raised by a job since the last `flush`.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._pending==0,timeout=timeout):
+                return False
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+        return True
+
+    wait = flush
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for q in self._queues:
+            q.put(None)
+        for w in self._workers:
+            w.join()
+        atexit.unregister(self.close)
+
+def load_hdf5(fpath=None,dir=None,filter=None,sim_index=None,lazy=False,mmap=False,verbose=True):
+    """
+    Load datasets and attributes from HDF5 file `fpath` into a dict, wrapping
+    arrays with a 'units' attribute in pint Quantities.
+
+    With `lazy=True` no dataset is read: the file is left open and each dataset
+    is returned as an `HDF5LazyDataset` proxy that only reads the bytes selected
+    by slicing it (e.g. `ds['Dev1/ai0'][::100]`). The returned `HDF5LazyData`
+    dict should be closed (or used as a context manager) when done. With
+    `mmap=True` as well, uncompressed contiguous datasets are memory-mapped
+    with `numpy.memmap` instead of being read through h5py. `verbose=False`
+    suppresses the per-item progress messages.
+    """
     if fpath is None:
         # sim_id = ''.join(str(ind)+'-' for ind in self.param_index_combinations[sim_index])[:-1]
         file_list =  glob(os.path.normpath(dir)+os.path.normpath('/'+ sim_id + '*'))
         fpath = max(file_list,key=os.path.getctime)
-    print('loading file: ' + os.path.basename(fpath))
+    if verbose:
+        print('loading file: ' + os.path.basename(fpath))
     # with open(fpath, "rb") as f:
     #     ds = pickle.load(f)
     # for k,v in ds.items():
@@ -123,42 +601,237 @@ def load_hdf5(fpath=None,dir=None,filter=None,sim_index=None):
     #         ds[k] = u.Quantity.from_tuple(v)
     #     except:
     #         ds[k] = v
+    if lazy:
+        f = h5py.File(fpath, "r")
+        ds = HDF5LazyData(f)
+        _load_hdf5_file(f,ds,lazy=True,mmap=mmap,verbose=verbose)
+        return ds
     ds = {}
     with h5py.File(fpath, "r") as f:
-        for h5_ds_name in f:
+        _load_hdf5_file(f,ds,verbose=verbose)
+    return ds
+
+def _load_hdf5_file(f,ds,lazy=False,mmap=False,verbose=True):
+    for h5_ds_name in f:
+        if verbose:
             print('importing ' + h5_ds_name + '...')
-            ds[h5_ds_name] = _load_hdf5_item(f[h5_ds_name])
-        for key,val in f.attrs.items():
+        ds[h5_ds_name] = _load_hdf5_item(f[h5_ds_name],lazy=lazy,mmap=mmap)
+    for key,val in f.attrs.items():
+        if verbose:
             print('importing attr ' + key + '...')
-            # try:
-            #     ds[key] = u.Quantity.from_tuple(val)
-            # except:
-            #     ds[key] = val
-            if "_".join([key,"units"]) in f.attrs.keys():
-                units_str = str(f.attrs["_".join([key,"units"])])
+        # try:
+        #     ds[key] = u.Quantity.from_tuple(val)
+        # except:
+        #     ds[key] = val
+        if "_".join([key,"units"]) in f.attrs.keys():
+            units_str = str(f.attrs["_".join([key,"units"])])
+            if verbose:
                 print(units_str)
-                ds[key] = u.Quantity(val,units_str)
-            elif key.split("_")[-1]=="units":
-                pass
-            else:
-                ds[key] = val
+            ds[key] = u.Quantity(val,units_str)
+        elif key.split("_")[-1]=="units":
+            pass
+        else:
+            ds[key] = val
     return ds
 
-def _load_hdf5_item(item):
+def _load_hdf5_item(item,lazy=False,mmap=False):
     if issubclass(type(item),h5py.Group):
-        ds = {subname: _load_hdf5_item(item[subname]) for subname in item}
+        ds = {subname: _load_hdf5_item(item[subname],lazy=lazy,mmap=mmap) for subname in item}
         for key,val in item.attrs.items():
             try:
                 ds[key] = u.Quantity.from_tuple(val)
             except:
                 ds[key] = val
         return ds
+    elif lazy:
+        return HDF5LazyDataset(item,mmap=mmap)
     else:
         if 'units' in item.attrs:
             return Q_(item[()],item.attrs['units'])
         else:
             return item[()]
 
+"""
+Lazy, unit-aware access to datasets in an open HDF5 file, returned by
+`load_hdf5(...,lazy=True)`. Indexing an `HDF5LazyDataset` reads only the
+selected elements and wraps them in a Quantity if the dataset has units;
+`.m`, `.read()` or `[()]` read the full dataset. Attribute access not defined
+here (e.g. `.m_as`, `.to`, `.max`) falls through to the fully-read value.
+"""
+class HDF5LazyDataset(object):
+
+    def __init__(self,h5_ds,mmap=False):
+        self.h5_ds = h5_ds
+        self.name = h5_ds.name
+        self.shape = h5_ds.shape
+        self.dtype = h5_ds.dtype
+        self.ndim = len(h5_ds.shape)
+        self.units = h5_ds.attrs['units'] if 'units' in h5_ds.attrs else None
+        self._mm = _hdf5_memmap(h5_ds) if mmap else None
+
+    def __repr__(self):
+        return "<HDF5LazyDataset {} shape={} dtype={} units={}>".format(
+            self.name,self.shape,self.dtype,self.units)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self,key):
+        if self._mm is not None:
+            data = self._mm[key]
+        else:
+            data = self.h5_ds[key]
+        if self.units is not None:
+            return Q_(data,self.units)
+        return data
+
+    def __array__(self,dtype=None,copy=None):
+        data = self.read(units=False)
+        return data if dtype is None else data.astype(dtype)
+
+    def __getattr__(self,name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.read(),name)
+
+    @property
+    def mmapped(self):
+        return self._mm is not None
+
+    @property
+    def m(self):
+        return self.read(units=False)
+
+    def read(self,units=True):
+        data = self[()]
+        if not units and self.units is not None:
+            return data.m
+        return data
+
+def _hdf5_memmap(h5_ds):
+    """
+    Return a read-only `numpy.memmap` of dataset `h5_ds` if it is stored as a
+    single uncompressed contiguous block in its file, otherwise None.
+    """
+    if h5_ds.chunks is not None or h5_ds.compression is not None or \
+        h5_ds.dtype.hasobject or h5_ds.shape==() or h5_ds.size==0:
+        return None
+    offset = h5_ds.id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(h5_ds.file.filename,mode='r',dtype=h5_ds.dtype,
+                    offset=offset,shape=h5_ds.shape)
+
+class HDF5LazyData(dict):
+    """
+    dict of lazily-loaded datasets and attributes that keeps the underlying
+    HDF5 file open until `close()` is called or the `with` block exits.
+    """
+    def __init__(self,f):
+        super().__init__()
+        self.f = f
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def close(self):
+        if self.f:
+            self.f.close()
+
+"""
+Batch loading of selected datasets/attributes from many HDF5 files, e.g. every
+`GalvoScan_*` file in a sample directory, in parallel worker processes.
+Results are stacked along a new leading file axis, one array per key:
+
+    ds = load_many(sample_dir,keys=['Vshg_x_g','P_ex','θ_pol_hwp'],filter='GalvoScan*.h5')
+    ds['fpath']         # (n_files,) array of file paths
+    ds['Vshg_x_g']      # (n_files,ny,nx) Quantity, in units of the first file
+    ds['P_ex']          # (n_files,) Quantity
+
+Keys name datasets (with group paths, e.g. 'daq/t') or file attributes; with
+`keys=None` every dataset and attribute found in the first file is loaded.
+Keys whose values differ in shape between files, or that are missing from
+some files, are returned as lists (with None for missing values) instead of
+stacked arrays.
+
+`source` is a directory (files matching `filter`, oldest first), a list of file
+paths, or, if catalog query arguments such as `ds_type='GalvoScan'` or
+`sample='A'` are given, a data directory whose catalog (see
+`experiment_control.util.catalog`) is queried for the files. On Windows, call
+`load_many` with `n_workers>1` from under `if __name__=='__main__':` in
+scripts, as for any use of `multiprocessing`.
+"""
+def load_many(source,keys=None,filter="*.h5",n_workers=None,**query):
+    fpaths = _many_fpaths(source,filter,query)
+    if not fpaths:
+        return {'fpath':np.asarray([],dtype=object)}
+    if keys is None:
+        keys = _hdf5_keys(fpaths[0])
+    if n_workers==1 or len(fpaths)==1:
+        items = [_load_hdf5_keys(fp,keys) for fp in fpaths]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=n_workers) as ex:
+            items = list(ex.map(_load_hdf5_keys,fpaths,repeat(keys),chunksize=max(1,len(fpaths)//(4*(n_workers or os.cpu_count() or 1)))))
+    ds = {'fpath':np.asarray(fpaths,dtype=object)}
+    for key in keys:
+        ds[key] = _stack_items([it.get(key) for it in items])
+    return ds
+
+def _many_fpaths(source,filter,query):
+    if query:
+        from .catalog import find_catalog
+        catalog = find_catalog(source)
+        if catalog is None:
+            raise ValueError("no catalog found for " + str(source) + ", needed for query " + str(query))
+        catalog.refresh()
+        return catalog.query(filter=filter,newest_first=False,**query)
+    if isinstance(source,str):
+        return sorted([ff for ff in glob.glob(os.path.join(source,filter)) if os.path.isfile(ff)],key=os.path.getctime)
+    return list(source)
+
+def _hdf5_keys(fpath):
+    keys = []
+    with h5py.File(fpath,"r") as f:
+        f.visititems(lambda name,obj: keys.append(name) if isinstance(obj,h5py.Dataset) else None)
+        keys += [k for k in f.attrs if not (k.split("_")[-1]=="units" and k[:-len("_units")] in f.attrs)]
+    return keys
+
+def _load_hdf5_keys(fpath,keys):
+    # runs in worker processes: returns plain (magnitude, units string) tuples
+    # rather than Quantities, which don't pickle across unit registries
+    out = {}
+    with h5py.File(fpath,"r") as f:
+        for key in keys:
+            if key in f and isinstance(f[key],h5py.Dataset):
+                item = f[key]
+                out[key] = (item[()],str(item.attrs['units']) if 'units' in item.attrs else None)
+            elif key in f.attrs:
+                units_key = "_".join([key,"units"])
+                out[key] = (f.attrs[key],str(f.attrs[units_key]) if units_key in f.attrs else None)
+    return out
+
+def _stack_items(items):
+    present = [it for it in items if it is not None]
+    units = present[0][1] if present else None
+    vals = []
+    for it in items:
+        if it is None:
+            vals.append(None)
+        elif units is not None and it[1] is not None:
+            vals.append(Q_(it[0],it[1]).m_as(units))
+        else:
+            vals.append(it[0])
+    if len(present)==len(items) and len(set(np.asarray(v).shape for v in vals))==1:
+        vals = np.stack(vals)
+        return Q_(vals,units) if units is not None else vals
+    if units is not None:
+        return [Q_(v,units) if v is not None else None for v in vals]
+    return vals
+
 # def dump_params(self,fpath):
 #     p = dict(self.params)
 #     for k,v in p.items():
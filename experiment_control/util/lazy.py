@@ -0,0 +1,27 @@
+"""
+Deferred imports of heavy dependencies (numpy, h5py, pint, instrumental), so
+that importing `experiment_control.util` for a quick analysis shell or command
+line tool doesn't pay for modules it never uses. `benchmarks/import_time.py`
+checks the resulting startup time against a budget.
+"""
+
+import sys
+import importlib.util
+
+def lazy_import(name):
+    """
+    Return module `name`, deferring its actual import until one of its
+    attributes is first accessed. If the module is already imported it is
+    returned as-is. Raises ImportError right away if it isn't installed.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError("No module named '" + name + "'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
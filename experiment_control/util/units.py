@@ -1,6 +1,178 @@
-try:
-    from instrumental import Q_, u
-except:
-    from pint import UnitRegistry
-    u = UnitRegistry()
-    Q_ = u.Quantity
+"""
+Units for the whole package come from a single pint `UnitRegistry`, so that
+Quantities from different modules (and from instrumental's drivers) can be
+combined. That registry is pint's default registry, the one instrumental
+uses for `instrumental.u`, so it is the same whether or not (and whenever)
+instrumental is imported. `u` and `Q_` stand in for the registry and its
+Quantity class until they are first used, rather than building the registry
+at import, which takes a large part of a second. Once resolved, `units.u` and
+`units.Q_` are the registry and Quantity class themselves; the stand-ins
+imported before that keep working, including `isinstance(x,Q_)`.
+"""
+
+import sys
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+_registry = None
+
+def get_registry():
+    global _registry, u, Q_
+    if _registry is None:
+        import pint
+        # `instrumental.u` is pint's default registry; it is also pint's
+        # application registry, so pickled Quantities load into it
+        registry = getattr(pint,'_DEFAULT_REGISTRY',None)
+        if registry is None:
+            registry = pint.get_application_registry()
+        if 'instrumental' in sys.modules and sys.modules['instrumental'].u is not registry:
+            registry = sys.modules['instrumental'].u
+        _registry = registry
+        u, Q_ = registry, registry.Quantity
+    return _registry
+
+class _LazyRegistry(object):
+
+    def __getattr__(self,name):
+        return getattr(get_registry(),name)
+
+    def __call__(self,*args,**kwargs):
+        return get_registry()(*args,**kwargs)
+
+    def __repr__(self):
+        return "<lazy UnitRegistry ({})>".format("unresolved" if _registry is None else repr(_registry))
+
+class _LazyQuantityType(type):
+    # the stand-in for `Q_` is a class, so isinstance/issubclass and class
+    # attributes like __name__ work, all forwarded to the registry's Quantity
+
+    def __getattr__(cls,name):
+        return getattr(get_registry().Quantity,name)
+
+    def __call__(cls,*args,**kwargs):
+        return get_registry().Quantity(*args,**kwargs)
+
+    def __instancecheck__(cls,obj):
+        return isinstance(obj,get_registry().Quantity)
+
+    def __subclasscheck__(cls,subclass):
+        return issubclass(subclass,get_registry().Quantity)
+
+    def __repr__(cls):
+        return "<lazy Quantity class ({})>".format("unresolved" if _registry is None else repr(_registry.Quantity))
+
+class Quantity(metaclass=_LazyQuantityType):
+    pass
+
+u = _LazyRegistry()
+Q_ = Quantity
+
+"""
+Growable numpy buffer of values in a single unit, for collecting measurements
+in hot sampling loops without keeping a list of Quantity objects around.
+Values appended as Quantities are converted to the buffer's `units` on insert
+using a conversion factor (and offset, for e.g. degC -> K) that is computed
+once per source unit and cached; plain numbers are assumed to already be in
+`units`. Storage doubles when full, so appends are O(1) amortized.
+
+`.m` is a zero-copy view of the values collected so far and `.q` wraps the
+same view in a Quantity. Statistics are computed in numpy and returned as
+Quantities.
+
+example:
+    I = QuantityBuffer(u.A)
+    for ii in range(reps):
+        I.append(smu.measure_current())
+    I_mean, I_std = I.mean(), I.std()
+"""
+class QuantityBuffer(object):
+
+    def __init__(self,units,capacity=64,dtype=float,shape=()):
+        self.units = u.Unit(units) if isinstance(units,str) else units
+        self.shape = tuple(shape)
+        self._data = np.empty((max(1,capacity),)+self.shape,dtype=dtype)
+        self._n = 0
+        self._conversions = {}
+
+    def __len__(self):
+        return self._n
+
+    def __repr__(self):
+        return "<QuantityBuffer {} {} of {}>".format(self._n,self.units,self._data.dtype)
+
+    def __getitem__(self,key):
+        return Q_(self.m[key],self.units)
+
+    def __array__(self,dtype=None,copy=None):
+        return self.m if dtype is None else self.m.astype(dtype)
+
+    def _conversion(self,units):
+        # cached (scale, offset) such that value_in_self_units = scale*value + offset
+        try:
+            return self._conversions[units]
+        except KeyError:
+            offset = Q_(0.0,units).m_as(self.units)
+            scale = Q_(1.0,units).m_as(self.units) - offset
+            self._conversions[units] = (scale,offset)
+            return scale, offset
+
+    def _magnitude(self,value):
+        try:
+            units, value = value.units, value.magnitude
+        except AttributeError:
+            return value
+        if units==self.units:
+            return value
+        scale, offset = self._conversion(units)
+        value = np.asarray(value)*scale
+        return value + offset if offset else value
+
+    def _reserve(self,n):
+        if n > len(self._data):
+            capacity = max(n,2*len(self._data))
+            data = np.empty((capacity,)+self.shape,dtype=self._data.dtype)
+            data[:self._n] = self._data[:self._n]
+            self._data = data
+
+    def append(self,value):
+        self._reserve(self._n+1)
+        self._data[self._n] = self._magnitude(value)
+        self._n += 1
+
+    def extend(self,values):
+        if not hasattr(values,'units'):
+            values = [self._magnitude(v) for v in values]
+        values = np.asarray(self._magnitude(values))
+        n_new = len(values)
+        self._reserve(self._n+n_new)
+        self._data[self._n:self._n+n_new] = values
+        self._n += n_new
+
+    def clear(self):
+        self._n = 0
+
+    @property
+    def m(self):
+        return self._data[:self._n]
+
+    magnitude = m
+
+    @property
+    def q(self):
+        return Q_(self.m,self.units)
+
+    def m_as(self,units):
+        return self.q.m_as(units)
+
+    def mean(self,axis=0):
+        return Q_(self.m.mean(axis=axis),self.units)
+
+    def std(self,axis=0,ddof=0):
+        return Q_(self.m.std(axis=axis,ddof=ddof),self.units)
+
+    def min(self,axis=0):
+        return Q_(self.m.min(axis=axis),self.units)
+
+    def max(self,axis=0):
+        return Q_(self.m.max(axis=axis),self.units)